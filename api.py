@@ -1,6 +1,81 @@
 """
 API do Super Conciliador V2.6.1 - Mercado Livre -> Conta Azul
 
+VERSÃO 2.7.0 (em desenvolvimento):
+- PERFORMANCE: Resumos (pasta Resumo/) agregados em uma única passada vetorizada
+  para todos os livros - agregar_resumos()
+- PERFORMANCE: Leitura, conciliação e geração dos arquivos rodam em um pool de
+  processos (CONCILIADOR_WORKERS) com fila limitada (CONCILIADOR_FILA_MAX);
+  o event loop fica livre para /health e outras requisições
+- NOVO: Jobs assíncronos - POST /jobs, GET /jobs/{id} (progresso por fase) e
+  GET /jobs/{id}/result; resultados em disco com expiração (CONCILIADOR_JOBS_TTL)
+- PERFORMANCE: Cache LRU em disco do /conciliar por fingerprint (arquivos +
+  centro de custo + VERSAO_MOTOR); requisições idênticas simultâneas
+  compartilham a mesma execução (header X-Cache: HIT/MISS/COALESCED)
+- NOVO: Controle de admissão por memória - cada conciliação reserva o pico
+  estimado (tamanho e tipo dos relatórios, calibrado pelo pico de RSS medido)
+  dentro de CONCILIADOR_MEMORIA_MB; o excedente aguarda na fila ou recebe 503
+- NOVO: GET /metrics (formato Prometheus) - duração por fase e por escritor,
+  pico de memória, linhas lidas, lançamentos, fallbacks e divergências
+- NOVO: profile=true no /conciliar (habilitado via CONCILIADOR_PROFILING) - inclui
+  Profiling/ no ZIP com pstats, pilhas colapsadas (flamegraph) e pico de memória por fase
+- NOVO: header Server-Timing no /conciliar (parse, index, extrato, previsao, render,
+  zip, total) e X-Stats-Linhas-*, X-Stats-Divergencias e X-Stats-Pico-Memoria-MB
+- MELHORIA: cold start - o processo da API não importa pandas/numpy/openpyxl (/ e
+  /health respondem logo após o boot); os workers são criados e aquecidos em segundo
+  plano com uma conciliação sintética. Tempos de importação/aquecimento em /health
+- MELHORIA: eventos por linha (fallbacks, divergências, linhas do extrato corrigidas,
+  não classificados, erros) não são mais logados um a um - um coletor por conciliação
+  conta por tipo, guarda poucos exemplos e emite um único resumo no log;
+  CONCILIADOR_DIAGNOSTICOS_CSV=1 inclui o detalhe completo em Outros/DIAGNOSTICOS.csv
+- NOVO: POST /conciliar/lancamentos - mesma conciliação, retornando os lançamentos
+  como NDJSON (campo "livro" + campos do lançamento), sem gerar XLSX/CSV/OFX/ZIP;
+  transmitido livro a livro enquanto a conciliação roda (transmitir_ndjson), com
+  gzip na API (Accept-Encoding: gzip) e as estatísticas na última linha
+- NOVO: bench/ - gerador de relatórios sintéticos coerentes (10 mil a 5 milhões de
+  operações, com devoluções, chargebacks, IDs múltiplos e linhas quebradas) e
+  benchmark com tempo por fase e por escritor em JSON (bench/benchmark.py)
+- NOVO: bench/memoria.py - pico de RSS e de tracemalloc por etapa (leitura, fases da
+  conciliação, cada escritor) com orçamentos em bench/orcamentos_memoria.json
+- NOVO: bench/equivalencia.py - compara os livros de um motor candidato com
+  processar_conciliacao por ID de operação, com corpus de casos difíceis
+  (reembolso consolidado, IDs múltiplos, frete do vendedor, PIX interno)
+- NOVO: índice persistente de vendas (SQLite, CONCILIADOR_INDICE_VENDAS) - VENDAS e
+  PÓS-VENDA enviados são gravados por op_id; liberações de vendas de meses anteriores
+  buscam competência, frete e origem no índice, sem reenviar o VENDAS antigo
+- NOVO: motor DuckDB (CONCILIADOR_MOTOR=duckdb) - origem da venda, mapas do VENDAS e
+  PÓS-VENDA, breakdown do LIBERAÇÕES e seleção das previsões em SQL, embutido no
+  worker (paralelo, com spill em disco); mesmos lançamentos do motor pandas
+- NOVO: motor Polars (motor=polars) e escolha do motor por requisição (campo `motor`
+  do /conciliar, /conciliar/lancamentos e /jobs; padrão CONCILIADOR_MOTOR)
+- PERFORMANCE: por_mes=true - extrato particionado pelo mês da RELEASE_DATE; os mapas
+  são montados uma vez e os meses conciliados em paralelo em processos próprios
+  (CONCILIADOR_PROCESSOS_POR_MES); pasta_por_mes=true inclui Meses/AAAA-MM/ no ZIP
+- CORREÇÃO: ZIPs com CSVs sobrepostos (viradas de mês, mesmo CSV duas vezes) - linhas
+  já presentes em um CSV anterior do ZIP são removidas por hash das colunas-chave do
+  relatório (CHAVES_DEDUPLICACAO); removidas por CSV no log, diagnósticos e stats
+- PERFORMANCE: LIBERAÇÕES fora da memória - acima de CONCILIADOR_LIBERACOES_EM_DISCO_MB
+  o relatório é lido em partes e o breakdown por op_id vai para um SQLite temporário
+  (LiberacoesEmDisco), consultado por ID na conciliação; mesmos lançamentos
+- NOVO: relatórios em gzip, zstd, Parquet e Arrow IPC, detectados pelo magic number
+  (detectar_formato); gzip/zstd descompactados em stream direto para o pd.read_csv
+  (o extrato e ZIPs compactados são lidos para bytes), Parquet/Arrow lidos direto em DataFrame (zstandard e pyarrow opcionais)
+- NOVO: sessões de upload em partes (POST /uploads, PUT das partes com SHA-256,
+  GET para retomar, POST /uploads/{id}/finalizar cria o job) - uma queda de conexão
+  reenvia só a parte perdida, não o relatório inteiro
+- PERFORMANCE: origem da venda (ML/LOJA/BALCAO) calculada com filtros vetorizados
+  no MotorPandas e categoria de receita atribuída em bloco por uma coluna categórica
+  (categorias_receita) para os IDs do extrato e das previsões; stats['origens'] via
+  value_counts
+- NOVO: POST /conciliar/diferencas - refaz a conciliação com relatórios reemitidos e
+  retorna só os lançamentos adicionados, removidos e alterados em relação a um ZIP
+  anterior ou a um job (diferencas_resultados, chave Categoria + Descrição + ocorrência
+  numerada pelo conteúdo; lançamentos idênticos são pareados antes dos alterados)
+- NOVO: OFX incremental (ofx_incremental=true) - registro em SQLite dos FITIDs já
+  exportados por centro de custo (RegistroOfx); o OFX traz só as transações novas,
+  com FITID estável (fitids_estaveis), e LEDGERBAL segue saldo inicial + total. Os
+  FITIDs são gravados só depois que o ZIP é entregue (entregar_registrando_ofx)
+
 VERSÃO 2.6.1 (2025-12-09):
 - CORREÇÃO: OFX agora considera o saldo inicial (INITIAL_BALANCE) do extrato
 - Saldo final do OFX = saldo inicial + soma das transações
@@ -32,8 +107,18 @@ VERSÃO 2.0 (base):
 - Tratamento correto de devoluções e chargebacks
 - Suporte a arquivos ZIP com múltiplos CSVs (para períodos longos)
 
-Endpoint:
+Endpoints:
     POST /conciliar - Recebe os relatórios CSV/ZIP e retorna um ZIP com os arquivos processados
+    POST /jobs - Mesmos relatórios, processados em background (retorna job_id)
+    GET /jobs/{job_id} - Status e progresso por fase do job
+    GET /jobs/{job_id}/result - ZIP do job concluído
+    POST /uploads - Abre uma sessão de upload em partes (relatórios muito grandes)
+    PUT /uploads/{sessao_id}/{relatorio}/{numero} - Envia uma parte (X-Checksum-SHA256)
+    GET /uploads/{sessao_id} - Partes já recebidas (para retomar o upload)
+    POST /uploads/{sessao_id}/finalizar - Monta os relatórios e cria o job
+    POST /conciliar/lancamentos - Lançamentos em NDJSON (sem gerar arquivos)
+    POST /conciliar/diferencas - Lançamentos adicionados/removidos/alterados vs. uma execução anterior
+    GET /metrics - Métricas no formato Prometheus
 
 Arquivos esperados (form-data) - Aceita CSV individual ou ZIP com múltiplos CSVs:
     - dinheiro: settlement report (obrigatório)
@@ -51,45 +136,238 @@ Fluxo de Cruzamento:
     5. PÓS-VENDA adiciona contexto de devoluções
 """
 
-import pandas as pd
-import numpy as np
+import time
+_inicio_importacao = time.perf_counter()
+
 import os
 import re
+import sys
+import importlib
+import importlib.metadata
+import importlib.util
 import io
 import zipfile
+import gzip
+import zlib
 import tempfile
 import shutil
+import pathlib
+import sqlite3
+import json
+import hashlib
+import uuid
 import logging
+import asyncio
+import functools
+import threading
+import multiprocessing
+import cProfile
+import pstats
+import tracemalloc
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
-from typing import Optional, Dict, List, Any, Tuple, Union
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import StreamingResponse
-from openpyxl import Workbook
-from openpyxl.styles import Font
+from typing import Optional, Dict, List, Any, Tuple, Union, Callable, Iterable, Iterator, AsyncIterator
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse
+
+# Segundos gastos importando cada módulo pesado neste processo (ver importar_modulo)
+TEMPOS_IMPORTACAO: Dict[str, float] = {}
+
+
+def importar_modulo(nome: str):
+    """Importa um módulo registrando o tempo da primeira importação em TEMPOS_IMPORTACAO"""
+    if nome in sys.modules:
+        return sys.modules[nome]
+    inicio = time.perf_counter()
+    modulo = importlib.import_module(nome)
+    TEMPOS_IMPORTACAO[nome] = round(time.perf_counter() - inicio, 3)
+    return modulo
+
+
+class ModuloTardio:
+    """
+    Substituto de `import <modulo> as <apelido>` que só importa no primeiro uso.
+
+    O processo da API (/, /health, filas, cache, jobs) não usa pandas/numpy - só os
+    workers do pool, que os carregam no aquecimento (aquecer_worker). No primeiro
+    acesso o apelido global é trocado pelo módulo real, sem custo nos acessos seguintes.
+    """
+
+    def __init__(self, nome: str, apelido: str):
+        self._nome = nome
+        self._apelido = apelido
+
+    def __getattr__(self, atributo: str):
+        modulo = importar_modulo(self._nome)
+        globals()[self._apelido] = modulo
+        return getattr(modulo, atributo)
+
+
+pd = ModuloTardio('pandas', 'pd')
+np = ModuloTardio('numpy', 'np')
 
 
 # ==============================================================================
 # FUNÇÕES PARA PROCESSAMENTO DE ZIP
 # ==============================================================================
 
+# Colunas que identificam uma linha de cada relatório na de-duplicação dos CSVs de
+# um ZIP (exportações de períodos sobrepostos, mesmo CSV incluído duas vezes).
+# Relatórios sem entrada aqui (retirada) usam todas as colunas.
+CHAVES_DEDUPLICACAO = {
+    'dinheiro': ['SOURCE_ID', 'TRANSACTION_TYPE', 'TRANSACTION_DATE', 'MONEY_RELEASE_DATE',
+                 'TRANSACTION_AMOUNT', 'REAL_AMOUNT', 'SHIPPING_FEE_AMOUNT'],
+    'vendas': ['Número da transação do Mercado Pago (operation_id)', 'Número da venda no Mercado Livre (order_id)',
+               'Valor do produto (transaction_amount)', 'Frete (shipping_cost)', 'Data da compra (date_created)',
+               'Data de liberação do dinheiro (date_released)', 'Status do envio (shipment_status)'],
+    'pos_venda': ['ID da transação (operation_id)', 'Motivo detalhado (reason_detail)',
+                  'Data de criação (date_created)'],
+    'liberacoes': ['DATE', 'SOURCE_ID', 'RECORD_TYPE', 'DESCRIPTION', 'NET_CREDIT_AMOUNT', 'NET_DEBIT_AMOUNT',
+                   'GROSS_AMOUNT', 'MP_FEE_AMOUNT', 'FINANCING_FEE_AMOUNT', 'SHIPPING_FEE_AMOUNT'],
+    'extrato': ['RELEASE_DATE', 'TRANSACTION_TYPE', 'REFERENCE_ID', 'TRANSACTION_NET_AMOUNT', 'PARTIAL_BALANCE'],
+}
+
+
 def is_zip_file(content: bytes) -> bool:
     """Verifica se o conteúdo é um arquivo ZIP pelo magic number"""
     return content[:4] == b'PK\x03\x04'
 
 
-def extrair_csvs_do_zip(zip_content: bytes, skip_rows: int = 0, clean_json: bool = False) -> pd.DataFrame:
+# Formatos aceitos além de CSV, pelo magic number do início do arquivo. gzip e zstd
+# são descompactados em stream direto para o pd.read_csv (ler_csv_arquivo); o leitor
+# do extrato e o de ZIP recebem os bytes descompactados. Parquet e Arrow IPC (arquivo
+# ou stream) viram DataFrame direto, sem parsing de CSV.
+ASSINATURAS_FORMATO = [
+    (b'PK\x03\x04', 'zip'),
+    (b'\x1f\x8b', 'gzip'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+    (b'PAR1', 'parquet'),
+    (b'ARROW1', 'arrow'),
+    (b'\xff\xff\xff\xff', 'arrow_stream'),
+]
+FORMATOS_COLUNARES = ('parquet', 'arrow', 'arrow_stream')
+MODULOS_FORMATO = {'zstd': 'zstandard', 'parquet': 'pyarrow', 'arrow': 'pyarrow', 'arrow_stream': 'pyarrow'}
+FATOR_COMPRESSAO = 5  # Descompactado/compactado estimado quando o formato não informa o tamanho
+
+
+def detectar_formato(inicio: bytes) -> str:
+    """'zip', 'gzip', 'zstd', 'parquet', 'arrow', 'arrow_stream' ou 'csv'"""
+    for assinatura, formato in ASSINATURAS_FORMATO:
+        if inicio.startswith(assinatura):
+            return formato
+    return 'csv'
+
+
+def formato_do_arquivo(caminho: str) -> str:
+    with open(caminho, 'rb') as f:
+        return detectar_formato(f.read(8))
+
+
+def importar_modulo_formato(formato: str):
+    """Módulo opcional do formato; ValueError (arquivo não suportado) se não estiver instalado"""
+    modulo = MODULOS_FORMATO[formato]
+    if importlib.util.find_spec(modulo) is None:
+        raise ValueError(f"Arquivo {formato} requer o pacote {modulo}, que não está instalado")
+    return importar_modulo(modulo)
+
+
+def abrir_relatorio(caminho: str, formato: Optional[str] = None):
+    """
+    Arquivo binário (com peek) do relatório; gzip e zstd são descompactados em
+    stream na leitura
+    """
+    formato = formato or formato_do_arquivo(caminho)
+    if formato == 'gzip':
+        return gzip.open(caminho, 'rb')
+    if formato == 'zstd':
+        zstandard = importar_modulo_formato('zstd')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(caminho, 'rb'), closefd=True))
+    return open(caminho, 'rb')
+
+
+def ler_relatorio_colunar(caminho: str, formato: str) -> 'pd.DataFrame':
+    """Parquet ou Arrow IPC -> DataFrame, com as colunas e os tipos gravados no arquivo"""
+    importar_modulo_formato(formato)
+    if formato == 'parquet':
+        return pd.read_parquet(caminho)
+    ipc = importar_modulo('pyarrow.ipc')
+    with open(caminho, 'rb') as f:
+        leitor = ipc.open_file(f) if formato == 'arrow' else ipc.open_stream(f)
+        return leitor.read_pandas()
+
+
+def partes_relatorio_colunar(caminho: str, formato: str, linhas_por_parte: int):
+    """DataFrames de até `linhas_por_parte` linhas de um Parquet ou Arrow IPC"""
+    importar_modulo_formato(formato)
+    if formato == 'parquet':
+        arquivo = importar_modulo('pyarrow.parquet').ParquetFile(caminho)
+        for lote in arquivo.iter_batches(batch_size=linhas_por_parte):
+            yield lote.to_pandas()
+        return
+    ipc = importar_modulo('pyarrow.ipc')
+    with open(caminho, 'rb') as f:
+        if formato == 'arrow':
+            leitor = ipc.open_file(f)
+            lotes = (leitor.get_batch(i) for i in range(leitor.num_record_batches))
+        else:
+            lotes = ipc.open_stream(f)
+        for lote in lotes:
+            for inicio in range(0, lote.num_rows, linhas_por_parte):
+                yield lote.slice(inicio, linhas_por_parte).to_pandas()
+
+
+def hash_linhas(df: 'pd.DataFrame', key: Optional[str] = None) -> 'np.ndarray':
+    """
+    Hash (uint64) de cada linha sobre as colunas-chave do relatório, normalizadas:
+    colunas numéricas (mesmo que lidas como texto em um dos CSVs) viram float
+    arredondado a 2 casas e as demais, texto sem espaços nas pontas - o mesmo valor
+    lido como 10000000000 em um CSV e "10000000000.0" em outro gera o mesmo hash.
+    """
+    colunas = [c for c in CHAVES_DEDUPLICACAO.get(key, ()) if c in df.columns] or list(df.columns)
+    normalizadas = {}
+    for coluna in colunas:
+        serie = df[coluna]
+        numeros = None
+        if pd.api.types.is_numeric_dtype(serie):
+            numeros = serie
+        elif pd.to_numeric(serie.dropna().head(100), errors='coerce').notna().all():
+            numeros = pd.to_numeric(serie, errors='coerce')
+            if numeros.isna().sum() != serie.isna().sum():
+                numeros = None  # Tem texto não numérico: compara como texto
+        if numeros is not None:
+            normalizadas[coluna] = numeros.astype('float64').round(2) + 0.0  # -0.0 -> 0.0
+        else:
+            normalizadas[coluna] = serie.astype(str).str.strip()
+    return pd.util.hash_pandas_object(pd.DataFrame(normalizadas), index=False).to_numpy()
+
+
+def extrair_csvs_do_zip(zip_content: bytes, skip_rows: int = 0, clean_json: bool = False,
+                        key: Optional[str] = None) -> 'pd.DataFrame':
     """
     Extrai todos os arquivos CSV de um ZIP e concatena em um único DataFrame.
 
+    Linhas de um CSV que já apareceram em um CSV anterior do mesmo ZIP (mesmo hash
+    das colunas-chave do relatório, ver CHAVES_DEDUPLICACAO) são descartadas antes
+    da concatenação; repetições dentro do mesmo CSV são mantidas. As linhas
+    removidas por CSV ficam em `attrs['linhas_duplicadas']` do resultado.
+
     Args:
         zip_content: Conteúdo binário do arquivo ZIP
         skip_rows: Número de linhas a pular no início de cada CSV
         clean_json: Se True, limpa campos JSON mal formatados
+        key: Tipo do relatório (define as colunas-chave da de-duplicação)
 
     Returns:
         DataFrame concatenado com todos os CSVs do ZIP
     """
     dataframes = []
+    hashes_vistos = np.empty(0, dtype=np.uint64)
+    linhas_duplicadas = {}
 
     with zipfile.ZipFile(io.BytesIO(zip_content), 'r') as zip_file:
         # Listar todos os arquivos no ZIP
@@ -124,7 +402,22 @@ def extrair_csvs_do_zip(zip_content: bytes, skip_rows: int = 0, clean_json: bool
                         index_col=False
                     )
 
-                    if not df.empty:
+                    if not df.empty and len(csv_files) > 1:
+                        # Sobreposição com os CSVs anteriores (hash das colunas-chave)
+                        hashes = hash_linhas(df, key)
+                        novas = ~np.isin(hashes, hashes_vistos)
+                        hashes_vistos = np.union1d(hashes_vistos, hashes)
+                        if not novas.all():
+                            linhas_duplicadas[csv_filename] = int(len(df) - novas.sum())
+                            logger.info(f"  - {csv_filename}: {len(df)} linhas, "
+                                        f"{linhas_duplicadas[csv_filename]} já presentes em outro CSV (removidas)")
+                            df = df[novas]
+                            if df.empty:
+                                continue
+                        else:
+                            logger.info(f"  - {csv_filename}: {len(df)} linhas")
+                        dataframes.append(df)
+                    elif not df.empty:
                         dataframes.append(df)
                         logger.info(f"  - {csv_filename}: {len(df)} linhas")
 
@@ -137,6 +430,7 @@ def extrair_csvs_do_zip(zip_content: bytes, skip_rows: int = 0, clean_json: bool
 
     # Concatenar todos os DataFrames
     resultado = pd.concat(dataframes, ignore_index=True)
+    resultado.attrs['linhas_duplicadas'] = linhas_duplicadas
     logger.info(f"Total após concatenação: {len(resultado)} linhas")
 
     return resultado
@@ -145,10 +439,27 @@ def extrair_csvs_do_zip(zip_content: bytes, skip_rows: int = 0, clean_json: bool
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Ciclo de vida da API: aquecimento do pool, limpeza periódica de jobs e encerramento do pool"""
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    await run_in_threadpool(limpar_jobs, ao_iniciar=True)
+    tarefa_limpeza = asyncio.create_task(loop_limpeza_jobs())
+    tarefa_aquecimento = asyncio.create_task(aquecer_pool()) if AQUECIMENTO_HABILITADO else None
+    yield
+    tarefa_limpeza.cancel()
+    if tarefa_aquecimento:
+        tarefa_aquecimento.cancel()
+    encerrar_pool()
+
+
 app = FastAPI(
     title="Super Conciliador API V2",
     description="API para conciliação de relatórios Mercado Livre com Conta Azul - Versão Melhorada",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 
@@ -179,6 +490,126 @@ CA_CATS = {
     'TRANSFERENCIA': "Transferências",
 }
 
+# Origem da venda (MotorPandas.indexar_vendas) -> categoria de receita; IDs sem
+# origem conhecida são LOJA (ver categorias_receita)
+ORIGENS_VENDA = ('ML', 'LOJA', 'BALCAO')
+CATEGORIA_RECEITA_POR_ORIGEM = {
+    'ML': CA_CATS['RECEITA_ML'],
+    'LOJA': CA_CATS['RECEITA_LOJA'],
+    'BALCAO': CA_CATS['RECEITA_BALCAO'],
+}
+
+# Pool de processos para o trabalho pesado (leitura, conciliação e geração de arquivos)
+# POOL_WORKERS: conciliações processadas em paralelo
+# POOL_FILA_MAX: conciliações aguardando worker livre (acima disso: 503 + Retry-After)
+# POOL_TAREFAS_POR_WORKER: recicla o worker após N conciliações (devolve memória ao SO; 0 = nunca)
+POOL_WORKERS = int(os.environ.get('CONCILIADOR_WORKERS', '2'))
+POOL_FILA_MAX = int(os.environ.get('CONCILIADOR_FILA_MAX', '4'))
+POOL_TAREFAS_POR_WORKER = int(os.environ.get('CONCILIADOR_TAREFAS_POR_WORKER', '10'))
+POOL_RETRY_AFTER = int(os.environ.get('CONCILIADOR_RETRY_AFTER', '30'))
+
+# Controle de admissão por memória: cada conciliação reserva sua estimativa de pico
+# antes de entrar no pool. MEMORIA_ORCAMENTO_MB é a memória disponível para as
+# conciliações (limite do container menos a API e os workers ociosos).
+# Estimativa = MEMORIA_BASE + correção * Σ(bytes do relatório * fator do relatório);
+# a correção é recalibrada a cada execução com o pico de RSS medido no worker.
+MEMORIA_ORCAMENTO_BYTES = int(float(os.environ.get('CONCILIADOR_MEMORIA_MB', '250')) * 1024 * 1024)
+MEMORIA_ESPERA_MAX = float(os.environ.get('CONCILIADOR_MEMORIA_ESPERA', '30'))  # segundos na fila antes do 503
+MEMORIA_BASE = 30 * 1024 * 1024
+FATORES_MEMORIA = {
+    # Bytes de memória por byte de CSV (descompactado), medidos com dados sintéticos.
+    # O EXTRATO domina: cada linha vira lançamentos e células nos XLSX de saída.
+    'extrato': 60,
+    'dinheiro': 20,
+    'liberacoes': 10,
+    'vendas': 10,
+    'pos_venda': 5,
+    'retirada': 2,
+}
+
+# Versão da lógica de conciliação - incrementar ao mudar regras de classificação/valores
+# (faz parte da chave do cache de resultados)
+VERSAO_MOTOR = "2.7.0"
+
+# Cache de resultados do /conciliar (requisições idênticas); CACHE_MAX_MB=0 desativa
+CACHE_DIR = os.environ.get('CONCILIADOR_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'conciliador_cache'))
+CACHE_MAX_BYTES = int(float(os.environ.get('CONCILIADOR_CACHE_MAX_MB', '200')) * 1024 * 1024)
+
+# Índice persistente de vendas/pós-vendas (SQLite): liberações de vendas de meses
+# anteriores encontram a venda sem reenviar o VENDAS antigo. Vazio desativa.
+INDICE_VENDAS_PATH = os.environ.get('CONCILIADOR_INDICE_VENDAS',
+                                    os.path.join(tempfile.gettempdir(), 'conciliador_indice', 'vendas.sqlite3'))
+
+# Registro das transações já exportadas em OFX, por conta (SQLite): com
+# ofx_incremental o OFX traz só as transações ainda não exportadas. Vazio desativa.
+OFX_EXPORTADOS_PATH = os.environ.get('CONCILIADOR_OFX_EXPORTADOS',
+                                     os.path.join(tempfile.gettempdir(), 'conciliador_indice', 'ofx_exportados.sqlite3'))
+
+# LIBERAÇÕES acima deste tamanho (descompactado) não viram DataFrame: são lidas em
+# partes e o breakdown por op_id vai para um SQLite temporário (LiberacoesEmDisco),
+# consultado pela conciliação. 0 desativa.
+LIBERACOES_EM_DISCO_BYTES = int(float(os.environ.get('CONCILIADOR_LIBERACOES_EM_DISCO_MB', '20')) * 1024 * 1024)
+LIBERACOES_EM_DISCO_DIR = os.environ.get('CONCILIADOR_LIBERACOES_EM_DISCO_DIR',
+                                         os.path.join(tempfile.gettempdir(), 'conciliador_liberacoes'))
+LIBERACOES_LINHAS_POR_PARTE = 50_000  # Linhas do CSV por DataFrame na leitura em partes
+LIBERACOES_CACHE_IDS = 4096  # IDs com o breakdown em memória (LRU) durante a conciliação
+
+# Motor padrão das junções da conciliação (ver MOTORES_CONCILIACAO): 'pandas',
+# 'duckdb' ou 'polars'; o campo `motor` da requisição tem precedência.
+# O DuckDB roda embutido no worker; acima do limite de memória faz spill em disco.
+MOTOR_PADRAO = os.environ.get('CONCILIADOR_MOTOR', 'pandas').strip().lower()
+DUCKDB_MEMORIA_MB = int(os.environ.get('CONCILIADOR_DUCKDB_MEMORIA_MB', '0'))  # 0 = padrão do DuckDB
+DUCKDB_THREADS = int(os.environ.get('CONCILIADOR_DUCKDB_THREADS', '0'))  # 0 = todos os núcleos
+DUCKDB_TEMP_DIR = os.environ.get('CONCILIADOR_DUCKDB_TEMP_DIR',
+                                 os.path.join(tempfile.gettempdir(), 'conciliador_duckdb'))
+
+# Conciliação particionada por mês do extrato (por_mes=true): processos que
+# conciliam os meses em paralelo dentro do worker, e a memória estimada de cada um
+# (interpretador + pandas + cópia dos mapas) somada à reserva da conciliação
+PROCESSOS_POR_MES = int(os.environ.get('CONCILIADOR_PROCESSOS_POR_MES', '2'))
+MEMORIA_PROCESSO_MES = 100 * 1024 * 1024
+
+# Fases do pipeline, na ordem em que são executadas (usadas no progresso dos jobs)
+FASES_PIPELINE = ['leitura', 'indexacao', 'liberacoes', 'extrato', 'previsoes', 'arquivos', 'zip']
+
+# Header Server-Timing do /conciliar: (métrica, fases somadas, descrição)
+SERVER_TIMING_FASES = [
+    ('parse', ['leitura'], 'Leitura dos relatorios'),
+    ('index', ['indexacao', 'liberacoes'], 'Indexacao e liberacoes'),
+    ('extrato', ['extrato'], 'Extrato'),
+    ('previsao', ['previsoes'], 'Previsoes'),
+    ('render', ['arquivos'], 'Arquivos de saida'),
+    ('zip', ['zip'], 'Compactacao'),
+]
+
+# Jobs assíncronos (POST /jobs): resultados ficam em disco até expirar o TTL
+JOBS_DIR = os.environ.get('CONCILIADOR_JOBS_DIR', os.path.join(tempfile.gettempdir(), 'conciliador_jobs'))
+JOBS_TTL = int(os.environ.get('CONCILIADOR_JOBS_TTL', str(24 * 3600)))  # segundos
+JOBS_MAX_PENDENTES = int(os.environ.get('CONCILIADOR_JOBS_MAX_PENDENTES', '20'))
+JOBS_INTERVALO_LIMPEZA = 600  # segundos entre varreduras de jobs expirados
+
+# Sessões de upload em partes (POST /uploads): partes numeradas com checksum vão para
+# UPLOADS_DIR e a finalização monta os relatórios e cria um job
+UPLOADS_DIR = os.environ.get('CONCILIADOR_UPLOADS_DIR', os.path.join(tempfile.gettempdir(), 'conciliador_uploads'))
+UPLOADS_TTL = int(os.environ.get('CONCILIADOR_UPLOADS_TTL', str(24 * 3600)))  # segundos sem atividade
+UPLOADS_PARTE_MAX_BYTES = int(float(os.environ.get('CONCILIADOR_UPLOADS_PARTE_MAX_MB', '64')) * 1024 * 1024)
+UPLOADS_PARTES_MAX = 10_000  # Partes por relatório
+
+# Diagnósticos por conciliação (eventos por linha: fallbacks, divergências, linhas
+# corrigidas...): contagem por tipo + até DIAGNOSTICOS_AMOSTRAS exemplos no log.
+# DIAGNOSTICOS_CSV inclui o detalhe completo em Outros/DIAGNOSTICOS.csv no ZIP.
+DIAGNOSTICOS_AMOSTRAS = int(os.environ.get('CONCILIADOR_DIAGNOSTICOS_AMOSTRAS', '5'))
+DIAGNOSTICOS_CSV = os.environ.get('CONCILIADOR_DIAGNOSTICOS_CSV', '0').lower() in ('1', 'true', 'sim')
+
+# Aquecimento dos workers no startup (imports pesados + conciliação sintética)
+AQUECIMENTO_HABILITADO = os.environ.get('CONCILIADOR_AQUECIMENTO', '1').lower() in ('1', 'true', 'sim')
+
+# Profiling sob demanda (profile=true no /conciliar). Desligado por padrão: o
+# profiling deixa a conciliação várias vezes mais lenta e o tracemalloc aumenta
+# o consumo de memória (a reserva de memória é multiplicada por PROFILING_FATOR_MEMORIA)
+PROFILING_HABILITADO = os.environ.get('CONCILIADOR_PROFILING', '0').lower() in ('1', 'true', 'sim')
+PROFILING_FATOR_MEMORIA = 2
+
 # ==============================================================================
 # FUNÇÕES UTILITÁRIAS
 # ==============================================================================
@@ -232,38 +663,53 @@ def format_date(val) -> str:
         return ""
 
 
-def processar_conciliacao(arquivos: Dict[str, pd.DataFrame], centro_custo: str = "NETAIR") -> Dict[str, Any]:
+def ids_do_extrato(extrato: 'pd.DataFrame') -> 'pd.Series':
+    """Coluna ID do extrato (REFERENCE_ID sem o '.0' da leitura como número)"""
+    return extrato['REFERENCE_ID'].astype(str).str.replace('.0', '', regex=False).str.strip()
+
+
+def origens_venda(ids: 'pd.Series', map_origem_venda: Dict[str, str]) -> 'pd.Series':
+    """Coluna categórica (ORIGENS_VENDA) com a origem de cada ID; LOJA quando desconhecida"""
+    origem = ids.map(map_origem_venda).astype(pd.CategoricalDtype(ORIGENS_VENDA))
+    return origem.fillna('LOJA')
+
+
+def categorias_receita(ids: 'pd.Series', map_origem_venda: Dict[str, str]) -> Dict[str, str]:
     """
-    Processa a conciliação dos relatórios do Mercado Livre.
+    {op_id: categoria de receita} dos IDs de uma vez (linhas do extrato ou das
+    previsões): a categoria é trocada nas categorias da coluna de origem, não por linha.
+    """
+    categoria = origens_venda(ids, map_origem_venda).cat.rename_categories(CATEGORIA_RECEITA_POR_ORIGEM)
+    return dict(zip(ids, categoria))
 
-    NOVA LÓGICA V2:
-    1. EXTRATO é a fonte da verdade (o que realmente movimentou)
-    2. Para cada movimento do EXTRATO, busca detalhes no LIBERAÇÕES
-    3. LIBERAÇÕES tem o breakdown: receita, comissão, frete
-    4. VENDAS enriquece com dados do pedido
-    5. DINHEIRO EM CONTA é usado apenas para PREVISÕES (não liberados ainda)
 
-    Args:
-        arquivos: Dicionário com DataFrames dos relatórios
-        centro_custo: Centro de custo para os lançamentos (padrão: NETAIR)
+def indexar_relatorios(arquivos: Dict[str, 'pd.DataFrame'], motor: Optional[str] = None,
+                       indice_vendas: Optional['IndiceVendas'] = None,
+                       progresso: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    Fases 1 e 2 da conciliação: normaliza os IDs (coluna op_id) e monta os mapas
+    de origem da venda, VENDAS, PÓS-VENDA e LIBERAÇÕES com o motor escolhido.
 
     Returns:
-        Dicionário com os DataFrames processados e estatísticas
+        {'motor', 'origem_venda', 'vendas', 'pos_venda', 'liberacoes',
+         'vendas_do_indice' (IDs resolvidos pelo índice persistente; None sem índice),
+         'stats_indice'} - consumido por processar_conciliacao(indices=...)
     """
-
     dinheiro = arquivos['dinheiro']
     vendas = arquivos['vendas']
     pos_venda = arquivos['pos_venda']
     liberacoes = arquivos['liberacoes']
-    extrato = arquivos['extrato']
 
-    CENTRO_CUSTO = centro_custo
+    def avancar_fase(fase: str):
+        if progresso:
+            progresso(fase)
 
     # ==============================================================================
     # FASE 1: PREPARAÇÃO E INDEXAÇÃO DOS DADOS
     # ==============================================================================
 
     logger.info("Fase 1: Preparando e indexando dados...")
+    avancar_fase('indexacao')
 
     # 1.1 Normalizar IDs em todos os DataFrames
     if 'SOURCE_ID' in dinheiro.columns:
@@ -275,128 +721,142 @@ def processar_conciliacao(arquivos: Dict[str, pd.DataFrame], centro_custo: str =
     if 'ID da transação (operation_id)' in pos_venda.columns:
         pos_venda['op_id'] = pos_venda['ID da transação (operation_id)'].apply(clean_id)
 
-    # 1.2 Criar mapa de ORIGEM da venda (ML, LOJA, BALCÃO)
-    map_origem_venda = {}
-
-    # Primeiro: se tem order_id do ML, é venda ML
-    if 'Número da venda no Mercado Livre (order_id)' in vendas.columns:
-        for _, row in vendas.iterrows():
-            op_id = clean_id(row.get('Número da transação do Mercado Pago (operation_id)', ''))
-            order_id = row.get('Número da venda no Mercado Livre (order_id)', '')
-            if op_id and pd.notna(order_id) and str(order_id).strip() not in ['', 'nan']:
-                map_origem_venda[op_id] = 'ML'
-
-    # Segundo: verifica SUB_UNIT no dinheiro
-    if 'SUB_UNIT' in dinheiro.columns:
-        for _, row in dinheiro.iterrows():
-            op_id = clean_id(row.get('SOURCE_ID', ''))
-            sub_unit = str(row.get('SUB_UNIT', '')).lower()
-            if op_id and op_id not in map_origem_venda:
-                if 'point' in sub_unit:
-                    map_origem_venda[op_id] = 'BALCAO'
-                else:
-                    map_origem_venda[op_id] = 'LOJA'
-
-    def get_categoria_receita(op_id: str) -> str:
-        """Retorna a categoria de receita baseada na origem da venda"""
-        origem = map_origem_venda.get(op_id, 'LOJA')
-        if origem == 'ML':
-            return CA_CATS['RECEITA_ML']
-        elif origem == 'BALCAO':
-            return CA_CATS['RECEITA_BALCAO']
-        else:
-            return CA_CATS['RECEITA_LOJA']
-
-    # 1.3 Criar mapas de dados das VENDAS para enriquecimento
-    map_vendas = {}
-    for _, row in vendas.iterrows():
-        op_id = row.get('op_id', '')
-        if op_id:
-            map_vendas[op_id] = {
-                'valor_produto': safe_float(row.get('Valor do produto (transaction_amount)', 0)),
-                'frete_comprador': safe_float(row.get('Frete (shipping_cost)', 0)),
-                'descricao': str(row.get('Descrição da operação (reason)', '')),
-                'order_id': clean_id(row.get('Número da venda no Mercado Livre (order_id)', '')),
-                'data_venda': row.get('Data da compra (date_created)', ''),
-                'data_liberacao': row.get('Data de liberação do dinheiro (date_released)', ''),
-                'status_envio': str(row.get('Status do envio (shipment_status)', '')),
-            }
+    # 1.2 a 1.4: ORIGEM da venda (ML, LOJA, BALCÃO) e mapas do VENDAS e do PÓS-VENDA
+    # para enriquecimento (ver MotorPandas.indexar_vendas)
+    motor_conciliacao = criar_motor_conciliacao(motor)
+    map_origem_venda, map_vendas, map_pos_venda = motor_conciliacao.indexar_vendas(dinheiro, vendas, pos_venda)
 
-    # 1.4 Criar mapa do PÓS-VENDA para contexto de devoluções
-    # Também extraímos a data original da venda (operation_date_created) para casos
-    # onde a venda não está no relatório VENDAS mas está no AFTER_COLLECTION
-    map_pos_venda = {}
-    for _, row in pos_venda.iterrows():
-        op_id = clean_id(row.get('ID da transação (operation_id)', ''))
-        if op_id:
-            map_pos_venda[op_id] = {
-                'motivo': str(row.get('Motivo detalhado (reason_detail)', '')),
-                'data_venda_original': row.get('Data de criação da transação (operation_date_created)', ''),
-                'data_reclamacao': row.get('Data de criação (date_created)', ''),
+    # 1.5 Índice persistente: grava as vendas do upload e completa os mapas com as
+    # vendas de períodos anteriores (só para IDs ausentes deste upload)
+    stats_indice = None
+    if indice_vendas is not None:
+        try:
+            stats_indice = {
+                'vendas_novas': indice_vendas.registrar('vendas', map_vendas),
+                'pos_venda_novas': indice_vendas.registrar('pos_venda', map_pos_venda),
             }
+            map_vendas = MapaComIndice(map_vendas, lambda op_id: indice_vendas.buscar('vendas', op_id))
+            map_pos_venda = MapaComIndice(map_pos_venda, lambda op_id: indice_vendas.buscar('pos_venda', op_id))
+        except sqlite3.Error as e:
+            logger.warning(f"Índice de vendas indisponível ({indice_vendas.path}): {str(e)}")
+            indice_vendas = None
 
     # ==============================================================================
     # FASE 2: INDEXAR LIBERAÇÕES POR SOURCE_ID E DESCRIPTION
     # ==============================================================================
 
     logger.info("Fase 2: Indexando liberações...")
+    avancar_fase('liberacoes')
 
-    # Filtrar liberações válidas
-    if 'RECORD_TYPE' in liberacoes.columns:
-        liberacoes_filtrado = liberacoes[liberacoes['RECORD_TYPE'] != 'available_balance'].copy()
-    elif 'SOURCE_ID' in liberacoes.columns:
-        liberacoes_filtrado = liberacoes[liberacoes['SOURCE_ID'].notna()].copy()
+    # Liberações válidas por (SOURCE_ID, DESCRIPTION) - ver MotorPandas.indexar_liberacoes;
+    # LIBERAÇÕES fora da memória já foi indexado na leitura e é consultado por ID
+    if isinstance(liberacoes, LiberacoesEmDisco):
+        map_liberacoes = MapaLiberacoesEmDisco(liberacoes)
     else:
-        liberacoes_filtrado = liberacoes.copy()
+        map_liberacoes = motor_conciliacao.indexar_liberacoes(liberacoes)
 
-    # Mapa de liberações por (SOURCE_ID, DESCRIPTION)
-    # Estrutura: {op_id: {'payment': {...}, 'refund': [{...}, {...}], ...}}
-    map_liberacoes = {}
+    return {
+        'motor': motor_conciliacao,
+        'origem_venda': map_origem_venda,
+        'vendas': map_vendas,
+        'pos_venda': map_pos_venda,
+        'liberacoes': map_liberacoes,
+        'vendas_do_indice': map_vendas.do_indice if indice_vendas is not None else None,
+        'stats_indice': stats_indice,
+    }
 
-    for _, row in liberacoes_filtrado.iterrows():
-        op_id = clean_id(row.get('SOURCE_ID', ''))
-        if not op_id:
-            continue
 
-        desc = str(row.get('DESCRIPTION', '')).lower().strip()
-
-        # Extrair valores do LIBERAÇÕES
-        dados = {
-            'date': row.get('DATE', ''),
-            'gross_amount': safe_float(row.get('GROSS_AMOUNT', 0)),
-            'mp_fee': safe_float(row.get('MP_FEE_AMOUNT', 0)),
-            'financing_fee': safe_float(row.get('FINANCING_FEE_AMOUNT', 0)),
-            'shipping_fee': safe_float(row.get('SHIPPING_FEE_AMOUNT', 0)),
-            'net_credit': safe_float(row.get('NET_CREDIT_AMOUNT', 0)),
-            'net_debit': safe_float(row.get('NET_DEBIT_AMOUNT', 0)),
-        }
+def processar_conciliacao(arquivos: Dict[str, 'pd.DataFrame'], centro_custo: str = "NETAIR",
+                          progresso: Optional[Callable[[str], None]] = None,
+                          diagnosticos: Optional['DiagnosticosConciliacao'] = None,
+                          indice_vendas: Optional['IndiceVendas'] = None,
+                          motor: Optional[str] = None,
+                          indices: Optional[Dict[str, Any]] = None,
+                          ids_multiplos_extrato: Optional[set] = None,
+                          livros_prontos: Optional[Callable[[Dict[str, List[Dict]]], None]] = None) -> Dict[str, Any]:
+    """
+    Processa a conciliação dos relatórios do Mercado Livre.
+
+    NOVA LÓGICA V2:
+    1. EXTRATO é a fonte da verdade (o que realmente movimentou)
+    2. Para cada movimento do EXTRATO, busca detalhes no LIBERAÇÕES
+    3. LIBERAÇÕES tem o breakdown: receita, comissão, frete
+    4. VENDAS enriquece com dados do pedido
+    5. DINHEIRO EM CONTA é usado apenas para PREVISÕES (não liberados ainda)
 
-        # Calcular valor líquido
-        dados['net_amount'] = dados['net_credit'] - dados['net_debit']
+    Args:
+        arquivos: Dicionário com DataFrames dos relatórios
+        centro_custo: Centro de custo para os lançamentos (padrão: NETAIR)
+        progresso: Callback opcional chamado com o nome de cada fase ao iniciá-la
+                   (ver FASES_PIPELINE)
+        diagnosticos: Coletor dos eventos por linha (fallbacks, divergências, não
+                      classificados, erros). Sem coletor, um próprio é criado e
+                      resumido no log ao final.
+        indice_vendas: Índice persistente (IndiceVendas). As vendas e pós-vendas do
+                       upload são gravadas nele, e IDs ausentes do upload são
+                       buscados nele (competência, frete, origem).
+        motor: Motor das junções (MOTORES_CONCILIACAO); None usa MOTOR_PADRAO
+        indices: Mapas já montados por indexar_relatorios (pula as fases 1 e 2)
+        ids_multiplos_extrato: IDs com mais de uma linha no extrato inteiro - quando
+                               `extrato` é só uma parte dele (processar_conciliacao_por_mes)
+        livros_prontos: Callback opcional chamado com {livro: lançamentos} assim que
+                        os livros do extrato (confirmados, pagamentos, transferencias)
+                        ficam definitivos, antes das previsões (NDJSON em streaming)
 
-        # Calcular comissão total (MP + parcelamento)
-        dados['comissao_total'] = dados['mp_fee'] + dados['financing_fee']
+    Returns:
+        Dicionário com os DataFrames processados e estatísticas
+    """
 
-        if op_id not in map_liberacoes:
-            map_liberacoes[op_id] = {}
-
-        # Armazenar por tipo de descrição
-        # Alguns tipos podem ter múltiplos registros para o mesmo ID
-        if desc in ['refund', 'chargeback', 'mediation', 'reserve_for_dispute']:
-            if desc not in map_liberacoes[op_id]:
-                map_liberacoes[op_id][desc] = []
-            map_liberacoes[op_id][desc].append(dados)
-        else:
-            # Payment geralmente é único
-            map_liberacoes[op_id][desc] = dados
+    dinheiro = arquivos['dinheiro']
+    extrato = arquivos['extrato']
+
+    CENTRO_CUSTO = centro_custo
+
+    resumir_diagnosticos = diagnosticos is None
+    if diagnosticos is None:
+        diagnosticos = DiagnosticosConciliacao()
+
+    def avancar_fase(fase: str):
+        if progresso:
+            progresso(fase)
+
+    # ==============================================================================
+    # FASES 1 E 2: PREPARAÇÃO E INDEXAÇÃO DOS DADOS (ver indexar_relatorios)
+    # ==============================================================================
+
+    if indices is None:
+        indices = indexar_relatorios(arquivos, motor=motor, indice_vendas=indice_vendas, progresso=progresso)
+    motor_conciliacao = indices.get('motor') or MotorPandas()
+    map_origem_venda = indices['origem_venda']
+    map_vendas = indices['vendas']
+    map_pos_venda = indices['pos_venda']
+    map_liberacoes = indices['liberacoes']
+    vendas_do_indice = indices['vendas_do_indice']
+    stats_indice = indices['stats_indice']
+
+    # Categoria de receita dos IDs do extrato e das previsões (categorias_receita),
+    # preenchida em bloco antes de cada fase
+    categorias_por_id = {}
+
+    def get_categoria_receita(op_id: str) -> str:
+        """Retorna a categoria de receita baseada na origem da venda"""
+        categoria = categorias_por_id.get(op_id)
+        if categoria is None:
+            categoria = CATEGORIA_RECEITA_POR_ORIGEM[map_origem_venda.get(op_id, 'LOJA')]
+        # Venda de período anterior (índice persistente): order_id do ML define a origem.
+        # Depende da busca sob demanda no índice, então fica por ID
+        if (categoria != CA_CATS['RECEITA_ML'] and vendas_do_indice is not None and op_id in map_vendas
+                and op_id in vendas_do_indice and map_vendas[op_id].get('order_id')):
+            categoria = CA_CATS['RECEITA_ML']
+        return categoria
 
     # ==============================================================================
     # FASE 3: IDENTIFICAR TRANSAÇÕES JÁ LIBERADAS (via LIBERAÇÕES)
     # ==============================================================================
 
-    # IDs que já aparecem no LIBERAÇÕES = já foram processados
-    ids_liberados = set(map_liberacoes.keys())
-    logger.info(f"Total de IDs com liberação: {len(ids_liberados)}")
+    # IDs que já aparecem no LIBERAÇÕES = já foram processados (as chaves de map_liberacoes)
+    total_ids_liberados = len(map_liberacoes)
+    logger.info(f"Total de IDs com liberação: {total_ids_liberados}")
 
     # ==============================================================================
     # FASE 4: PROCESSAR EXTRATO (FONTE DA VERDADE)
@@ -410,12 +870,18 @@ def processar_conciliacao(arquivos: Dict[str, pd.DataFrame], centro_custo: str =
     rows_transferencias = []
     rows_nao_classificados = []  # Para rastreabilidade
     rows_divergencias_fallback = []  # V2.5.1: IDs que usaram fallback com divergência
+    # Fallbacks de detalhamento (contados em `diagnosticos`):
+    #   sem_liberacao  - liberação sem payment no LIBERAÇÕES (detalhado via VENDAS)
+    #   assertiva_soma - ID múltiplo cuja soma detalhada não bateu com o extrato
+    #   reembolso_soma - reembolso cuja soma detalhada não bateu com o extrato
+    TIPOS_FALLBACK = ('sem_liberacao', 'assertiva_soma', 'reembolso_soma')
 
     # Preparar EXTRATO
     extrato['Valor'] = extrato['TRANSACTION_NET_AMOUNT'].apply(clean_float_extrato)
     extrato['Data'] = pd.to_datetime(extrato['RELEASE_DATE'], dayfirst=True, errors='coerce')
     extrato['DataStr'] = extrato['Data'].dt.strftime('%d/%m/%Y')
-    extrato['ID'] = extrato['REFERENCE_ID'].astype(str).str.replace('.0', '', regex=False).str.strip()
+    extrato['ID'] = ids_do_extrato(extrato)
+    categorias_por_id.update(categorias_receita(extrato['ID'], map_origem_venda))
 
     def criar_lancamento(op_id: str, data_competencia: str, categoria: str, valor: float,
                          descricao: str, observacoes: str, centro: str = CENTRO_CUSTO,
@@ -651,7 +1117,7 @@ def processar_conciliacao(arquivos: Dict[str, pd.DataFrame], centro_custo: str =
         else:
             # Fallback: não tem detalhes no LIBERAÇÕES
             # Tenta usar dados do VENDAS para detalhar
-            logger.info(f"op_id={op_id} sem detalhes em LIBERAÇÕES, usando fallback VENDAS")
+            diagnosticos.registrar('sem_liberacao', op_id=op_id)
 
             if op_id in map_vendas:
                 venda = map_vendas[op_id]
@@ -749,7 +1215,8 @@ def processar_conciliacao(arquivos: Dict[str, pd.DataFrame], centro_custo: str =
                 'Fonte_Original': 'VENDAS' if op_id not in map_liberacoes else 'LIBERACOES',
                 'Observacao': 'Usado valor direto do EXTRATO por divergência'
             })
-            logger.warning(f"op_id={op_id}: Divergência detectada! Extrato={valor_extrato:.2f}, Calculado={soma_lancamentos:.2f}. Usando valor do extrato.")
+            diagnosticos.registrar('divergencia_extrato', op_id=op_id, extrato=valor_extrato,
+                                   calculado=soma_lancamentos)
 
             # Substituir lançamentos pelo valor direto do extrato
             lancamentos = [criar_lancamento(
@@ -964,7 +1431,8 @@ def processar_conciliacao(arquivos: Dict[str, pd.DataFrame], centro_custo: str =
             # Nesse caso, retorna lista vazia para usar o fallback (valor direto)
             soma_lancamentos = sum(l['Valor'] for l in lancamentos)
             if abs(soma_lancamentos - valor_extrato) > 0.10:
-                logger.info(f"op_id={op_id}: soma lançamentos ({soma_lancamentos:.2f}) != extrato ({valor_extrato:.2f}), usando fallback")
+                diagnosticos.registrar('assertiva_soma', op_id=op_id, soma=soma_lancamentos,
+                                       extrato=valor_extrato)
                 return []  # Usar valor direto do extrato
 
         # =========================================================================
@@ -1025,10 +1493,14 @@ def processar_conciliacao(arquivos: Dict[str, pd.DataFrame], centro_custo: str =
     # ==============================================================================
 
     logger.info("Fase 5: Processando cada linha do EXTRATO...")
+    avancar_fase('extrato')
 
     # Identificar quais IDs têm múltiplas transações no extrato
-    ids_multiplos = extrato.groupby('ID').size()
-    ids_multiplos = set(ids_multiplos[ids_multiplos > 1].index)
+    if ids_multiplos_extrato is not None:
+        ids_multiplos = ids_multiplos_extrato
+    else:
+        ids_multiplos = extrato.groupby('ID').size()
+        ids_multiplos = set(ids_multiplos[ids_multiplos > 1].index)
     logger.info(f"IDs com múltiplas transações no extrato: {len(ids_multiplos)}")
 
     for idx, row in extrato.iterrows():
@@ -1228,6 +1700,7 @@ def processar_conciliacao(arquivos: Dict[str, pd.DataFrame], centro_custo: str =
                         soma_lanc = sum(l['Valor'] for l in lancamentos)
                         if abs(soma_lanc - val) > 0.10:
                             lancamentos = []
+                            diagnosticos.registrar('reembolso_soma', op_id=op_id, soma=soma_lanc, extrato=val)
 
                 # Fallback: comportamento anterior (valor direto em uma categoria)
                 if not lancamentos:
@@ -1371,6 +1844,7 @@ def processar_conciliacao(arquivos: Dict[str, pd.DataFrame], centro_custo: str =
                 'valor': val,
                 'data': data_str
             })
+            diagnosticos.registrar('nao_classificado', op_id=op_id, tipo=tipo_transacao, valor=val)
 
             rows_conta_azul_confirmados.append(criar_lancamento(
                 op_id, data_str, CA_CATS['OUTROS'], val,
@@ -1378,19 +1852,28 @@ def processar_conciliacao(arquivos: Dict[str, pd.DataFrame], centro_custo: str =
             ))
 
         except Exception as e:
-            logger.error(f"Erro processando linha {idx}: {str(e)}")
+            diagnosticos.registrar('erro_linha_extrato', linha=idx, erro=str(e))
             continue
 
     logger.info(f"Processadas {len(rows_conta_azul_confirmados)} transações confirmadas")
     logger.info(f"Transações não classificadas: {len(rows_nao_classificados)}")
+    if livros_prontos:
+        livros_prontos({'confirmados': rows_conta_azul_confirmados, 'pagamentos': rows_pagamento_conta,
+                        'transferencias': rows_transferencias})
 
     # ==============================================================================
     # FASE 6: PROCESSAR PREVISÕES (DINHEIRO EM CONTA não liberado)
     # ==============================================================================
 
     logger.info("Fase 6: Processando PREVISÕES (dinheiro não liberado)...")
+    avancar_fase('previsoes')
+
+    previsoes = motor_conciliacao.selecionar_previsoes(dinheiro, map_liberacoes)
+    motor_conciliacao.fechar()
+    if 'op_id' in previsoes.columns:
+        categorias_por_id.update(categorias_receita(previsoes['op_id'], map_origem_venda))
 
-    for _, row in dinheiro.iterrows():
+    for _, row in previsoes.iterrows():
         try:
             op_id = row.get('op_id', '')
             if not op_id:
@@ -1493,7 +1976,7 @@ def processar_conciliacao(arquivos: Dict[str, pd.DataFrame], centro_custo: str =
                     ))
 
         except Exception as e:
-            logger.error(f"Erro processando previsão op_id={op_id}: {str(e)}")
+            diagnosticos.registrar('erro_previsao', op_id=op_id, erro=str(e))
             continue
 
     logger.info(f"Processadas {len(rows_conta_azul_previsao)} previsões")
@@ -1503,23 +1986,15 @@ def processar_conciliacao(arquivos: Dict[str, pd.DataFrame], centro_custo: str =
     # ==============================================================================
 
     # Estatísticas de origem
-    origens_count = {'ML': 0, 'LOJA': 0, 'BALCAO': 0}
-    for origem in map_origem_venda.values():
-        origens_count[origem] = origens_count.get(origem, 0) + 1
-
-    # Log de transações não classificadas para debug
-    if rows_nao_classificados:
-        logger.warning(f"⚠️ {len(rows_nao_classificados)} transações não classificadas:")
-        for nc in rows_nao_classificados[:10]:  # Mostrar até 10
-            logger.warning(f"  - {nc['op_id']}: {nc['tipo']} = R$ {nc['valor']:.2f}")
-
-    # V2.5.1: Log de divergências encontradas
-    if rows_divergencias_fallback:
-        logger.warning(f"⚠️ {len(rows_divergencias_fallback)} IDs com divergência de valor (ver DIVERGENCIAS_FALLBACK.csv):")
-        for div in rows_divergencias_fallback[:5]:
-            logger.warning(f"  - {div['ID']}: Extrato={div['Valor_Extrato']:.2f}, Calculado={div['Valor_Calculado']:.2f}, Diff={div['Diferenca']:.2f}")
+    origens = pd.Series(list(map_origem_venda.values()), dtype=pd.CategoricalDtype(ORIGENS_VENDA))
+    origens_count = {origem: int(total) for origem, total in origens.value_counts(sort=False).items()}
 
-    return {
+    # Não classificados, divergências (ver DIVERGENCIAS_FALLBACK.csv) e fallbacks
+    # vão para um único resumo no log
+    if resumir_diagnosticos:
+        diagnosticos.resumir()
+
+    resultado = {
         'confirmados': rows_conta_azul_confirmados,
         'previsao': rows_conta_azul_previsao,
         'pagamentos': rows_pagamento_conta,
@@ -1533,10 +2008,24 @@ def processar_conciliacao(arquivos: Dict[str, pd.DataFrame], centro_custo: str =
             'transferencias': len(rows_transferencias),
             'nao_classificados': len(rows_nao_classificados),
             'divergencias_fallback': len(rows_divergencias_fallback),  # V2.5.1
+            'fallbacks': {tipo: diagnosticos.contagens.get(tipo, 0) for tipo in TIPOS_FALLBACK},
             'origens': origens_count,
-            'ids_com_liberacao': len(ids_liberados)
+            'ids_com_liberacao': total_ids_liberados
         }
     }
+    if stats_indice is not None:
+        stats_indice['vendas_do_indice'] = len(map_vendas.do_indice)
+        stats_indice['pos_venda_do_indice'] = len(map_pos_venda.do_indice)
+        resultado['stats']['indice_vendas'] = stats_indice
+        if not map_vendas.falhas and not map_pos_venda.falhas:
+            resultado['consultas_indice'] = {'vendas': map_vendas.consultas, 'pos_venda': map_pos_venda.consultas}
+    return resultado
+
+
+# Colunas do CSV de importação do Conta Azul (Outros/*.csv)
+COLUNAS_CSV_CONTA_AZUL = ['Data de Competência', 'Data de Vencimento', 'Data de Pagamento', 'Valor',
+                          'Categoria', 'Descrição', 'Cliente/Fornecedor', 'CNPJ/CPF Cliente/Fornecedor',
+                          'Centro de Custo', 'Observações']
 
 
 def gerar_csv_conta_azul(rows: List[Dict], output_path: str) -> bool:
@@ -1556,9 +2045,7 @@ def gerar_csv_conta_azul(rows: List[Dict], output_path: str) -> bool:
     df['Cliente/Fornecedor'] = "MERCADO LIVRE"
     df['CNPJ/CPF Cliente/Fornecedor'] = "03007331000141"
 
-    cols = ['Data de Competência', 'Data de Vencimento', 'Data de Pagamento', 'Valor',
-            'Categoria', 'Descrição', 'Cliente/Fornecedor', 'CNPJ/CPF Cliente/Fornecedor',
-            'Centro de Custo', 'Observações']
+    cols = COLUNAS_CSV_CONTA_AZUL
 
     for c in cols:
         if c not in df.columns:
@@ -1593,6 +2080,9 @@ def gerar_xlsx_completo(rows: List[Dict], output_path: str) -> bool:
         if c not in df.columns:
             df[c] = ""
 
+    from openpyxl import Workbook
+    from openpyxl.styles import Font
+
     wb = Workbook()
     ws = wb.active
     ws.title = "Importação Conta Azul"
@@ -1623,7 +2113,36 @@ def gerar_xlsx_completo(rows: List[Dict], output_path: str) -> bool:
     return True
 
 
-def gerar_ofx_mercadopago(rows: List[Dict], output_path: str, saldo_inicial: float = 0.0) -> bool:
+def transacoes_ofx(resultado: Dict[str, Any]) -> List[Dict]:
+    """Lançamentos que entram no OFX: confirmados + transferências + pagamentos"""
+    return resultado['confirmados'] + resultado['transferencias'] + resultado['pagamentos']
+
+
+def fitids_estaveis(df: 'pd.DataFrame') -> 'pd.Series':
+    """
+    FITID de cada transação do OFX que não depende da posição no arquivo: hash de
+    data de pagamento, valor, categoria e descrição (que começa pelo ID da operação),
+    mais a ocorrência entre transações idênticas. A mesma transação tem o mesmo FITID
+    em qualquer execução - base do OFX incremental (RegistroOfx).
+    """
+    chave = ['Data de Pagamento', 'Valor', 'Categoria', 'Descrição']
+    ocorrencia = df.groupby(chave, sort=False).cumcount()
+    textos = (df['Data de Pagamento'].astype(str) + '|' + df['Valor'].map('{:.2f}'.format) + '|'
+              + df['Categoria'].astype(str) + '|' + df['Descrição'].astype(str) + '|' + ocorrencia.astype(str))
+    return pd.Series([hashlib.md5(texto.encode()).hexdigest()[:20] for texto in textos], index=df.index)
+
+
+def fitids_transacoes_ofx(rows: List[Dict]) -> List[str]:
+    """FITIDs estáveis das transações que gerar_ofx_mercadopago escreve (valor não zerado)"""
+    if not rows:
+        return []
+    df = pd.DataFrame(rows)
+    df['Valor'] = df['Valor'].round(2)
+    return fitids_estaveis(df[df['Valor'] != 0]).tolist()
+
+
+def gerar_ofx_mercadopago(rows: List[Dict], output_path: str, saldo_inicial: float = 0.0,
+                          exportados: Optional[set] = None) -> bool:
     """
     Gera arquivo OFX no formato Money 2000 (versão 102) compatível com Mercado Pago.
 
@@ -1631,6 +2150,9 @@ def gerar_ofx_mercadopago(rows: List[Dict], output_path: str, saldo_inicial: flo
         rows: Lista de dicionários com as transações
         output_path: Caminho para salvar o arquivo OFX
         saldo_inicial: Saldo inicial do extrato (INITIAL_BALANCE)
+        exportados: OFX incremental - FITIDs já exportados (RegistroOfx). Os FITIDs
+            passam a ser estáveis (fitids_estaveis) e as transações já exportadas
+            ficam de fora; período e LEDGERBAL continuam sendo os de todas as transações
 
     Returns:
         True se o arquivo foi gerado com sucesso, False caso contrário
@@ -1651,6 +2173,11 @@ def gerar_ofx_mercadopago(rows: List[Dict], output_path: str, saldo_inicial: flo
     if df.empty:
         return False
 
+    transacoes = df
+    if exportados is not None:
+        df['FITID'] = fitids_estaveis(df)
+        transacoes = df[~df['FITID'].isin(exportados)]
+
     # Determinar período das transações
     datas = pd.to_datetime(df['Data de Pagamento'], format='%d/%m/%Y', errors='coerce')
     data_inicio = datas.min()
@@ -1709,7 +2236,7 @@ NEWFILEUID:NONE
 """
 
     # Transações
-    for idx, row in df.iterrows():
+    for idx, row in transacoes.iterrows():
         valor = row['Valor']
         descricao = str(row.get('Descrição', ''))[:255]
         data_pag = row.get('Data de Pagamento', '')
@@ -1723,8 +2250,11 @@ NEWFILEUID:NONE
         # Tipo: CREDIT para positivo, DEBIT para negativo
         trntype = 'CREDIT' if valor >= 0 else 'DEBIT'
 
-        # Gera um ID único baseado na descrição, valor e índice
-        fitid = hashlib.md5(f"{descricao}{valor}{idx}".encode()).hexdigest()[:20]
+        # Gera um ID único baseado na descrição, valor e índice (no incremental, o estável)
+        if exportados is not None:
+            fitid = row['FITID']
+        else:
+            fitid = hashlib.md5(f"{descricao}{valor}{idx}".encode()).hexdigest()[:20]
 
         # Limpar caracteres especiais do memo
         memo = descricao.replace('&', 'e').replace('<', '').replace('>', '').replace('"', '')
@@ -1759,40 +2289,77 @@ NEWFILEUID:NONE
     return True
 
 
-def gerar_xlsx_resumo(rows: List[Dict], output_path: str) -> bool:
-    """Gera arquivo XLSX com dados agrupados por Data de Pagamento e Categoria"""
-    if not rows:
-        return False
+def agregar_resumos(livros: Dict[str, List[Dict]]) -> Dict[str, 'pd.DataFrame']:
+    """
+    Agrega todos os livros de lançamentos por Data de Pagamento e Categoria em uma
+    única passada.
 
-    df = pd.DataFrame(rows)
+    Os livros são concatenados em um só DataFrame (coluna 'Livro'), as chaves de
+    agrupamento viram códigos inteiros (categorical) e soma/contagem/primeiro valor
+    saem de um único groupby com agregações nativas - sem lambdas por grupo.
 
-    if df.empty:
-        return False
+    Args:
+        livros: {nome_livro: lista de lançamentos} (ex: {'CONFIRMADOS': [...]})
+
+    Returns:
+        {nome_livro: DataFrame agrupado e ordenado por Data de Pagamento}, na mesma
+        ordem de `livros`. Livros sem lançamentos não aparecem no resultado.
+    """
+    frames = []
+    for nome, rows in livros.items():
+        if rows:
+            df_livro = pd.DataFrame(rows)
+            df_livro['Livro'] = nome
+            frames.append(df_livro)
 
+    if not frames:
+        return {}
+
+    df = pd.concat(frames, ignore_index=True)
     df['Valor'] = df['Valor'].round(2)
     df = df[df['Valor'] != 0]
-    df['Data de Vencimento'] = df['Data de Pagamento']
 
-    df['Cliente/Fornecedor'] = "MERCADO LIVRE"
-    df['CNPJ/CPF Cliente/Fornecedor'] = "03007331000141"
+    # Códigos inteiros para as chaves (categorias ordenadas = mesma ordem lexical do groupby)
+    chaves = ['Livro', 'Data de Pagamento', 'Categoria']
+    df = df.astype({c: 'category' for c in chaves})
+
+    df_grouped = df.groupby(chaves, observed=True, sort=True).agg(**{
+        'Data de Competência': ('Data de Competência', 'first'),
+        'Centro de Custo': ('Centro de Custo', 'first'),
+        'Valor': ('Valor', 'sum'),
+        'Quantidade': ('Valor', 'size'),
+    }).reset_index()
+    df_grouped = df_grouped.astype({c: object for c in chaves})
+
+    quantidade = df_grouped['Quantidade'].astype(str)
+    df_grouped['Data de Vencimento'] = df_grouped['Data de Pagamento']
+    df_grouped['Descrição'] = 'Resumo ' + quantidade + ' transações'
+    df_grouped['Observações'] = quantidade + ' lançamentos agrupados'
+    df_grouped['Cliente/Fornecedor'] = "MERCADO LIVRE"
+    df_grouped['CNPJ/CPF Cliente/Fornecedor'] = "03007331000141"
+
+    por_livro = dict(tuple(df_grouped.groupby('Livro', sort=False)))
+
+    resumos = {}
+    for nome, rows in livros.items():
+        if not rows:
+            continue
+        # Livro só com valores zerados gera resumo vazio (apenas cabeçalho)
+        df_livro = por_livro.get(nome, df_grouped.iloc[0:0])
+        resumos[nome] = df_livro.sort_values('Data de Pagamento', kind='stable').reset_index(drop=True)
 
-    df_grouped = df.groupby(['Data de Pagamento', 'Categoria'], as_index=False).agg({
-        'Data de Competência': 'first',
-        'Data de Vencimento': 'first',
-        'Valor': 'sum',
-        'Descrição': lambda x: f"Resumo {len(x)} transações",
-        'Cliente/Fornecedor': 'first',
-        'CNPJ/CPF Cliente/Fornecedor': 'first',
-        'Centro de Custo': 'first',
-        'Observações': lambda x: f"{len(x)} lançamentos agrupados"
-    })
+    return resumos
 
-    df_grouped = df_grouped.sort_values('Data de Pagamento')
 
+def gerar_xlsx_resumo_agrupado(df_grouped: 'pd.DataFrame', output_path: str) -> bool:
+    """Gera arquivo XLSX a partir de um resumo já agregado por agregar_resumos()"""
     cols = ['Data de Competência', 'Data de Vencimento', 'Data de Pagamento', 'Valor',
             'Categoria', 'Descrição', 'Cliente/Fornecedor', 'CNPJ/CPF Cliente/Fornecedor',
             'Centro de Custo', 'Observações']
 
+    from openpyxl import Workbook
+    from openpyxl.styles import Font
+
     wb = Workbook()
     ws = wb.active
     ws.title = "Importação Conta Azul"
@@ -1823,359 +2390,4016 @@ def gerar_xlsx_resumo(rows: List[Dict], output_path: str) -> bool:
     return True
 
 
+def gerar_xlsx_resumo(rows: List[Dict], output_path: str) -> bool:
+    """Gera arquivo XLSX com dados agrupados por Data de Pagamento e Categoria"""
+    resumos = agregar_resumos({'RESUMO': rows})
+    if 'RESUMO' not in resumos:
+        return False
+    return gerar_xlsx_resumo_agrupado(resumos['RESUMO'], output_path)
+
+
 # ==============================================================================
-# ENDPOINTS DA API
+# MÉTRICAS (tempos por fase e contadores - expostos em /metrics)
 # ==============================================================================
 
-@app.get("/")
-async def root():
-    """Endpoint de health check"""
-    return {
-        "status": "online",
-        "service": "Super Conciliador API",
-        "version": "1.0.0"
-    }
+BUCKETS_SEGUNDOS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BUCKETS_BYTES = tuple(mb * 1024 * 1024 for mb in (16, 32, 64, 128, 192, 256, 384, 512, 1024))
+
+# nome: (tipo, descrição, buckets)
+DEFINICOES_METRICAS = {
+    'conciliador_fase_duracao_segundos': (
+        'histogram', 'Duração de cada fase do pipeline de conciliação', BUCKETS_SEGUNDOS),
+    'conciliador_escrita_duracao_segundos': (
+        'histogram', 'Duração de cada escritor de arquivo de saída', BUCKETS_SEGUNDOS),
+    'conciliador_memoria_pico_bytes': (
+        'histogram', 'Pico de memória (RSS) medido no worker por conciliação', BUCKETS_BYTES),
+    'conciliador_linhas_processadas_total': (
+        'counter', 'Linhas lidas dos relatórios de entrada', None),
+    'conciliador_linhas_duplicadas_total': (
+        'counter', 'Linhas repetidas entre CSVs de um mesmo ZIP, removidas na leitura', None),
+    'conciliador_lancamentos_total': (
+        'counter', 'Lançamentos emitidos por livro', None),
+    'conciliador_fallbacks_total': (
+        'counter', 'Detalhamentos que caíram em fallback, por tipo', None),
+    'conciliador_divergencias_total': (
+        'counter', 'Liberações ajustadas pelo valor do extrato (DIVERGENCIAS_FALLBACK)', None),
+    'conciliador_nao_classificados_total': (
+        'counter', 'Linhas do extrato não classificadas', None),
+    'conciliador_diagnosticos_total': (
+        'counter', 'Eventos de diagnóstico por tipo (ver TIPOS_DIAGNOSTICO)', None),
+    'conciliador_execucoes_total': (
+        'counter', 'Execuções do pipeline por resultado', None),
+    'conciliador_requisicoes_total': (
+        'counter', 'Requisições de /conciliar por origem do resultado', None),
+    'conciliador_upload_partes_total': (
+        'counter', 'Partes recebidas nas sessões de upload, por resultado', None),
+}
 
 
-@app.post("/conciliar")
-async def conciliar(
-    dinheiro: UploadFile = File(..., description="Arquivo settlement (dinheiro em conta) - CSV ou ZIP"),
-    vendas: UploadFile = File(..., description="Arquivo collection (vendas) - CSV ou ZIP"),
-    pos_venda: UploadFile = File(..., description="Arquivo after_collection (pós venda) - CSV ou ZIP"),
-    liberacoes: UploadFile = File(..., description="Arquivo reserve-release (liberações) - CSV ou ZIP"),
-    extrato: UploadFile = File(..., description="Arquivo account_statement (extrato) - CSV ou ZIP"),
-    retirada: Optional[UploadFile] = File(None, description="Arquivo withdraw (retirada) - opcional - CSV ou ZIP"),
-    centro_custo: str = Form("NETAIR", description="Centro de custo para os lançamentos")
-):
+class MedicaoConciliacao:
     """
-    Processa os relatórios do Mercado Livre e retorna um ZIP com os arquivos de importação.
+    Tempos por fase e contadores de UMA execução do pipeline.
 
-    ## Arquivos de entrada (CSV ou ZIP):
-    Cada campo aceita um arquivo CSV individual OU um arquivo ZIP contendo múltiplos CSVs.
-    Quando um ZIP é enviado, todos os CSVs dentro dele são extraídos e concatenados automaticamente.
-    Isso é útil para períodos longos que geram múltiplos arquivos compactados.
+    Roda no worker; o resultado (como_dict) volta junto com a saída e é somado ao
+    RegistroMetricas do processo da API.
+    """
 
-    - **dinheiro**: settlement report (obrigatório) - CSV ou ZIP
-    - **vendas**: collection report (obrigatório) - CSV ou ZIP
-    - **pos_venda**: after_collection report (obrigatório) - CSV ou ZIP
-    - **liberacoes**: reserve-release report (obrigatório) - CSV ou ZIP
-    - **extrato**: account_statement report (obrigatório) - CSV ou ZIP
-    - **retirada**: withdraw report (opcional) - CSV ou ZIP
+    def __init__(self):
+        self.fases: Dict[str, float] = {}
+        self.escritas: List[Dict[str, Any]] = []
+        self.contadores: List[Dict[str, Any]] = []
+        self._fase_atual: Optional[str] = None
+        self._inicio_fase = 0.0
+
+    def iniciar_fase(self, fase: str):
+        """Encerra a fase sequencial atual (se houver) e inicia `fase`"""
+        self.encerrar_fase()
+        self._fase_atual = fase
+        self._inicio_fase = time.perf_counter()
+
+    def encerrar_fase(self):
+        if self._fase_atual is not None:
+            duracao = time.perf_counter() - self._inicio_fase
+            self.fases[self._fase_atual] = self.fases.get(self._fase_atual, 0.0) + duracao
+            self._fase_atual = None
+
+    @contextmanager
+    def fase(self, nome: str):
+        """Mede um trecho independente das fases sequenciais (ex: leitura_dinheiro)"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.fases[nome] = self.fases.get(nome, 0.0) + time.perf_counter() - inicio
+
+    @contextmanager
+    def escrita(self, escritor: str, arquivo: str):
+        """Mede um escritor de arquivo de saída (gerar_*)"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.escritas.append({'escritor': escritor, 'arquivo': arquivo,
+                                  'segundos': time.perf_counter() - inicio})
 
-    ## Parâmetros adicionais:
-    - **centro_custo**: Centro de custo para os lançamentos (padrão: NETAIR)
+    def contar(self, metrica: str, valor: float = 1, **labels):
+        self.contadores.append({'metrica': metrica, 'labels': labels, 'valor': valor})
 
-    ## Arquivos de saída (ZIP com pastas):
+    def registrar_stats(self, stats: Dict[str, Any]):
+        """Converte as estatísticas da conciliação em contadores"""
+        for livro in ('confirmados', 'previsao', 'pagamentos', 'transferencias'):
+            self.contar('conciliador_lancamentos_total', stats.get(livro, 0), livro=livro)
+        for tipo, quantidade in stats.get('fallbacks', {}).items():
+            self.contar('conciliador_fallbacks_total', quantidade, tipo=tipo)
+        self.contar('conciliador_divergencias_total', stats.get('divergencias_fallback', 0))
+        self.contar('conciliador_nao_classificados_total', stats.get('nao_classificados', 0))
 
-    ### Conta Azul/ (arquivos principais para importação)
-    - CONFIRMADOS.xlsx
-    - TRANSFERENCIAS.xlsx
-    - PAGAMENTO_CONTAS.xlsx
+    def como_dict(self) -> Dict[str, Any]:
+        self.encerrar_fase()
+        return {'fases': self.fases, 'escritas': self.escritas, 'contadores': self.contadores}
 
-    ### Resumo/ (agrupados por data e categoria)
-    - CONFIRMADOS_RESUMO.xlsx
-    - PREVISAO_RESUMO.xlsx
-    - TRANSFERENCIAS_RESUMO.xlsx
-    - PAGAMENTO_CONTAS_RESUMO.xlsx
 
-    ### Outros/ (CSVs e auxiliares)
-    - CONFIRMADOS.csv
-    - PREVISAO.csv
-    - PREVISAO.xlsx
-    - PAGAMENTO_CONTAS.csv
-    - TRANSFERENCIAS.csv
+class RegistroMetricas:
+    """
+    Histogramas e contadores acumulados no processo da API, exportados no formato
+    texto do Prometheus. Só é atualizado pelo event loop (sem locks).
     """
 
-    temp_dir = tempfile.mkdtemp()
-
-    try:
-        # Carregar DataFrames dos arquivos enviados
-        arquivos = {}
+    def __init__(self):
+        # (metrica, labels ordenados) -> valor (contador) ou [contagens por bucket, soma, total] (histograma)
+        self._series: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Any] = {}
+
+    def incrementar(self, metrica: str, valor: float = 1, **labels):
+        chave = (metrica, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        self._series[chave] = self._series.get(chave, 0) + valor
+
+    def observar(self, metrica: str, valor: float, **labels):
+        buckets = DEFINICOES_METRICAS[metrica][2]
+        chave = (metrica, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        serie = self._series.setdefault(chave, [[0] * len(buckets), 0.0, 0])
+        for i, limite in enumerate(buckets):
+            if valor <= limite:
+                serie[0][i] += 1
+        serie[1] += valor
+        serie[2] += 1
+
+    def registrar_execucao(self, metricas: Dict[str, Any], pico_memoria: Optional[int] = None):
+        """Soma as medições de uma execução (MedicaoConciliacao.como_dict)"""
+        for fase, segundos in metricas.get('fases', {}).items():
+            self.observar('conciliador_fase_duracao_segundos', segundos, fase=fase)
+        for escrita in metricas.get('escritas', []):
+            self.observar('conciliador_escrita_duracao_segundos', escrita['segundos'],
+                          escritor=escrita['escritor'], arquivo=escrita['arquivo'])
+        for contador in metricas.get('contadores', []):
+            self.incrementar(contador['metrica'], contador['valor'], **contador['labels'])
+        if pico_memoria:
+            self.observar('conciliador_memoria_pico_bytes', pico_memoria)
+        self.incrementar('conciliador_execucoes_total', resultado='sucesso')
+
+    def exportar(self) -> str:
+        """Formato de exposição texto do Prometheus (version 0.0.4)"""
+        def formatar_labels(labels, extra=()):
+            pares = list(labels) + list(extra)
+            if not pares:
+                return ''
+            escapados = []
+            for k, v in pares:
+                v = v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                escapados.append(f'{k}="{v}"')
+            return '{' + ','.join(escapados) + '}'
+
+        linhas = []
+        for metrica, (tipo, descricao, buckets) in DEFINICOES_METRICAS.items():
+            series = sorted((labels, valor) for (nome, labels), valor in self._series.items() if nome == metrica)
+            linhas.append(f'# HELP {metrica} {descricao}')
+            linhas.append(f'# TYPE {metrica} {tipo}')
+            for labels, valor in series:
+                if tipo == 'counter':
+                    linhas.append(f'{metrica}{formatar_labels(labels)} {valor}')
+                    continue
+                contagens, soma, total = valor
+                for limite, contagem in zip(buckets, contagens):
+                    linhas.append(f'{metrica}_bucket{formatar_labels(labels, [("le", repr(float(limite)))])} {contagem}')
+                linhas.append(f'{metrica}_bucket{formatar_labels(labels, [("le", "+Inf")])} {total}')
+                linhas.append(f'{metrica}_sum{formatar_labels(labels)} {soma}')
+                linhas.append(f'{metrica}_count{formatar_labels(labels)} {total}')
+        return '\n'.join(linhas) + '\n'
 
-        # Função auxiliar para ler CSV ou ZIP com detecção automática
-        async def ler_csv(upload_file: UploadFile, key: str, skip_rows: int = 0, clean_json: bool = False):
-            """
-            Lê um arquivo CSV ou ZIP contendo múltiplos CSVs.
-
-            Se o arquivo for um ZIP, extrai todos os CSVs e concatena em um único DataFrame.
-            Isso é útil quando períodos longos geram múltiplos arquivos compactados.
-            """
-            content = await upload_file.read()
-
-            # Verificar se é um arquivo ZIP
-            if is_zip_file(content):
-                logger.info(f"Arquivo '{key}' detectado como ZIP - extraindo e concatenando CSVs...")
-                return extrair_csvs_do_zip(content, skip_rows=skip_rows, clean_json=clean_json)
-
-            # Processar como CSV normal
-            content_str = content.decode('utf-8')
-
-            if clean_json:
-                # Remove campos JSON mal formatados (METADATA com aspas internas não escapadas)
-                # Pattern captura desde "{ até }" incluindo JSON aninhado
-                content_str = re.sub(r'"\{[^}]*(?:\{[^}]*\}[^}]*)*\}"', '""', content_str)
-
-            # Detectar separador automaticamente (verifica primeira linha após skip_rows)
-            lines = content_str.split('\n')
-            header_line = lines[skip_rows] if len(lines) > skip_rows else lines[0]
-
-            # Conta ocorrências de ; e , na linha de cabeçalho (fora de aspas)
-            sep = ';' if header_line.count(';') > header_line.count(',') else ','
-
-            return pd.read_csv(
-                io.StringIO(content_str),
-                sep=sep,
-                skiprows=skip_rows,
-                on_bad_lines='skip',
-                index_col=False
-            )
 
-        async def ler_extrato(upload_file: UploadFile) -> Tuple[pd.DataFrame, float]:
-            """
-            Lê o arquivo de extrato (account_statement) com tratamento especial para
-            linhas que têm campos extras devido a separadores no nome da empresa.
+metricas = RegistroMetricas()
 
-            O extrato tem 5 colunas:
-            RELEASE_DATE;TRANSACTION_TYPE;REFERENCE_ID;TRANSACTION_NET_AMOUNT;PARTIAL_BALANCE
 
-            Quando o TRANSACTION_TYPE contém ';', a linha fica com mais de 5 campos.
-            Esta função junta os campos extras no TRANSACTION_TYPE.
+# ==============================================================================
+# DIAGNÓSTICOS (eventos por linha agregados por conciliação)
+# ==============================================================================
 
-            Returns:
-                Tuple[DataFrame, float]: (DataFrame com transações, saldo_inicial)
-            """
-            content = await upload_file.read()
+# tipo: (nível do log, descrição)
+TIPOS_DIAGNOSTICO = {
+    'extrato_linha_corrigida': (logging.INFO, "Extrato: linha com campos extras corrigida"),
+    'extrato_linha_ignorada': (logging.WARNING, "Extrato: linha com menos de 5 campos ignorada"),
+    'zip_linhas_duplicadas': (logging.INFO, "ZIP: CSV com linhas já presentes em outro CSV (removidas)"),
+    'sem_liberacao': (logging.INFO, "Liberação sem detalhes em LIBERAÇÕES - detalhada via VENDAS"),
+    'assertiva_soma': (logging.INFO, "ID múltiplo com soma detalhada != extrato - usado valor direto"),
+    'reembolso_soma': (logging.INFO, "Reembolso com soma detalhada != extrato - usado valor direto"),
+    'divergencia_extrato': (logging.WARNING, "Divergência extrato x calculado - usado valor do extrato"),
+    'nao_classificado': (logging.WARNING, "Transação não classificada"),
+    'erro_linha_extrato': (logging.ERROR, "Erro processando linha do extrato"),
+    'erro_previsao': (logging.ERROR, "Erro processando previsão"),
+}
 
-            # Verificar se é ZIP
-            if is_zip_file(content):
-                logger.info("Arquivo 'extrato' detectado como ZIP - extraindo e concatenando CSVs...")
-                # Para ZIP, usar tratamento padrão por enquanto (sem saldo inicial)
-                return extrair_csvs_do_zip(content, skip_rows=3, clean_json=False), 0.0
 
-            content_str = content.decode('utf-8')
-            lines = content_str.split('\n')
+class DiagnosticosConciliacao:
+    """
+    Coletor dos eventos por linha de uma conciliação.
 
-            # Pular as 3 primeiras linhas (cabeçalho resumo)
-            # Linha 0: INITIAL_BALANCE;CREDITS;DEBITS;FINAL_BALANCE
-            # Linha 1: valores
-            # Linha 2: vazia
-            # Linha 3: cabeçalho das colunas (RELEASE_DATE;TRANSACTION_TYPE;...)
+    Substitui o log linha a linha nos laços do pipeline: cada evento só incrementa
+    a contagem do tipo e, até `max_amostras`, guarda os campos brutos (sem montar
+    mensagem). No fim, resumir() emite um único log; com `guardar_todos` o detalhe
+    completo vai para um CSV no ZIP de saída.
+    """
 
-            if len(lines) < 4:
-                raise ValueError("Arquivo de extrato inválido - menos de 4 linhas")
+    def __init__(self, max_amostras: int = DIAGNOSTICOS_AMOSTRAS, guardar_todos: bool = False):
+        self.max_amostras = max_amostras
+        self.guardar_todos = guardar_todos
+        self.contagens: Dict[str, int] = defaultdict(int)
+        self.amostras: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.eventos: List[Tuple[str, Dict[str, Any]]] = []
+
+    def registrar(self, tipo: str, /, **campos):
+        self.contagens[tipo] += 1
+        if len(self.amostras[tipo]) < self.max_amostras:
+            self.amostras[tipo].append(campos)
+        if self.guardar_todos:
+            self.eventos.append((tipo, campos))
+
+    def mesclar(self, outro: 'DiagnosticosConciliacao'):
+        """Soma os eventos de outro coletor (ex: de um processo de mês) a este"""
+        for tipo, total in outro.contagens.items():
+            self.contagens[tipo] += total
+            vagas = max(self.max_amostras - len(self.amostras[tipo]), 0)
+            self.amostras[tipo].extend(outro.amostras[tipo][:vagas])
+        if self.guardar_todos:
+            self.eventos.extend(outro.eventos)
+
+    @staticmethod
+    def _formatar(campos: Dict[str, Any]) -> str:
+        return ', '.join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in campos.items())
+
+    def resumir(self):
+        """Emite um único log com a contagem e os exemplos de cada tipo de evento"""
+        if not self.contagens:
+            return
+        linhas = []
+        nivel_max = logging.DEBUG
+        for tipo, total in sorted(self.contagens.items(), key=lambda item: -TIPOS_DIAGNOSTICO[item[0]][0]):
+            nivel, descricao = TIPOS_DIAGNOSTICO[tipo]
+            nivel_max = max(nivel_max, nivel)
+            exemplos = ' | '.join(self._formatar(c) for c in self.amostras[tipo])
+            linhas.append(f"  - {descricao}: {total}" + (f" (ex: {exemplos})" if exemplos else ""))
+        logger.log(nivel_max, "Diagnósticos da conciliação:\n" + "\n".join(linhas))
+
+    def gravar_csv(self, output_path: str) -> bool:
+        """Grava todos os eventos (requer guardar_todos) em CSV"""
+        if not self.eventos:
+            return False
+        df = pd.DataFrame([
+            {'Tipo': tipo, 'Nivel': logging.getLevelName(TIPOS_DIAGNOSTICO[tipo][0]),
+             'Descricao': TIPOS_DIAGNOSTICO[tipo][1], **campos}
+            for tipo, campos in self.eventos
+        ])
+        df.to_csv(output_path, sep=';', index=False, encoding='utf-8-sig')
+        return True
 
-            # Extrair saldo inicial da linha 1
-            saldo_inicial = 0.0
-            try:
-                valores_resumo = lines[1].strip().split(';')
-                if valores_resumo:
-                    # INITIAL_BALANCE está na primeira posição
-                    saldo_str = valores_resumo[0].replace('.', '').replace(',', '.')
-                    saldo_inicial = float(saldo_str)
-                    logger.info(f"Extrato: Saldo inicial = R$ {saldo_inicial:.2f}")
-            except (ValueError, IndexError) as e:
-                logger.warning(f"Extrato: Não foi possível extrair saldo inicial: {e}")
-
-            header = lines[3].strip().split(';')
-            expected_cols = 5  # RELEASE_DATE, TRANSACTION_TYPE, REFERENCE_ID, TRANSACTION_NET_AMOUNT, PARTIAL_BALANCE
-
-            data_rows = []
-            linhas_corrigidas = 0
-
-            for line_num, line in enumerate(lines[4:], start=5):
-                line = line.strip()
-                if not line:
-                    continue
 
-                campos = line.split(';')
-
-                if len(campos) == expected_cols:
-                    # Linha normal
-                    data_rows.append(campos)
-                elif len(campos) > expected_cols:
-                    # Linha com campos extras - juntar os extras no TRANSACTION_TYPE
-                    # campos[0] = RELEASE_DATE
-                    # campos[1:-3] = partes do TRANSACTION_TYPE
-                    # campos[-3] = REFERENCE_ID
-                    # campos[-2] = TRANSACTION_NET_AMOUNT
-                    # campos[-1] = PARTIAL_BALANCE
-                    extra_count = len(campos) - expected_cols
-                    transaction_type_parts = campos[1:2+extra_count]
-                    transaction_type = ' '.join(transaction_type_parts)
-
-                    fixed_row = [
-                        campos[0],                    # RELEASE_DATE
-                        transaction_type,             # TRANSACTION_TYPE (juntado)
-                        campos[-3],                   # REFERENCE_ID
-                        campos[-2],                   # TRANSACTION_NET_AMOUNT
-                        campos[-1]                    # PARTIAL_BALANCE
-                    ]
-                    data_rows.append(fixed_row)
-                    linhas_corrigidas += 1
-                    logger.info(f"Extrato linha {line_num}: corrigida ({len(campos)} campos -> 5)")
-                else:
-                    # Linha com menos campos que o esperado - ignorar
-                    logger.warning(f"Extrato linha {line_num}: ignorada ({len(campos)} campos < 5)")
+# ==============================================================================
+# ÍNDICE PERSISTENTE DE VENDAS (SQLite)
+# ==============================================================================
+#
+# Uma liberação deste mês pode ser de uma venda de meses anteriores. Sem o VENDAS
+# daquele mês, a competência cai na data do extrato e o frete do vendedor se perde.
+# O índice guarda (append-only, chave op_id) as vendas e pós-vendas de todos os
+# uploads; a conciliação consulta o índice só para IDs ausentes do upload atual.
+
+# Campos guardados por tabela - os mesmos de map_vendas / map_pos_venda
+CAMPOS_INDICE_VENDAS = {
+    'vendas': ['valor_produto', 'frete_comprador', 'descricao', 'order_id',
+               'data_venda', 'data_liberacao', 'status_envio'],
+    'pos_venda': ['motivo', 'data_venda_original', 'data_reclamacao'],
+}
+CAMPOS_NUMERICOS_INDICE = {'valor_produto', 'frete_comprador'}
 
-            if linhas_corrigidas > 0:
-                logger.info(f"Extrato: {linhas_corrigidas} linha(s) com campos extras foram corrigidas")
 
-            df = pd.DataFrame(data_rows, columns=header[:expected_cols])
-            return df, saldo_inicial
+class IndiceVendas:
+    """
+    Índice de vendas/pós-vendas em SQLite (um arquivo compartilhado pelos workers,
+    em modo WAL). Cada op_id é gravado uma única vez (INSERT OR IGNORE), então a
+    linha de um op_id nunca muda depois de gravada. `somente_leitura` abre o arquivo
+    com mode=ro (não cria, não grava) - usado pela API fora dos workers.
+    """
 
-        # Carregar arquivos obrigatórios
-        try:
-            arquivos['dinheiro'] = await ler_csv(dinheiro, 'dinheiro', clean_json=True)
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Erro ao processar arquivo 'dinheiro': {str(e)}")
+    LOTE_CONSULTA = 500  # op_ids por consulta (limite de parâmetros do SQLite)
+
+    def __init__(self, path: str, somente_leitura: bool = False):
+        self.path = path
+        self.somente_leitura = somente_leitura
+        self._conexao: Optional[sqlite3.Connection] = None
+
+    def conectar(self) -> sqlite3.Connection:
+        if self._conexao is None and self.somente_leitura:
+            self._conexao = sqlite3.connect(f"{pathlib.Path(os.path.abspath(self.path)).as_uri()}?mode=ro",
+                                            uri=True, timeout=5)
+        if self._conexao is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conexao = sqlite3.connect(self.path, timeout=30)
+            conexao.execute('PRAGMA journal_mode=WAL')
+            for tabela, campos in CAMPOS_INDICE_VENDAS.items():
+                colunas = ', '.join(f"{campo} {'REAL' if campo in CAMPOS_NUMERICOS_INDICE else 'TEXT'}"
+                                    for campo in campos)
+                conexao.execute(f'CREATE TABLE IF NOT EXISTS {tabela} (op_id TEXT PRIMARY KEY, {colunas})')
+            conexao.commit()
+            self._conexao = conexao
+        return self._conexao
+
+    def fechar(self):
+        if self._conexao is not None:
+            self._conexao.close()
+            self._conexao = None
+
+    @staticmethod
+    def _valor_sql(valor):
+        if valor is None or (isinstance(valor, float) and valor != valor):  # None / NaN
+            return None
+        return valor if isinstance(valor, (int, float)) else str(valor)
+
+    def registrar(self, tabela: str, mapa: Dict[str, Dict[str, Any]]) -> int:
+        """Grava os op_ids de `mapa` que ainda não estão no índice; retorna quantos entraram"""
+        campos = CAMPOS_INDICE_VENDAS[tabela]
+        conexao = self.conectar()
+        antes = conexao.total_changes
+        with conexao:
+            conexao.executemany(
+                f"INSERT OR IGNORE INTO {tabela} (op_id, {', '.join(campos)}) "
+                f"VALUES ({', '.join('?' * (len(campos) + 1))})",
+                ((op_id, *(self._valor_sql(dados.get(campo)) for campo in campos))
+                 for op_id, dados in mapa.items())
+            )
+        return conexao.total_changes - antes
+
+    @staticmethod
+    def _dados(campos: List[str], row) -> Dict[str, Any]:
+        return {campo: (valor if valor is not None else (0.0 if campo in CAMPOS_NUMERICOS_INDICE else ''))
+                for campo, valor in zip(campos, row)}
+
+    def buscar(self, tabela: str, op_id: str) -> Optional[Dict[str, Any]]:
+        campos = CAMPOS_INDICE_VENDAS[tabela]
+        row = self.conectar().execute(
+            f"SELECT {', '.join(campos)} FROM {tabela} WHERE op_id = ?", (op_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._dados(campos, row)
+
+    def buscar_varios(self, tabela: str, op_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """buscar() de vários op_ids (None para os que não estão no índice)"""
+        campos = CAMPOS_INDICE_VENDAS[tabela]
+        conexao = self.conectar()
+        encontrados = dict.fromkeys(op_ids)
+        for inicio in range(0, len(op_ids), self.LOTE_CONSULTA):
+            lote = op_ids[inicio:inicio + self.LOTE_CONSULTA]
+            for op_id, *row in conexao.execute(
+                    f"SELECT op_id, {', '.join(campos)} FROM {tabela} "
+                    f"WHERE op_id IN ({', '.join('?' * len(lote))})", lote):
+                encontrados[op_id] = self._dados(campos, row)
+        return encontrados
+
+
+class MapaComIndice(dict):
+    """
+    map_vendas / map_pos_venda do upload atual; IDs ausentes são buscados (uma vez)
+    no IndiceVendas. Suporta o uso da conciliação: `in`, [] e get().
 
-        try:
-            arquivos['vendas'] = await ler_csv(vendas, 'vendas')
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Erro ao processar arquivo 'vendas': {str(e)}")
+    `consultas` guarda o que cada busca retornou (None se o ID não estava no índice):
+    é tudo do índice de que o resultado depende (ver cache_ler).
+    """
 
-        try:
-            arquivos['pos_venda'] = await ler_csv(pos_venda, 'pos_venda')
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Erro ao processar arquivo 'pos_venda': {str(e)}")
+    def __init__(self, dados: Dict[str, Dict[str, Any]], buscar: Callable[[str], Optional[Dict[str, Any]]]):
+        super().__init__(dados)
+        self._buscar = buscar
+        self.consultas: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.do_indice = set()  # IDs resolvidos pelo índice
+        self.falhas = 0  # Buscas com erro do SQLite (tratadas como ausentes)
 
+    def _carregar(self, op_id) -> bool:
+        if op_id in self.consultas or not op_id:
+            return False
         try:
-            arquivos['liberacoes'] = await ler_csv(liberacoes, 'liberacoes', clean_json=True)
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Erro ao processar arquivo 'liberacoes': {str(e)}")
+            dados = self._buscar(op_id)
+        except sqlite3.Error:
+            self.falhas += 1
+            dados = None
+        self.consultas[op_id] = dados
+        if dados is None:
+            return False
+        dict.__setitem__(self, op_id, dados)
+        self.do_indice.add(op_id)
+        return True
+
+    def __contains__(self, op_id) -> bool:
+        return dict.__contains__(self, op_id) or self._carregar(op_id)
+
+    def __missing__(self, op_id):
+        if self._carregar(op_id):
+            return dict.__getitem__(self, op_id)
+        raise KeyError(op_id)
+
+    def get(self, op_id, default=None):
+        return self[op_id] if op_id in self else default
+
+    def carregar(self, ids):
+        """Resolve de uma vez os IDs ausentes do upload (ex: antes de copiar o mapa)"""
+        for op_id in ids:
+            if not dict.__contains__(self, op_id):
+                self._carregar(op_id)
 
-        try:
-            arquivos['extrato'], saldo_inicial_extrato = await ler_extrato(extrato)
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Erro ao processar arquivo 'extrato': {str(e)}")
 
-        # Arquivo opcional
-        if retirada:
-            try:
-                arquivos['retirada'] = await ler_csv(retirada, 'retirada')
-            except:
-                arquivos['retirada'] = pd.DataFrame()
-        else:
-            arquivos['retirada'] = pd.DataFrame()
+# ==============================================================================
+# REGISTRO DE TRANSAÇÕES EXPORTADAS EM OFX (SQLite)
+# ==============================================================================
+#
+# O OFX completo traz o período inteiro a cada upload, e o Conta Azul reprocessa
+# milhares de transações já importadas. O registro guarda, por conta (o centro de
+# custo), os FITIDs estáveis (fitids_estaveis) de tudo que já saiu em um OFX; com
+# ofx_incremental o OFX traz só as transações fora do registro.
 
-        # Processar conciliação
-        try:
-            resultado = processar_conciliacao(arquivos, centro_custo=centro_custo)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Erro ao processar conciliação: {str(e)}")
+class RegistroOfx:
+    """
+    FITIDs já exportados de uma conta, em SQLite (um arquivo compartilhado pelos
+    workers, em modo WAL). Cada FITID é gravado uma única vez (INSERT OR IGNORE).
+    """
 
-        # Gerar arquivos de saída organizados por pasta
-        # Estrutura:
-        #   Conta Azul/  - Arquivos principais para importação
-        #   Resumo/      - Arquivos resumidos (agrupados por data/categoria)
-        #   Outros/      - CSVs, OFX e arquivos auxiliares
+    LOTE_CONSULTA = 500  # FITIDs por consulta (limite de parâmetros do SQLite)
+
+    def __init__(self, path: str, conta: str):
+        self.path = path
+        self.conta = conta
+        self._conexao: Optional[sqlite3.Connection] = None
+
+    def conectar(self) -> sqlite3.Connection:
+        if self._conexao is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conexao = sqlite3.connect(self.path, timeout=30)
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute('CREATE TABLE IF NOT EXISTS exportados (conta TEXT, fitid TEXT, exportado_em TEXT, '
+                            'PRIMARY KEY (conta, fitid)) WITHOUT ROWID')
+            conexao.commit()
+            self._conexao = conexao
+        return self._conexao
+
+    def fechar(self):
+        if self._conexao is not None:
+            self._conexao.close()
+            self._conexao = None
+
+    def ja_exportados(self, fitids: List[str]) -> set:
+        """Os FITIDs de `fitids` que já saíram em um OFX desta conta"""
+        conexao = self.conectar()
+        exportados = set()
+        for inicio in range(0, len(fitids), self.LOTE_CONSULTA):
+            lote = fitids[inicio:inicio + self.LOTE_CONSULTA]
+            exportados.update(fitid for fitid, in conexao.execute(
+                f"SELECT fitid FROM exportados WHERE conta = ? AND fitid IN ({', '.join('?' * len(lote))})",
+                (self.conta, *lote)))
+        return exportados
+
+    def registrar(self, fitids: List[str]) -> int:
+        """Grava os FITIDs exportados; retorna quantos eram novos"""
+        conexao = self.conectar()
+        antes = conexao.total_changes
+        exportado_em = datetime.now().isoformat(timespec='seconds')
+        with conexao:
+            conexao.executemany("INSERT OR IGNORE INTO exportados (conta, fitid, exportado_em) VALUES (?, ?, ?)",
+                                ((self.conta, fitid, exportado_em) for fitid in fitids))
+        return conexao.total_changes - antes
+
+
+def registrar_ofx_entregue(centro_custo: str, fitids: List[str]) -> int:
+    """
+    Grava no RegistroOfx os FITIDs de um OFX incremental já entregue ao cliente.
+    Chamado só depois do envio do ZIP (entregar_registrando_ofx): um cliente que cai
+    no meio do download recebe as mesmas transações na próxima execução.
+    """
+    registro = RegistroOfx(OFX_EXPORTADOS_PATH, centro_custo)
+    try:
+        return registro.registrar(fitids)
+    finally:
+        registro.fechar()
 
-        arquivos_gerados = {}  # {caminho_no_zip: caminho_local}
 
-        # =====================================================================
-        # PASTA: Conta Azul (arquivos principais para importação)
-        # =====================================================================
+# ==============================================================================
+# MOTORES DE CONCILIAÇÃO (pandas / DuckDB / Polars)
+# ==============================================================================
+#
+# A indexação de processar_conciliacao (origem da venda, mapas do VENDAS e do
+# PÓS-VENDA, breakdown do LIBERAÇÕES) e a seleção das previsões ainda não liberadas
+# são junções sobre os relatórios. O motor executa essas etapas e entrega as mesmas
+# estruturas; a classificação linha a linha do extrato e das previsões é comum.
+
+# Descrições do LIBERAÇÕES que podem se repetir para o mesmo ID (guardadas em lista)
+DESCRICOES_LIBERACAO_MULTIPLAS = ('refund', 'chargeback', 'mediation', 'reserve_for_dispute')
+
+
+class MotorPandas:
+    """Motor de referência: percorre os DataFrames linha a linha"""
+
+    nome = 'pandas'
+    modulo = None
+
+    def indexar_vendas(self, dinheiro: 'pd.DataFrame', vendas: 'pd.DataFrame',
+                       pos_venda: 'pd.DataFrame') -> Tuple[Dict[str, str], Dict[str, Dict], Dict[str, Dict]]:
+        """(map_origem_venda, map_vendas, map_pos_venda) - requer as colunas op_id"""
+        # 1.2 Criar mapa de ORIGEM da venda (ML, LOJA, BALCÃO)
+        map_origem_venda = {}
+
+        # Primeiro: se tem order_id do ML, é venda ML
+        if {'op_id', 'Número da venda no Mercado Livre (order_id)'} <= set(vendas.columns):
+            order_id = vendas['Número da venda no Mercado Livre (order_id)']
+            venda_ml = ((vendas['op_id'] != '') & order_id.notna()
+                        & ~order_id.astype(str).str.strip().isin(['', 'nan']))
+            map_origem_venda = dict.fromkeys(vendas.loc[venda_ml, 'op_id'], 'ML')
+
+        # Segundo: verifica SUB_UNIT no dinheiro (primeira linha de cada ID)
+        if {'op_id', 'SUB_UNIT'} <= set(dinheiro.columns):
+            primeiras = dinheiro.loc[dinheiro['op_id'] != '', ['op_id', 'SUB_UNIT']].drop_duplicates('op_id')
+            primeiras = primeiras[~primeiras['op_id'].isin(map_origem_venda.keys())]
+            balcao = primeiras['SUB_UNIT'].astype(str).str.lower().str.contains('point', regex=False)
+            map_origem_venda.update(zip(primeiras['op_id'], np.where(balcao, 'BALCAO', 'LOJA').tolist()))
+
+        # 1.3 Criar mapas de dados das VENDAS para enriquecimento
+        map_vendas = {}
+        for _, row in vendas.iterrows():
+            op_id = row.get('op_id', '')
+            if op_id:
+                map_vendas[op_id] = {
+                    'valor_produto': safe_float(row.get('Valor do produto (transaction_amount)', 0)),
+                    'frete_comprador': safe_float(row.get('Frete (shipping_cost)', 0)),
+                    'descricao': str(row.get('Descrição da operação (reason)', '')),
+                    'order_id': clean_id(row.get('Número da venda no Mercado Livre (order_id)', '')),
+                    'data_venda': row.get('Data da compra (date_created)', ''),
+                    'data_liberacao': row.get('Data de liberação do dinheiro (date_released)', ''),
+                    'status_envio': str(row.get('Status do envio (shipment_status)', '')),
+                }
+
+        # 1.4 Criar mapa do PÓS-VENDA para contexto de devoluções
+        # Também extraímos a data original da venda (operation_date_created) para casos
+        # onde a venda não está no relatório VENDAS mas está no AFTER_COLLECTION
+        map_pos_venda = {}
+        for _, row in pos_venda.iterrows():
+            op_id = clean_id(row.get('ID da transação (operation_id)', ''))
+            if op_id:
+                map_pos_venda[op_id] = {
+                    'motivo': str(row.get('Motivo detalhado (reason_detail)', '')),
+                    'data_venda_original': row.get('Data de criação da transação (operation_date_created)', ''),
+                    'data_reclamacao': row.get('Data de criação (date_created)', ''),
+                }
+
+        return map_origem_venda, map_vendas, map_pos_venda
+
+    def indexar_liberacoes(self, liberacoes: 'pd.DataFrame') -> Dict[str, Dict[str, Any]]:
+        """{op_id: {'payment': {...}, 'refund': [{...}, {...}], ...}}"""
+        # Filtrar liberações válidas
+        if 'RECORD_TYPE' in liberacoes.columns:
+            liberacoes_filtrado = liberacoes[liberacoes['RECORD_TYPE'] != 'available_balance'].copy()
+        elif 'SOURCE_ID' in liberacoes.columns:
+            liberacoes_filtrado = liberacoes[liberacoes['SOURCE_ID'].notna()].copy()
+        else:
+            liberacoes_filtrado = liberacoes.copy()
+
+        # Mapa de liberações por (SOURCE_ID, DESCRIPTION)
+        # Estrutura: {op_id: {'payment': {...}, 'refund': [{...}, {...}], ...}}
+        map_liberacoes = {}
+
+        for _, row in liberacoes_filtrado.iterrows():
+            op_id = clean_id(row.get('SOURCE_ID', ''))
+            if not op_id:
+                continue
+
+            desc = str(row.get('DESCRIPTION', '')).lower().strip()
+
+            # Extrair valores do LIBERAÇÕES
+            dados = {
+                'date': row.get('DATE', ''),
+                'gross_amount': safe_float(row.get('GROSS_AMOUNT', 0)),
+                'mp_fee': safe_float(row.get('MP_FEE_AMOUNT', 0)),
+                'financing_fee': safe_float(row.get('FINANCING_FEE_AMOUNT', 0)),
+                'shipping_fee': safe_float(row.get('SHIPPING_FEE_AMOUNT', 0)),
+                'net_credit': safe_float(row.get('NET_CREDIT_AMOUNT', 0)),
+                'net_debit': safe_float(row.get('NET_DEBIT_AMOUNT', 0)),
+            }
+
+            # Calcular valor líquido
+            dados['net_amount'] = dados['net_credit'] - dados['net_debit']
+
+            # Calcular comissão total (MP + parcelamento)
+            dados['comissao_total'] = dados['mp_fee'] + dados['financing_fee']
+
+            if op_id not in map_liberacoes:
+                map_liberacoes[op_id] = {}
+
+            # Armazenar por tipo de descrição
+            # Alguns tipos podem ter múltiplos registros para o mesmo ID
+            if desc in DESCRICOES_LIBERACAO_MULTIPLAS:
+                if desc not in map_liberacoes[op_id]:
+                    map_liberacoes[op_id][desc] = []
+                map_liberacoes[op_id][desc].append(dados)
+            else:
+                # Payment geralmente é único
+                map_liberacoes[op_id][desc] = dados
+
+        return map_liberacoes
+
+    def selecionar_previsoes(self, dinheiro: 'pd.DataFrame', map_liberacoes: Dict[str, Any]) -> 'pd.DataFrame':
+        """Linhas do DINHEIRO EM CONTA candidatas a previsão (o loop das previsões ignora as já liberadas)"""
+        return dinheiro
+
+    def fechar(self):
+        pass
+
+
+class MotorColunar:
+    """
+    Base dos motores colunares (DuckDB, Polars): cada motor normaliza as colunas
+    usadas dos relatórios (clean_id, safe_float, str) e devolve as linhas já
+    filtradas, na ordem original; os mapas são montados aqui, com o mesmo conteúdo
+    e a mesma ordem do MotorPandas (a última linha de um ID vence).
+    """
+
+    # {campo do mapa: (coluna do relatório, tipo)}; tipos: numero = safe_float,
+    # texto = str, id = clean_id, bruto = valor da célula
+    COLUNAS_VENDAS = {
+        'valor_produto': ('Valor do produto (transaction_amount)', 'numero'),
+        'frete_comprador': ('Frete (shipping_cost)', 'numero'),
+        'descricao': ('Descrição da operação (reason)', 'texto'),
+        'order_id': ('Número da venda no Mercado Livre (order_id)', 'id'),
+        'data_venda': ('Data da compra (date_created)', 'bruto'),
+        'data_liberacao': ('Data de liberação do dinheiro (date_released)', 'bruto'),
+        'status_envio': ('Status do envio (shipment_status)', 'texto'),
+    }
+    COLUNAS_POS_VENDA = {
+        'motivo': ('Motivo detalhado (reason_detail)', 'texto'),
+        'data_venda_original': ('Data de criação da transação (operation_date_created)', 'bruto'),
+        'data_reclamacao': ('Data de criação (date_created)', 'bruto'),
+    }
+    COLUNAS_LIBERACOES = {
+        'date': ('DATE', 'bruto'),
+        'gross_amount': ('GROSS_AMOUNT', 'numero'),
+        'mp_fee': ('MP_FEE_AMOUNT', 'numero'),
+        'financing_fee': ('FINANCING_FEE_AMOUNT', 'numero'),
+        'shipping_fee': ('SHIPPING_FEE_AMOUNT', 'numero'),
+        'net_credit': ('NET_CREDIT_AMOUNT', 'numero'),
+        'net_debit': ('NET_DEBIT_AMOUNT', 'numero'),
+    }
+    CAMPOS_LIBERACOES = [*COLUNAS_LIBERACOES, 'net_amount', 'comissao_total']
+    COLUNA_ORDER_ID = 'Número da venda no Mercado Livre (order_id)'
+
+    # False com o LIBERAÇÕES fora da memória (LiberacoesEmDisco): sem o anti-join, as
+    # previsões recebem todo o DINHEIRO EM CONTA e o loop consulta o índice por ID
+    liberacoes_indexadas = False
+
+    def fechar(self):
+        pass
+
+    @staticmethod
+    def _montar_mapa(linhas, colunas: Dict[str, Tuple[str, str]], presentes) -> Dict[str, Dict]:
+        """Linhas (op_id, *campos) -> {op_id: {campo: valor}}; célula vazia 'bruta' volta a ser NaN"""
+        campos = list(colunas)
+        brutos = [i for i, (coluna, tipo) in enumerate(colunas.values()) if tipo == 'bruto' and coluna in presentes]
+        mapa = {}
+        for op_id, *valores in linhas:
+            for i in brutos:
+                if valores[i] is None:
+                    valores[i] = float('nan')
+            mapa[op_id] = dict(zip(campos, valores))
+        return mapa
+
+    @classmethod
+    def _montar_liberacoes(cls, linhas, presentes) -> Dict[str, Dict[str, Any]]:
+        """Linhas (op_id, desc, *CAMPOS_LIBERACOES) -> {op_id: {'payment': {...}, 'refund': [...]}}"""
+        data_bruta = 'DATE' in presentes
+        map_liberacoes = {}
+        for op_id, desc, *valores in linhas:
+            if data_bruta and valores[0] is None:
+                valores[0] = float('nan')
+            dados = dict(zip(cls.CAMPOS_LIBERACOES, valores))
+            por_tipo = map_liberacoes.setdefault(op_id, {})
+            if desc in DESCRICOES_LIBERACAO_MULTIPLAS:
+                por_tipo.setdefault(desc, []).append(dados)
+            else:
+                por_tipo[desc] = dados
+        return map_liberacoes
+
+
+class MotorDuckDB(MotorColunar):
+    """
+    Motor em DuckDB, embutido no worker: as colunas usadas de cada relatório são
+    registradas como tabelas e a normalização, os filtros e a junção das previsões
+    com o LIBERAÇÕES rodam em SQL, em paralelo e com spill em disco
+    (DUCKDB_MEMORIA_MB / DUCKDB_TEMP_DIR).
+    """
+
+    nome = 'duckdb'
+    modulo = 'duckdb'
+
+    # Valor de row.get(coluna, default) quando a coluna não existe no relatório
+    AUSENTES = {'numero': '0.0', 'texto': "''", 'id': "''", 'bruto': "''"}
+
+    def __init__(self):
+        duckdb = importar_modulo('duckdb')
+        config = {'temp_directory': DUCKDB_TEMP_DIR}
+        if DUCKDB_MEMORIA_MB:
+            config['memory_limit'] = f'{DUCKDB_MEMORIA_MB}MB'
+        if DUCKDB_THREADS:
+            config['threads'] = DUCKDB_THREADS
+        self.conexao = duckdb.connect(':memory:', config=config)
+
+    def fechar(self):
+        if self.conexao is not None:
+            self.conexao.close()
+            self.conexao = None
+
+    def _registrar(self, tabela: str, df: 'pd.DataFrame', colunas) -> set:
+        """Registra as colunas existentes de `df` + a posição da linha (_rn); retorna as registradas"""
+        presentes = [coluna for coluna in dict.fromkeys(colunas) if coluna in df.columns]
+        self.conexao.register(tabela, df[presentes].assign(_rn=np.arange(len(df))))
+        return set(presentes)
+
+    @classmethod
+    def _expressao(cls, coluna: str, tipo: str, presentes: set) -> str:
+        """SQL equivalente a safe_float / str / clean_id / valor bruto de row.get(coluna)"""
+        if coluna not in presentes:
+            return cls.AUSENTES[tipo]
+        sql = '"' + coluna.replace('"', '""') + '"'
+        if tipo == 'numero':
+            return f"COALESCE(TRY_CAST({sql} AS DOUBLE), 0.0)"
+        if tipo == 'texto':
+            return f"COALESCE(CAST({sql} AS VARCHAR), 'nan')"
+        if tipo == 'id':
+            return f"COALESCE(trim(replace(CAST({sql} AS VARCHAR), '.0', '')), '')"
+        return sql
+
+    def _mapa(self, tabela: str, colunas: Dict[str, Tuple[str, str]], presentes: set) -> Dict[str, Dict]:
+        if 'op_id' not in presentes:
+            return {}
+        selecao = ', '.join(f'{self._expressao(coluna, tipo, presentes)} AS "{campo}"'
+                            for campo, (coluna, tipo) in colunas.items())
+        linhas = self.conexao.execute(f"SELECT op_id, {selecao} FROM {tabela} WHERE op_id <> '' ORDER BY _rn")
+        return self._montar_mapa(linhas.fetchall(), colunas, presentes)
+
+    def indexar_vendas(self, dinheiro: 'pd.DataFrame', vendas: 'pd.DataFrame',
+                       pos_venda: 'pd.DataFrame') -> Tuple[Dict[str, str], Dict[str, Dict], Dict[str, Dict]]:
+        presentes_dinheiro = self._registrar('dinheiro', dinheiro, ['op_id', 'SUB_UNIT'])
+        presentes_vendas = self._registrar('vendas', vendas,
+                                           ['op_id', *(coluna for coluna, _ in self.COLUNAS_VENDAS.values())])
+        presentes_pos_venda = self._registrar('pos_venda', pos_venda,
+                                              ['op_id', *(coluna for coluna, _ in self.COLUNAS_POS_VENDA.values())])
+
+        # Origem: ML quando o VENDAS tem order_id; senão, pelo SUB_UNIT da primeira
+        # linha do DINHEIRO EM CONTA (point = BALCÃO, demais = LOJA)
+        self.conexao.execute("CREATE TEMP TABLE origem_ml (op_id VARCHAR, _rn BIGINT)")
+        if {'op_id', self.COLUNA_ORDER_ID} <= presentes_vendas:
+            order_id = self._expressao(self.COLUNA_ORDER_ID, 'bruto', presentes_vendas)
+            self.conexao.execute(f"""
+                INSERT INTO origem_ml
+                SELECT op_id, min(_rn) FROM vendas
+                WHERE op_id <> '' AND {order_id} IS NOT NULL
+                  AND trim(CAST({order_id} AS VARCHAR)) NOT IN ('', 'nan')
+                GROUP BY op_id
+            """)
+        map_origem_venda = dict(self.conexao.execute(
+            "SELECT op_id, 'ML' FROM origem_ml ORDER BY _rn").fetchall())
+        if {'op_id', 'SUB_UNIT'} <= presentes_dinheiro:
+            sub_unit = self._expressao('SUB_UNIT', 'texto', presentes_dinheiro)
+            map_origem_venda.update(self.conexao.execute(f"""
+                SELECT op_id, CASE WHEN contains(lower(arg_min({sub_unit}, _rn)), 'point')
+                                   THEN 'BALCAO' ELSE 'LOJA' END
+                FROM dinheiro
+                WHERE op_id <> '' AND op_id NOT IN (SELECT op_id FROM origem_ml)
+                GROUP BY op_id
+                ORDER BY min(_rn)
+            """).fetchall())
+
+        map_vendas = self._mapa('vendas', self.COLUNAS_VENDAS, presentes_vendas)
+        map_pos_venda = self._mapa('pos_venda', self.COLUNAS_POS_VENDA, presentes_pos_venda)
+        return map_origem_venda, map_vendas, map_pos_venda
+
+    def indexar_liberacoes(self, liberacoes: 'pd.DataFrame') -> Dict[str, Dict[str, Any]]:
+        presentes = self._registrar('liberacoes', liberacoes,
+                                    ['RECORD_TYPE', 'SOURCE_ID', 'DESCRIPTION',
+                                     *(coluna for coluna, _ in self.COLUNAS_LIBERACOES.values())])
+        if 'RECORD_TYPE' in presentes:
+            filtro = "\"RECORD_TYPE\" IS DISTINCT FROM 'available_balance'"
+        elif 'SOURCE_ID' in presentes:
+            filtro = '"SOURCE_ID" IS NOT NULL'
+        else:
+            filtro = 'true'
+        selecao = ', '.join(f'{self._expressao(coluna, tipo, presentes)} AS {campo}'
+                            for campo, (coluna, tipo) in self.COLUNAS_LIBERACOES.items())
+        self.conexao.execute(f"""
+            CREATE TEMP TABLE liberacoes_validas AS
+            SELECT _rn, op_id, lower(trim(descricao)) AS descricao, * EXCLUDE (_rn, op_id, descricao),
+                   net_credit - net_debit AS net_amount,
+                   mp_fee + financing_fee AS comissao_total
+            FROM (
+                SELECT _rn, {self._expressao('SOURCE_ID', 'id', presentes)} AS op_id,
+                       {self._expressao('DESCRIPTION', 'texto', presentes)} AS descricao, {selecao}
+                FROM liberacoes WHERE {filtro}
+            )
+            WHERE op_id <> ''
+        """)
+        linhas = self.conexao.execute(f"SELECT op_id, descricao, {', '.join(self.CAMPOS_LIBERACOES)} "
+                                      f"FROM liberacoes_validas ORDER BY _rn")
+        self.liberacoes_indexadas = True
+        return self._montar_liberacoes(linhas.fetchall(), presentes)
+
+    def selecionar_previsoes(self, dinheiro: 'pd.DataFrame', map_liberacoes: Dict[str, Any]) -> 'pd.DataFrame':
+        """Anti-join do DINHEIRO EM CONTA com o LIBERAÇÕES: só as operações ainda não liberadas"""
+        if 'op_id' not in dinheiro.columns:
+            return dinheiro.iloc[0:0]
+        if not self.liberacoes_indexadas:
+            return dinheiro
+        posicoes = [rn for rn, in self.conexao.execute("""
+            SELECT d._rn FROM dinheiro d
+            WHERE d.op_id <> '' AND NOT EXISTS (SELECT 1 FROM liberacoes_validas l WHERE l.op_id = d.op_id)
+            ORDER BY d._rn
+        """).fetchall()]
+        return dinheiro.iloc[posicoes]
+
+
+class MotorPolars(MotorColunar):
+    """
+    Motor em Polars: as colunas usadas de cada relatório viram um LazyFrame (só elas
+    são convertidas - projeção) e a normalização, os filtros e as junções são
+    expressões avaliadas em paralelo pelo Polars (POLARS_MAX_THREADS).
+    """
+
+    nome = 'polars'
+    modulo = 'polars'
+
+    def __init__(self):
+        self.pl = importar_modulo('polars')
+        self._dinheiro = None
+        self._ids_liberados = None
+
+    def fechar(self):
+        self._dinheiro = self._ids_liberados = None
+
+    def _lazy(self, df: 'pd.DataFrame', colunas) -> Tuple[Any, set]:
+        """LazyFrame com as colunas existentes de `df` + a posição da linha (_rn)"""
+        pl = self.pl
+        series = []
+        for coluna in dict.fromkeys(colunas):
+            if coluna not in df.columns:
+                continue
+            valores = df[coluna]
+            if valores.dtype.kind in 'biuf':
+                series.append(pl.Series(coluna, valores.to_numpy(), nan_to_null=True))
+            else:
+                # Texto/objeto: sem pyarrow, passa pelos objetos Python (NaN -> null)
+                series.append(pl.Series(coluna, valores.to_numpy(dtype=object, na_value=None),
+                                        dtype=pl.Utf8, strict=False))
+        quadro = pl.DataFrame(series) if series else pl.DataFrame({'_vazio': [None] * len(df)})
+        return quadro.with_row_index('_rn').lazy(), {s.name for s in series}
+
+    def _expressao(self, coluna: str, tipo: str, presentes: set, esquema) -> Any:
+        """Expressão equivalente a safe_float / str / clean_id / valor bruto de row.get(coluna)"""
+        pl = self.pl
+        if coluna not in presentes:
+            return pl.lit(0.0) if tipo == 'numero' else pl.lit('')
+        expr = pl.col(coluna)
+        if tipo == 'numero':
+            if esquema[coluna] == pl.Utf8:
+                expr = expr.str.strip_chars()
+            return expr.cast(pl.Float64, strict=False).fill_null(0.0)
+        if tipo == 'texto':
+            return expr.cast(pl.Utf8).fill_null('nan')
+        if tipo == 'id':
+            return expr.cast(pl.Utf8).str.replace_all('.0', '', literal=True).str.strip_chars().fill_null('')
+        return expr
+
+    def _consulta_mapa(self, lazy, presentes: set, colunas: Dict[str, Tuple[str, str]]) -> Any:
+        """Linhas (op_id, *campos) com op_id preenchido, na ordem do relatório"""
+        pl = self.pl
+        if 'op_id' not in presentes:
+            return pl.LazyFrame({'op_id': []}, schema={'op_id': pl.Utf8})
+        esquema = lazy.collect_schema()
+        return lazy.filter(pl.col('op_id') != '').select(
+            'op_id', *(self._expressao(coluna, tipo, presentes, esquema).alias(campo)
+                       for campo, (coluna, tipo) in colunas.items())
+        )
+
+    def indexar_vendas(self, dinheiro: 'pd.DataFrame', vendas: 'pd.DataFrame',
+                       pos_venda: 'pd.DataFrame') -> Tuple[Dict[str, str], Dict[str, Dict], Dict[str, Dict]]:
+        pl = self.pl
+        self._dinheiro, presentes_dinheiro = self._lazy(dinheiro, ['op_id', 'SUB_UNIT'])
+        lazy_vendas, presentes_vendas = self._lazy(
+            vendas, ['op_id', *(coluna for coluna, _ in self.COLUNAS_VENDAS.values())])
+        lazy_pos_venda, presentes_pos_venda = self._lazy(
+            pos_venda, ['op_id', *(coluna for coluna, _ in self.COLUNAS_POS_VENDA.values())])
+
+        # Origem: ML quando o VENDAS tem order_id; senão, pelo SUB_UNIT da primeira
+        # linha do DINHEIRO EM CONTA (point = BALCÃO, demais = LOJA)
+        ids_ml = pl.LazyFrame({'op_id': []}, schema={'op_id': pl.Utf8})
+        if {'op_id', self.COLUNA_ORDER_ID} <= presentes_vendas:
+            order_id = pl.col(self.COLUNA_ORDER_ID)
+            ids_ml = lazy_vendas.filter(
+                (pl.col('op_id') != '') & order_id.is_not_null()
+                & ~order_id.cast(pl.Utf8).str.strip_chars().is_in(['', 'nan'])
+            ).select('op_id').unique(maintain_order=True)
+        consultas = [ids_ml.with_columns(origem=pl.lit('ML'))]
+        if {'op_id', 'SUB_UNIT'} <= presentes_dinheiro:
+            sub_unit = self._expressao('SUB_UNIT', 'texto', presentes_dinheiro, self._dinheiro.collect_schema())
+            consultas.append(
+                self._dinheiro.filter(pl.col('op_id') != '')
+                .unique('op_id', keep='first', maintain_order=True)
+                .join(ids_ml, on='op_id', how='anti', maintain_order='left')
+                .select('op_id', origem=pl.when(sub_unit.str.to_lowercase().str.contains('point', literal=True))
+                        .then(pl.lit('BALCAO')).otherwise(pl.lit('LOJA')))
+            )
+        # As três consultas são avaliadas juntas, em paralelo
+        origens, vendas_normalizadas, pos_venda_normalizada = pl.collect_all([
+            pl.concat(consultas),
+            self._consulta_mapa(lazy_vendas, presentes_vendas, self.COLUNAS_VENDAS),
+            self._consulta_mapa(lazy_pos_venda, presentes_pos_venda, self.COLUNAS_POS_VENDA),
+        ])
+        map_origem_venda = dict(origens.rows())
+        map_vendas = self._montar_mapa(vendas_normalizadas.rows(), self.COLUNAS_VENDAS, presentes_vendas)
+        map_pos_venda = self._montar_mapa(pos_venda_normalizada.rows(), self.COLUNAS_POS_VENDA, presentes_pos_venda)
+        return map_origem_venda, map_vendas, map_pos_venda
+
+    def indexar_liberacoes(self, liberacoes: 'pd.DataFrame') -> Dict[str, Dict[str, Any]]:
+        pl = self.pl
+        lazy, presentes = self._lazy(liberacoes, ['RECORD_TYPE', 'SOURCE_ID', 'DESCRIPTION',
+                                                  *(coluna for coluna, _ in self.COLUNAS_LIBERACOES.values())])
+        esquema = lazy.collect_schema()
+        if 'RECORD_TYPE' in presentes:
+            lazy = lazy.filter(pl.col('RECORD_TYPE').ne_missing('available_balance'))
+        elif 'SOURCE_ID' in presentes:
+            lazy = lazy.filter(pl.col('SOURCE_ID').is_not_null())
+        validas = lazy.select(
+            op_id=self._expressao('SOURCE_ID', 'id', presentes, esquema),
+            descricao=self._expressao('DESCRIPTION', 'texto', presentes, esquema).str.to_lowercase().str.strip_chars(),
+            **{campo: self._expressao(coluna, tipo, presentes, esquema)
+               for campo, (coluna, tipo) in self.COLUNAS_LIBERACOES.items()},
+        ).filter(pl.col('op_id') != '').with_columns(
+            net_amount=pl.col('net_credit') - pl.col('net_debit'),
+            comissao_total=pl.col('mp_fee') + pl.col('financing_fee'),
+        ).collect()
+        self._ids_liberados = validas.get_column('op_id').unique()
+        self.liberacoes_indexadas = True
+        return self._montar_liberacoes(validas.rows(), presentes)
+
+    def selecionar_previsoes(self, dinheiro: 'pd.DataFrame', map_liberacoes: Dict[str, Any]) -> 'pd.DataFrame':
+        """Anti-join do DINHEIRO EM CONTA com o LIBERAÇÕES: só as operações ainda não liberadas"""
+        pl = self.pl
+        if 'op_id' not in dinheiro.columns:
+            return dinheiro.iloc[0:0]
+        if not self.liberacoes_indexadas:
+            return dinheiro
+        posicoes = self._dinheiro.filter(
+            (pl.col('op_id') != '') & ~pl.col('op_id').is_in(self._ids_liberados.implode())
+        ).select('_rn').collect().get_column('_rn').to_list()
+        return dinheiro.iloc[posicoes]
+
+
+MOTORES_CONCILIACAO = {
+    'pandas': MotorPandas,
+    'duckdb': MotorDuckDB,
+    'polars': MotorPolars,
+}
+
+
+def resolver_motor(nome: Optional[str] = None) -> str:
+    """
+    Nome do motor (vazio = MOTOR_PADRAO). ValueError se for desconhecido ou se o
+    pacote dele não estiver instalado (verificado sem importá-lo).
+    """
+    nome = (nome or MOTOR_PADRAO).strip().lower()
+    if nome not in MOTORES_CONCILIACAO:
+        raise ValueError(f"Motor de conciliação desconhecido: '{nome}' "
+                         f"(disponíveis: {', '.join(MOTORES_CONCILIACAO)})")
+    modulo = MOTORES_CONCILIACAO[nome].modulo
+    if modulo and importlib.util.find_spec(modulo) is None:
+        raise ValueError(f"Motor '{nome}' indisponível: instale o pacote {modulo}")
+    return nome
+
+
+def criar_motor_conciliacao(nome: Optional[str] = None):
+    return MOTORES_CONCILIACAO[resolver_motor(nome)]()
+
+
+# ==============================================================================
+# LIBERAÇÕES FORA DA MEMÓRIA (SQLite)
+# ==============================================================================
+#
+# Em sellers grandes o LIBERAÇÕES sozinho não cabe no container como DataFrame.
+# Acima de LIBERACOES_EM_DISCO_BYTES o relatório é lido em partes; de cada parte
+# sai o mesmo breakdown de MotorPandas.indexar_liberacoes (uma linha por liberação
+# válida, na ordem do relatório), gravado em um SQLite temporário indexado por
+# op_id. A conciliação consulta o índice por ID (MapaLiberacoesEmDisco): a memória
+# fica limitada a uma parte do CSV e ao cache de IDs, ao custo de uma consulta por ID.
+
+def ler_partes_por_arquivo(caminho: str, key: str, clean_json: bool = False,
+                           linhas_por_parte: int = LIBERACOES_LINHAS_POR_PARTE,
+                           linhas_duplicadas: Optional[Dict[str, int]] = None):
+    """
+    Lê um relatório em DataFrames de até `linhas_por_parte` linhas, agrupados por
+    arquivo: gera (arquivo, partes), com `arquivo` = nome do CSV dentro do ZIP (None
+    fora de ZIP) e `partes` = iterador dos DataFrames desse arquivo.
+
+    CSVs (também gzip/zstd, descompactados em stream, e os CSVs de um ZIP) são lidos
+    por ler_csv_stream - pd.read_csv em partes, então um campo entre aspas com quebra
+    de linha não é cortado entre partes - com o mesmo tratamento de ler_csv /
+    extrair_csvs_do_zip: METADATA malformado, separador pelo cabeçalho e linhas já
+    presentes em um CSV anterior do ZIP descartadas (contadas por CSV em
+    `linhas_duplicadas`). Parquet e Arrow IPC são lidos em lotes.
+
+    Um erro no meio de um CSV do ZIP é levantado por `partes`: quem consome descarta o
+    que já recebeu desse CSV e segue para o próximo, como extrair_csvs_do_zip, que
+    ignora o CSV inteiro. As linhas de um CSV só contam para a de-duplicação dos
+    próximos (e para `linhas_duplicadas`) depois que ele é lido por inteiro.
+    """
+    formato = formato_do_arquivo(caminho)
+    if formato in FORMATOS_COLUNARES:
+        yield None, partes_relatorio_colunar(caminho, formato, linhas_por_parte)
+        return
+
+    def partes_do_csv(binario):
+        return (df for df in ler_csv_stream(binario, clean_json=clean_json, linhas_por_parte=linhas_por_parte)
+                if not df.empty)
+
+    origem_zip = caminho
+    if formato != 'zip':
+        with abrir_relatorio(caminho, formato) as f:
+            if formato in ('gzip', 'zstd') and is_zip_file(f.peek(4)[:4]):
+                origem_zip = io.BytesIO(f.read())  # ZIP compactado de novo: o ZipFile precisa de seek
+            else:
+                yield None, partes_do_csv(f)
+                return
+
+    hashes_vistos = np.empty(0, dtype=np.uint64)
+
+    def partes_do_membro(zip_file: zipfile.ZipFile, csv_filename: str, deduplicar: bool):
+        nonlocal hashes_vistos
+        hashes_arquivo, duplicadas = [], 0
+        with zip_file.open(csv_filename) as csv_file:
+            for df in partes_do_csv(csv_file):
+                if deduplicar:
+                    # Sobreposição com os CSVs anteriores (hash das colunas-chave)
+                    hashes = hash_linhas(df, key)
+                    hashes_arquivo.append(hashes)
+                    novas = ~np.isin(hashes, hashes_vistos)
+                    if not novas.all():
+                        duplicadas += int(len(df) - novas.sum())
+                        df = df[novas]
+                if not df.empty:
+                    yield df
+        if hashes_arquivo:
+            hashes_vistos = np.union1d(hashes_vistos, np.concatenate(hashes_arquivo))
+        if duplicadas and linhas_duplicadas is not None:
+            linhas_duplicadas[csv_filename] = duplicadas
+
+    with zipfile.ZipFile(origem_zip) as zip_file:
+        csv_files = [f for f in zip_file.namelist()
+                     if f.lower().endswith('.csv') and not f.startswith('__MACOSX')]
+        if not csv_files:
+            raise ValueError("Nenhum arquivo CSV encontrado dentro do ZIP")
+        for csv_filename in csv_files:
+            yield csv_filename, partes_do_membro(zip_file, csv_filename, len(csv_files) > 1)
+
+
+class LiberacoesEmDisco:
+    """
+    LIBERAÇÕES em um SQLite temporário: uma linha por liberação válida (op_id,
+    descrição e valores de MotorPandas.indexar_liberacoes), na ordem do relatório.
+    Ocupa o lugar do DataFrame em arquivos['liberacoes'] (len = linhas lidas,
+    attrs = linhas_duplicadas). Picklable: cada processo abre a própria conexão.
+    """
+
+    CAMPOS = ['date', 'gross_amount', 'mp_fee', 'financing_fee', 'shipping_fee', 'net_credit', 'net_debit']
+
+    def __init__(self, path: str):
+        self.path = path
+        self.linhas = 0  # Linhas lidas do relatório (válidas ou não)
+        self.total_ids = 0  # op_ids distintos com liberação válida
+        self.attrs: Dict[str, Any] = {}
+        self._conexao: Optional[sqlite3.Connection] = None
+
+    def __len__(self) -> int:
+        return self.linhas
+
+    def __getstate__(self):
+        estado = dict(self.__dict__)
+        estado['_conexao'] = None
+        return estado
+
+    def conectar(self) -> sqlite3.Connection:
+        if self._conexao is None:
+            self._conexao = sqlite3.connect(self.path, timeout=30)
+        return self._conexao
+
+    def fechar(self, remover: bool = False):
+        if self._conexao is not None:
+            self._conexao.close()
+            self._conexao = None
+        if remover:
+            for sufixo in ('', '-journal'):
+                try:
+                    os.remove(self.path + sufixo)
+                except FileNotFoundError:
+                    pass
+
+    @classmethod
+    def importar(cls, caminho: str, clean_json: bool = True) -> 'LiberacoesEmDisco':
+        """Lê o relatório em `caminho` em partes e grava o breakdown em LIBERACOES_EM_DISCO_DIR"""
+        os.makedirs(LIBERACOES_EM_DISCO_DIR, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix='.sqlite3', dir=LIBERACOES_EM_DISCO_DIR)
+        os.close(fd)
+        liberacoes = cls(path)
+        try:
+            conexao = liberacoes.conectar()
+            conexao.execute('PRAGMA journal_mode=MEMORY')  # Sem journal não há ROLLBACK TO SAVEPOINT
+            conexao.execute('PRAGMA synchronous=OFF')
+            conexao.execute(f"CREATE TABLE liberacoes (rn INTEGER PRIMARY KEY, op_id TEXT, descricao TEXT, "
+                            f"date, {', '.join(f'{campo} REAL' for campo in cls.CAMPOS[1:])})")
+            linhas_duplicadas = {}
+            with conexao:
+                for arquivo, partes in ler_partes_por_arquivo(caminho, 'liberacoes', clean_json=clean_json,
+                                                              linhas_duplicadas=linhas_duplicadas):
+                    # Um CSV do ZIP com erro no meio sai inteiro (savepoint), como na leitura em memória
+                    conexao.execute('SAVEPOINT arquivo')
+                    linhas = 0
+                    try:
+                        for df in partes:
+                            conexao.executemany(
+                                f"INSERT INTO liberacoes VALUES (NULL, ?, ?, {', '.join('?' * len(cls.CAMPOS))})",
+                                cls._linhas_validas(df)
+                            )
+                            linhas += len(df)
+                    except sqlite3.Error:
+                        raise
+                    except Exception as e:
+                        if arquivo is None:
+                            raise
+                        conexao.execute('ROLLBACK TO SAVEPOINT arquivo')
+                        logger.warning(f"Erro ao processar {arquivo} do ZIP: {str(e)}")
+                    else:
+                        liberacoes.linhas += linhas
+                    conexao.execute('RELEASE SAVEPOINT arquivo')
+            conexao.execute('CREATE INDEX liberacoes_op_id ON liberacoes (op_id, rn)')
+            liberacoes.total_ids = conexao.execute('SELECT COUNT(DISTINCT op_id) FROM liberacoes').fetchone()[0]
+            liberacoes.attrs['linhas_duplicadas'] = linhas_duplicadas
+        except Exception:
+            liberacoes.fechar(remover=True)
+            raise
+        logger.info(f"LIBERAÇÕES fora da memória: {liberacoes.linhas} linhas, "
+                    f"{liberacoes.total_ids} IDs com liberação ({path})")
+        return liberacoes
+
+    @staticmethod
+    def _linhas_validas(df: 'pd.DataFrame'):
+        """(op_id, descrição, *CAMPOS) das liberações válidas - os filtros de MotorPandas.indexar_liberacoes"""
+        if 'RECORD_TYPE' in df.columns:
+            df = df[df['RECORD_TYPE'] != 'available_balance']
+        elif 'SOURCE_ID' in df.columns:
+            df = df[df['SOURCE_ID'].notna()]
+
+        def coluna(nome: str, default=''):
+            return df[nome].tolist() if nome in df.columns else [default] * len(df)
+
+        numeros = [map(safe_float, coluna(nome, 0))
+                   for nome in ('GROSS_AMOUNT', 'MP_FEE_AMOUNT', 'FINANCING_FEE_AMOUNT', 'SHIPPING_FEE_AMOUNT',
+                                'NET_CREDIT_AMOUNT', 'NET_DEBIT_AMOUNT')]
+        for source_id, desc, data, *valores in zip(coluna('SOURCE_ID'), coluna('DESCRIPTION'), coluna('DATE'),
+                                                   *numeros):
+            op_id = clean_id(source_id)
+            if op_id:
+                yield (op_id, str(desc).lower().strip(), IndiceVendas._valor_sql(data), *valores)
+
+    def buscar(self, op_id: str) -> Optional[Dict[str, Any]]:
+        """Breakdown de um op_id ({'payment': {...}, 'refund': [...]}), ou None"""
+        linhas = self.conectar().execute(
+            f"SELECT op_id, descricao, {', '.join(self.CAMPOS)}, net_credit - net_debit, mp_fee + financing_fee "
+            f"FROM liberacoes WHERE op_id = ? ORDER BY rn", (op_id,)
+        ).fetchall()
+        if not linhas:
+            return None
+        # DATE vazia volta a ser NaN, como na leitura em DataFrame
+        return MotorColunar._montar_liberacoes(linhas, {'DATE'})[op_id]
+
+    def ids(self):
+        """op_ids com liberação, na ordem da primeira liberação de cada um"""
+        for op_id, in self.conectar().execute('SELECT op_id FROM liberacoes GROUP BY op_id ORDER BY MIN(rn)'):
+            yield op_id
+
+
+class MapaLiberacoesEmDisco(Mapping):
+    """
+    map_liberacoes sobre um LiberacoesEmDisco: `in`, [] e get() consultam o índice,
+    com os últimos LIBERACOES_CACHE_IDS IDs consultados (inclusive os ausentes) em
+    memória - cada linha do extrato consulta o mesmo ID várias vezes.
+    """
+
+    def __init__(self, liberacoes: LiberacoesEmDisco, cache_ids: int = LIBERACOES_CACHE_IDS):
+        self.liberacoes = liberacoes
+        self._cache_ids = cache_ids
+        self._cache: 'OrderedDict[str, Optional[Dict[str, Any]]]' = OrderedDict()
+
+    def _buscar(self, op_id) -> Optional[Dict[str, Any]]:
+        if op_id in self._cache:
+            self._cache.move_to_end(op_id)
+            return self._cache[op_id]
+        dados = self.liberacoes.buscar(op_id) if isinstance(op_id, str) and op_id else None
+        self._cache[op_id] = dados
+        if len(self._cache) > self._cache_ids:
+            self._cache.popitem(last=False)
+        return dados
+
+    def __contains__(self, op_id) -> bool:
+        return self._buscar(op_id) is not None
+
+    def __getitem__(self, op_id) -> Dict[str, Any]:
+        dados = self._buscar(op_id)
+        if dados is None:
+            raise KeyError(op_id)
+        return dados
+
+    def __len__(self) -> int:
+        return self.liberacoes.total_ids
+
+    def __iter__(self):
+        return self.liberacoes.ids()
+
+
+# ==============================================================================
+# CONCILIAÇÃO PARTICIONADA POR MÊS (fechamentos longos)
+# ==============================================================================
+#
+# Os lançamentos de uma linha do extrato dependem só da própria linha, dos mapas
+# (origem, VENDAS, PÓS-VENDA, LIBERAÇÕES) e dos IDs com várias linhas no extrato.
+# Com por_mes, os mapas são montados uma vez, o extrato é particionado pelo mês da
+# RELEASE_DATE e cada mês é conciliado em um processo próprio; as previsões rodam
+# no processo atual enquanto isso.
+
+PARTICAO_SEM_DATA = 'sem_data'  # Linhas do extrato com RELEASE_DATE inválida
+
+# Livros gerados a partir do extrato (concatenados mês a mês); a previsão vem do
+# DINHEIRO EM CONTA e é calculada uma única vez
+LIVROS_POR_MES = ('confirmados', 'pagamentos', 'transferencias', 'nao_classificados', 'divergencias_fallback')
+
+_contexto_mes: Dict[str, Any] = {}  # Mapas e parâmetros do processo de mês (iniciar_processo_mes)
+
+
+def particionar_extrato_por_mes(extrato: 'pd.DataFrame') -> Dict[str, 'pd.DataFrame']:
+    """{'AAAA-MM': linhas do extrato daquele mês}, em ordem cronológica"""
+    datas = pd.to_datetime(extrato['RELEASE_DATE'], dayfirst=True, errors='coerce')
+    meses = datas.dt.strftime('%Y-%m').fillna(PARTICAO_SEM_DATA)
+    return {mes: parte for mes, parte in extrato.groupby(meses, sort=True)}
+
+
+def iniciar_processo_mes(contexto: Dict[str, Any]):
+    """Initializer dos processos de mês: recebe os mapas uma única vez por processo"""
+    logger.setLevel(logging.WARNING)  # O log por fase de cada mês só repetiria o do processo principal
+    _contexto_mes.update(contexto)
+
+
+def conciliar_mes(extrato_mes: 'pd.DataFrame',
+                  contexto: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], DiagnosticosConciliacao]:
+    """Concilia as linhas de um mês do extrato com os mapas de `contexto` (padrão: _contexto_mes)"""
+    contexto = contexto or _contexto_mes
+    diagnosticos = DiagnosticosConciliacao(guardar_todos=contexto['guardar_diagnosticos'])
+    vazio = pd.DataFrame()
+    resultado = processar_conciliacao(
+        {'dinheiro': vazio, 'vendas': vazio, 'pos_venda': vazio, 'liberacoes': vazio, 'extrato': extrato_mes},
+        centro_custo=contexto['centro_custo'], diagnosticos=diagnosticos,
+        indices=contexto['indices'], ids_multiplos_extrato=contexto['ids_multiplos'],
+    )
+    return resultado, diagnosticos
+
+
+def processar_conciliacao_por_mes(arquivos: Dict[str, 'pd.DataFrame'], centro_custo: str = "NETAIR",
+                                  progresso: Optional[Callable[[str], None]] = None,
+                                  diagnosticos: Optional[DiagnosticosConciliacao] = None,
+                                  indice_vendas: Optional['IndiceVendas'] = None,
+                                  motor: Optional[str] = None,
+                                  processos: Optional[int] = None) -> Dict[str, Any]:
+    """
+    processar_conciliacao com o extrato particionado por mês da RELEASE_DATE.
+
+    As fases 1 e 2 (indexar_relatorios) rodam uma vez; cada mês é conciliado em um
+    processo (até `processos`, padrão PROCESSOS_POR_MES, limitado às CPUs) e as
+    previsões rodam aqui em paralelo - por isso a fase 'previsoes' fica dentro da fase 'extrato'. Os
+    lançamentos são os mesmos de processar_conciliacao (bench/equivalencia.py),
+    concatenados em ordem cronológica.
+
+    Returns:
+        O mesmo de processar_conciliacao, mais 'por_mes' ({'AAAA-MM': livros do
+        mês}) e stats['meses'] (lançamentos confirmados por mês)
+    """
+    resumir_diagnosticos = diagnosticos is None
+    if diagnosticos is None:
+        diagnosticos = DiagnosticosConciliacao()
+
+    indices = indexar_relatorios(arquivos, motor=motor, indice_vendas=indice_vendas, progresso=progresso)
+    if progresso:
+        progresso('extrato')
+
+    extrato = arquivos['extrato']
+    extrato['ID'] = ids_do_extrato(extrato)
+    contagem_ids = extrato.groupby('ID').size()
+    ids_multiplos = set(contagem_ids[contagem_ids > 1].index)
+    particoes = particionar_extrato_por_mes(extrato)
+
+    # Os processos de mês recebem cópias simples dos mapas: os IDs do extrato que
+    # só existem no índice persistente são resolvidos antes, aqui
+    map_vendas, map_pos_venda = indices['vendas'], indices['pos_venda']
+    if indice_vendas is not None:
+        map_vendas.carregar(contagem_ids.index)
+        map_pos_venda.carregar(contagem_ids.index)
+    vendas_do_indice = indices['vendas_do_indice']
+    indices_mes = {
+        'origem_venda': indices['origem_venda'],
+        'vendas': dict(map_vendas),
+        'pos_venda': dict(map_pos_venda),
+        'liberacoes': indices['liberacoes'],
+        'vendas_do_indice': set(vendas_do_indice) if vendas_do_indice is not None else None,
+        'stats_indice': None,
+    }
+
+    contexto = {'indices': indices_mes, 'centro_custo': centro_custo, 'ids_multiplos': ids_multiplos,
+                'guardar_diagnosticos': diagnosticos.guardar_todos}
+
+    # Com um só processo útil (um mês ou uma CPU), criar processos só custaria o
+    # tempo de importação: os meses rodam aqui, um após o outro
+    processos = min(processos or PROCESSOS_POR_MES, len(particoes), os.cpu_count() or 1)
+    executor = None
+    if processos > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=processos,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=iniciar_processo_mes,
+            initargs=(contexto,),
+        )
+    try:
+        if executor:
+            futuros = {mes: executor.submit(conciliar_mes, parte) for mes, parte in particoes.items()}
+        # Previsões (DINHEIRO EM CONTA) no processo atual, com o extrato vazio
+        resultado = processar_conciliacao(
+            {'dinheiro': arquivos['dinheiro'], 'extrato': extrato.iloc[0:0].copy()},
+            centro_custo=centro_custo, diagnosticos=diagnosticos, indices=indices,
+            ids_multiplos_extrato=ids_multiplos,
+        )
+        por_mes = {}
+        for mes, parte in particoes.items():
+            if executor:
+                resultado_mes, diagnosticos_mes = futuros[mes].result()
+            else:
+                resultado_mes, diagnosticos_mes = conciliar_mes(parte, contexto)
+            diagnosticos.mesclar(diagnosticos_mes)
+            por_mes[mes] = {livro: resultado_mes[livro] for livro in LIVROS_POR_MES}
+    finally:
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    stats = resultado['stats']
+    for livro in LIVROS_POR_MES:
+        resultado[livro] = [row for livros in por_mes.values() for row in livros[livro]]
+        stats[livro] = len(resultado[livro])
+    stats['fallbacks'] = {tipo: diagnosticos.contagens.get(tipo, 0) for tipo in stats['fallbacks']}
+    stats['meses'] = {mes: len(livros['confirmados']) for mes, livros in por_mes.items()}
+    resultado['por_mes'] = por_mes
+    logger.info(f"Conciliação por mês: {stats['confirmados']} transações confirmadas em {len(por_mes)} mês(es), "
+                f"{processos} processo(s)")
+
+    if resumir_diagnosticos:
+        diagnosticos.resumir()
+    return resultado
+
+
+# ==============================================================================
+# PROFILING SOB DEMANDA (profile=true no /conciliar)
+# ==============================================================================
+
+class AmostradorPilhas:
+    """
+    Amostra periodicamente a pilha da thread que executa a conciliação e acumula
+    as pilhas no formato "colapsado" (frame;frame;frame contagem), aceito pelo
+    flamegraph.pl, speedscope e similares.
+    """
+
+    def __init__(self, intervalo: float = 0.005):
+        self.intervalo = intervalo
+        self.pilhas: Dict[str, int] = defaultdict(int)
+        self._thread_alvo = threading.get_ident()
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _amostrar(self):
+        while not self._parar.wait(self.intervalo):
+            frame = sys._current_frames().get(self._thread_alvo)
+            pilha = []
+            while frame is not None:
+                codigo = frame.f_code
+                nome = f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+                pilha.append(nome.replace(';', ','))
+                frame = frame.f_back
+            if pilha:
+                self.pilhas[';'.join(reversed(pilha))] += 1
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._amostrar, daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread:
+            self._thread.join()
+
+    def gravar(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            for pilha, contagem in sorted(self.pilhas.items()):
+                f.write(f"{pilha} {contagem}\n")
+
+
+class PerfilConciliacao:
+    """
+    Perfil de uma execução: cProfile (pstats), pilhas amostradas e pico de memória
+    alocada (tracemalloc) por fase. Cobre processar_conciliacao e os escritores.
+    """
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.amostrador = AmostradorPilhas()
+        self.memoria_fases: List[Dict[str, Any]] = []
+        self._fase_atual = 'inicio'
+        self._inicio_fase = 0.0
+
+    def iniciar(self):
+        tracemalloc.start()
+        self._inicio_fase = time.perf_counter()
+        self.amostrador.iniciar()
+        self.profiler.enable()
+
+    def marcar_fase(self, fase: str):
+        """Fecha a fase atual registrando o pico de memória e reinicia o pico"""
+        if not tracemalloc.is_tracing():
+            return
+        atual, pico = tracemalloc.get_traced_memory()
+        agora = time.perf_counter()
+        self.memoria_fases.append({
+            'fase': self._fase_atual,
+            'segundos': agora - self._inicio_fase,
+            'pico_bytes': pico,
+            'atual_bytes': atual,
+        })
+        tracemalloc.reset_peak()
+        self._fase_atual = fase
+        self._inicio_fase = agora
+
+    def encerrar(self):
+        self.profiler.disable()
+        self.amostrador.parar()
+        self.marcar_fase(None)
+        tracemalloc.stop()
+
+    def gravar(self, diretorio: str) -> Dict[str, str]:
+        """Grava os arquivos de perfil e retorna {caminho_no_zip: caminho_local}"""
+        os.makedirs(diretorio, exist_ok=True)
+        arquivos = {}
+
+        path = os.path.join(diretorio, 'conciliacao.pstats')
+        self.profiler.dump_stats(path)
+        arquivos['Profiling/conciliacao.pstats'] = path
+
+        path = os.path.join(diretorio, 'top_funcoes.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            pstats.Stats(self.profiler, stream=f).sort_stats('cumulative').print_stats(60)
+        arquivos['Profiling/top_funcoes.txt'] = path
+
+        path = os.path.join(diretorio, 'pilhas_colapsadas.txt')
+        self.amostrador.gravar(path)
+        arquivos['Profiling/pilhas_colapsadas.txt'] = path
+
+        path = os.path.join(diretorio, 'memoria_por_fase.csv')
+        pd.DataFrame([
+            {
+                'Fase': m['fase'],
+                'Segundos': round(m['segundos'], 4),
+                'Pico Alocado (MB)': round(m['pico_bytes'] / 1048576, 2),
+                'Alocado ao Fim (MB)': round(m['atual_bytes'] / 1048576, 2),
+            }
+            for m in self.memoria_fases
+        ]).to_csv(path, sep=';', index=False, encoding='utf-8-sig')
+        arquivos['Profiling/memoria_por_fase.csv'] = path
+
+        return arquivos
+
+
+# ==============================================================================
+# LEITURA DOS RELATÓRIOS
+# ==============================================================================
+
+def ler_csv(content: bytes, key: str, skip_rows: int = 0, clean_json: bool = False) -> 'pd.DataFrame':
+    """
+    Lê um arquivo CSV ou ZIP contendo múltiplos CSVs.
+
+    Se o arquivo for um ZIP, extrai todos os CSVs e concatena em um único DataFrame.
+    Isso é útil quando períodos longos geram múltiplos arquivos compactados.
+    """
+    # Verificar se é um arquivo ZIP
+    if is_zip_file(content):
+        logger.info(f"Arquivo '{key}' detectado como ZIP - extraindo e concatenando CSVs...")
+        return extrair_csvs_do_zip(content, skip_rows=skip_rows, clean_json=clean_json, key=key)
+
+    # Processar como CSV normal
+    content_str = content.decode('utf-8')
+
+    if clean_json:
+        # Remove campos JSON mal formatados (METADATA com aspas internas não escapadas)
+        # Pattern captura desde "{ até }" incluindo JSON aninhado
+        content_str = re.sub(r'"\{[^}]*(?:\{[^}]*\}[^}]*)*\}"', '""', content_str)
+
+    # Detectar separador automaticamente (verifica primeira linha após skip_rows)
+    lines = content_str.split('\n')
+    header_line = lines[skip_rows] if len(lines) > skip_rows else lines[0]
+
+    # Conta ocorrências de ; e , na linha de cabeçalho (fora de aspas)
+    sep = ';' if header_line.count(';') > header_line.count(',') else ','
+
+    return pd.read_csv(
+        io.StringIO(content_str),
+        sep=sep,
+        skiprows=skip_rows,
+        on_bad_lines='skip',
+        index_col=False
+    )
+
+
+class TextoEmBlocos(io.TextIOBase):
+    """
+    Stream de texto para o pd.read_csv lido em blocos de linhas inteiras; com
+    `limpar_json`, o METADATA malformado é removido de cada bloco (a mesma regex de
+    ler_csv, aplicada bloco a bloco em vez de no arquivo inteiro).
+    """
+
+    TAMANHO_BLOCO = 1 << 20  # caracteres lidos por vez
+    JSON_MALFORMADO = re.compile(r'"\{[^}]*(?:\{[^}]*\}[^}]*)*\}"')
+
+    def __init__(self, texto: io.TextIOBase, inicio: str = '', limpar_json: bool = False):
+        self._texto = texto
+        self._limpar_json = limpar_json
+        self._pendente = ''  # Linha incompleta do último bloco
+        self._buffer = self._limpar(inicio)
+
+    def _limpar(self, conteudo: str) -> str:
+        return self.JSON_MALFORMADO.sub('""', conteudo) if self._limpar_json else conteudo
+
+    def _ler_bloco(self) -> bool:
+        bloco = self._texto.read(self.TAMANHO_BLOCO)
+        if not bloco:
+            if not self._pendente:
+                return False
+            bloco, self._pendente = self._pendente, ''
+        else:
+            bloco = self._pendente + bloco
+            corte = bloco.rfind('\n') + 1
+            bloco, self._pendente = bloco[:corte], bloco[corte:]
+        self._buffer += self._limpar(bloco)
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: Optional[int] = -1) -> str:
+        while (size is None or size < 0 or len(self._buffer) < size) and self._ler_bloco():
+            pass
+        if size is None or size < 0:
+            size = len(self._buffer)
+        conteudo, self._buffer = self._buffer[:size], self._buffer[size:]
+        return conteudo
+
+
+def ler_csv_stream(binario, clean_json: bool = False, linhas_por_parte: Optional[int] = None):
+    """
+    ler_csv sobre um arquivo binário aberto, sem carregá-lo inteiro: o texto é
+    decodificado em stream (io.TextIOWrapper) e vai direto para o pd.read_csv.
+    Com `linhas_por_parte`, retorna um iterador de DataFrames (chunksize); um
+    arquivo vazio não tem partes.
+    """
+    texto = io.TextIOWrapper(binario, encoding='utf-8', newline='')
+    cabecalho = texto.readline()
+    if not cabecalho and linhas_por_parte:
+        return iter(())
+    sep = ';' if cabecalho.count(';') > cabecalho.count(',') else ','
+    return pd.read_csv(
+        TextoEmBlocos(texto, cabecalho, limpar_json=clean_json),
+        sep=sep,
+        on_bad_lines='skip',
+        index_col=False,
+        chunksize=linhas_por_parte
+    )
+
+
+def ler_csv_arquivo(caminho: str, key: str, clean_json: bool = False,
+                    formato: Optional[str] = None) -> 'pd.DataFrame':
+    """
+    ler_csv de um relatório salvo em disco. O CSV (também gzip/zstd, descompactado
+    em stream) vai direto para o pd.read_csv (ler_csv_stream): o pico de memória é
+    o do DataFrame, não o do texto descompactado. ZIP, compactado ou não, segue por
+    extrair_csvs_do_zip, que precisa dos bytes.
+    """
+    with abrir_relatorio(caminho, formato) as f:
+        if is_zip_file(f.peek(4)[:4]):
+            return ler_csv(f.read(), key, clean_json=clean_json)
+        return ler_csv_stream(f, clean_json=clean_json)
+
+
+def ler_extrato(content: bytes,
+                diagnosticos: Optional[DiagnosticosConciliacao] = None) -> Tuple['pd.DataFrame', float]:
+    """
+    Lê o arquivo de extrato (account_statement) com tratamento especial para
+    linhas que têm campos extras devido a separadores no nome da empresa.
+
+    O extrato tem 5 colunas:
+    RELEASE_DATE;TRANSACTION_TYPE;REFERENCE_ID;TRANSACTION_NET_AMOUNT;PARTIAL_BALANCE
+
+    Quando o TRANSACTION_TYPE contém ';', a linha fica com mais de 5 campos.
+    Esta função junta os campos extras no TRANSACTION_TYPE. Linhas corrigidas e
+    ignoradas são registradas em `diagnosticos`.
+
+    Returns:
+        Tuple[DataFrame, float]: (DataFrame com transações, saldo_inicial)
+    """
+    # Verificar se é ZIP
+    if is_zip_file(content):
+        logger.info("Arquivo 'extrato' detectado como ZIP - extraindo e concatenando CSVs...")
+        # Para ZIP, usar tratamento padrão por enquanto (sem saldo inicial)
+        return extrair_csvs_do_zip(content, skip_rows=3, clean_json=False, key='extrato'), 0.0
+
+    content_str = content.decode('utf-8')
+    lines = content_str.split('\n')
+
+    # Pular as 3 primeiras linhas (cabeçalho resumo)
+    # Linha 0: INITIAL_BALANCE;CREDITS;DEBITS;FINAL_BALANCE
+    # Linha 1: valores
+    # Linha 2: vazia
+    # Linha 3: cabeçalho das colunas (RELEASE_DATE;TRANSACTION_TYPE;...)
+
+    if len(lines) < 4:
+        raise ValueError("Arquivo de extrato inválido - menos de 4 linhas")
+
+    # Extrair saldo inicial da linha 1
+    saldo_inicial = 0.0
+    try:
+        valores_resumo = lines[1].strip().split(';')
+        if valores_resumo:
+            # INITIAL_BALANCE está na primeira posição
+            saldo_str = valores_resumo[0].replace('.', '').replace(',', '.')
+            saldo_inicial = float(saldo_str)
+            logger.info(f"Extrato: Saldo inicial = R$ {saldo_inicial:.2f}")
+    except (ValueError, IndexError) as e:
+        logger.warning(f"Extrato: Não foi possível extrair saldo inicial: {e}")
+
+    header = lines[3].strip().split(';')
+    expected_cols = 5  # RELEASE_DATE, TRANSACTION_TYPE, REFERENCE_ID, TRANSACTION_NET_AMOUNT, PARTIAL_BALANCE
+
+    data_rows = []
+    linhas_corrigidas = 0
+
+    for line_num, line in enumerate(lines[4:], start=5):
+        line = line.strip()
+        if not line:
+            continue
+
+        campos = line.split(';')
+
+        if len(campos) == expected_cols:
+            # Linha normal
+            data_rows.append(campos)
+        elif len(campos) > expected_cols:
+            # Linha com campos extras - juntar os extras no TRANSACTION_TYPE
+            # campos[0] = RELEASE_DATE
+            # campos[1:-3] = partes do TRANSACTION_TYPE
+            # campos[-3] = REFERENCE_ID
+            # campos[-2] = TRANSACTION_NET_AMOUNT
+            # campos[-1] = PARTIAL_BALANCE
+            extra_count = len(campos) - expected_cols
+            transaction_type_parts = campos[1:2+extra_count]
+            transaction_type = ' '.join(transaction_type_parts)
+
+            fixed_row = [
+                campos[0],                    # RELEASE_DATE
+                transaction_type,             # TRANSACTION_TYPE (juntado)
+                campos[-3],                   # REFERENCE_ID
+                campos[-2],                   # TRANSACTION_NET_AMOUNT
+                campos[-1]                    # PARTIAL_BALANCE
+            ]
+            data_rows.append(fixed_row)
+            linhas_corrigidas += 1
+            if diagnosticos:
+                diagnosticos.registrar('extrato_linha_corrigida', linha=line_num, campos=len(campos))
+        elif diagnosticos:
+            # Linha com menos campos que o esperado - ignorar
+            diagnosticos.registrar('extrato_linha_ignorada', linha=line_num, campos=len(campos))
+
+    if linhas_corrigidas > 0:
+        logger.info(f"Extrato: {linhas_corrigidas} linha(s) com campos extras foram corrigidas")
+
+    df = pd.DataFrame(data_rows, columns=header[:expected_cols])
+    return df, saldo_inicial
+
+
+def saldo_inicial_colunar(extrato: 'pd.DataFrame') -> float:
+    """
+    Saldo inicial de um extrato Parquet/Arrow (sem o cabeçalho INITIAL_BALANCE do
+    CSV): saldo parcial da primeira linha menos o valor dela.
+    """
+    if extrato.empty or not {'PARTIAL_BALANCE', 'TRANSACTION_NET_AMOUNT'} <= set(extrato.columns):
+        return 0.0
+    primeira = extrato.iloc[0]
+    saldo_inicial = (clean_float_extrato(primeira['PARTIAL_BALANCE'])
+                     - clean_float_extrato(primeira['TRANSACTION_NET_AMOUNT']))
+    logger.info(f"Extrato: Saldo inicial = R$ {saldo_inicial:.2f} (saldo parcial da primeira linha)")
+    return round(saldo_inicial, 2)
+
+
+# ==============================================================================
+# PIPELINE COMPLETO (executado nos workers do pool de processos)
+# ==============================================================================
+
+class ErroConciliacao(Exception):
+    """
+    Erro do pipeline com o status HTTP correspondente.
+
+    Os argumentos ficam em `args` para que a exceção possa ser serializada (pickle)
+    e devolvida do worker para o processo da API.
+    """
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def carregar_arquivos(caminhos: Dict[str, str], medicao: Optional[MedicaoConciliacao] = None,
+                      diagnosticos: Optional[DiagnosticosConciliacao] = None) -> Tuple[Dict[str, 'pd.DataFrame'], float]:
+    """
+    Lê os relatórios enviados a partir dos arquivos salvos em disco. CSV e ZIP
+    podem vir compactados com gzip ou zstd; Parquet e Arrow IPC são carregados
+    direto (ler_relatorio_colunar). Os CSVs vão do arquivo (descompactado em stream)
+    direto para o pd.read_csv (ler_csv_arquivo), sem o conteúdo inteiro em memória;
+    o extrato, cujo leitor corrige linha a linha, e os ZIPs são lidos para bytes.
+
+    Args:
+        caminhos: {nome_relatorio: caminho_local} - 'retirada' é opcional
+        medicao: Coletor de tempos (leitura_<relatorio>) e linhas lidas
+        diagnosticos: Coletor das linhas corrigidas/ignoradas do extrato e das linhas
+                      repetidas entre CSVs de um ZIP (por CSV)
+
+    Returns:
+        Tuple[Dict[str, DataFrame], float]: (DataFrames dos relatórios, saldo inicial do extrato)
+    """
+    formatos = {key: formato_do_arquivo(caminho) for key, caminho in caminhos.items() if caminho}
+
+    def ler_bytes(key: str) -> bytes:
+        with abrir_relatorio(caminhos[key], formatos[key]) as f:
+            return f.read()
+
+    def ler_csv_do_arquivo(key: str, clean_json: bool = False) -> 'pd.DataFrame':
+        return ler_csv_arquivo(caminhos[key], key, clean_json=clean_json, formato=formatos[key])
+
+    def colunar(key: str) -> bool:
+        return formatos[key] in FORMATOS_COLUNARES
+
+    medicao = medicao or MedicaoConciliacao()
+    arquivos = {}
+
+    # Carregar arquivos obrigatórios
+    for key, clean_json in [('dinheiro', True), ('vendas', False), ('pos_venda', False), ('liberacoes', True)]:
+        try:
+            with medicao.fase(f'leitura_{key}'):
+                if (key == 'liberacoes' and LIBERACOES_EM_DISCO_BYTES
+                        and tamanho_descompactado(caminhos[key]) > LIBERACOES_EM_DISCO_BYTES):
+                    arquivos[key] = LiberacoesEmDisco.importar(caminhos[key], clean_json=clean_json)
+                elif colunar(key):
+                    arquivos[key] = ler_relatorio_colunar(caminhos[key], formatos[key])
+                else:
+                    arquivos[key] = ler_csv_do_arquivo(key, clean_json=clean_json)
+        except Exception as e:
+            raise ErroConciliacao(400, f"Erro ao processar arquivo '{key}': {str(e)}")
+
+    try:
+        with medicao.fase('leitura_extrato'):
+            if colunar('extrato'):
+                arquivos['extrato'] = ler_relatorio_colunar(caminhos['extrato'], formatos['extrato'])
+                saldo_inicial_extrato = saldo_inicial_colunar(arquivos['extrato'])
+            else:
+                arquivos['extrato'], saldo_inicial_extrato = ler_extrato(ler_bytes('extrato'), diagnosticos)
+    except Exception as e:
+        fechar_liberacoes_em_disco(arquivos)
+        raise ErroConciliacao(400, f"Erro ao processar arquivo 'extrato': {str(e)}")
+
+    # Arquivo opcional
+    if caminhos.get('retirada'):
+        try:
+            with medicao.fase('leitura_retirada'):
+                if colunar('retirada'):
+                    arquivos['retirada'] = ler_relatorio_colunar(caminhos['retirada'], formatos['retirada'])
+                else:
+                    arquivos['retirada'] = ler_csv_do_arquivo('retirada')
+        except:
+            arquivos['retirada'] = pd.DataFrame()
+    else:
+        arquivos['retirada'] = pd.DataFrame()
+
+    for key, df in arquivos.items():
+        medicao.contar('conciliador_linhas_processadas_total', len(df), relatorio=key)
+        for arquivo, linhas in df.attrs.get('linhas_duplicadas', {}).items():
+            medicao.contar('conciliador_linhas_duplicadas_total', linhas, relatorio=key)
+            if diagnosticos:
+                diagnosticos.registrar('zip_linhas_duplicadas', relatorio=key, arquivo=arquivo, linhas=linhas)
+
+    return arquivos, saldo_inicial_extrato
+
+
+def fechar_liberacoes_em_disco(arquivos: Dict[str, Any]):
+    """Remove o SQLite temporário do LIBERAÇÕES lido fora da memória, se houver"""
+    if isinstance(arquivos.get('liberacoes'), LiberacoesEmDisco):
+        arquivos['liberacoes'].fechar(remover=True)
+
+
+def gerar_arquivos_saida(resultado: Dict[str, Any], saldo_inicial_extrato: float, temp_dir: str,
+                         medicao: Optional[MedicaoConciliacao] = None,
+                         diagnosticos: Optional[DiagnosticosConciliacao] = None,
+                         ofx_exportados: Optional[set] = None) -> Dict[str, str]:
+    """
+    Gera os arquivos de saída organizados por pasta.
+
+    Estrutura:
+        Conta Azul/  - Arquivos principais para importação
+        Resumo/      - Arquivos resumidos (agrupados por data/categoria)
+        Outros/      - CSVs, OFX e arquivos auxiliares
+
+    O tempo de cada escritor (gerar_*) é registrado em `medicao`. Se `diagnosticos`
+    guardou todos os eventos, o detalhe vai para Outros/DIAGNOSTICOS.csv. Com
+    `ofx_exportados` (FITIDs já exportados) o OFX é incremental.
+
+    Returns:
+        {caminho_no_zip: caminho_local}
+    """
+    medicao = medicao or MedicaoConciliacao()
+    arquivos_gerados = {}  # {caminho_no_zip: caminho_local}
+
+    # =====================================================================
+    # PASTA: Conta Azul (arquivos principais para importação)
+    # =====================================================================
+    with medicao.escrita('gerar_xlsx_completo', 'Conta Azul/CONFIRMADOS.xlsx'):
         if gerar_xlsx_completo(resultado['confirmados'], os.path.join(temp_dir, 'CONFIRMADOS.xlsx')):
             arquivos_gerados['Conta Azul/CONFIRMADOS.xlsx'] = os.path.join(temp_dir, 'CONFIRMADOS.xlsx')
 
-        # XLSX de transferências e pagamentos voltam para a pasta principal
+    # XLSX de transferências e pagamentos voltam para a pasta principal
+    with medicao.escrita('gerar_xlsx_completo', 'Conta Azul/TRANSFERENCIAS.xlsx'):
         if gerar_xlsx_completo(resultado['transferencias'], os.path.join(temp_dir, 'TRANSFERENCIAS.xlsx')):
             arquivos_gerados['Conta Azul/TRANSFERENCIAS.xlsx'] = os.path.join(temp_dir, 'TRANSFERENCIAS.xlsx')
 
+    with medicao.escrita('gerar_xlsx_completo', 'Conta Azul/PAGAMENTO_CONTAS.xlsx'):
         if gerar_xlsx_completo(resultado['pagamentos'], os.path.join(temp_dir, 'PAGAMENTO_CONTAS.xlsx')):
             arquivos_gerados['Conta Azul/PAGAMENTO_CONTAS.xlsx'] = os.path.join(temp_dir, 'PAGAMENTO_CONTAS.xlsx')
 
-        # =====================================================================
-        # PASTA: Resumo (arquivos agrupados por data/categoria)
-        # =====================================================================
-        if gerar_xlsx_resumo(resultado['confirmados'], os.path.join(temp_dir, 'CONFIRMADOS_RESUMO.xlsx')):
-            arquivos_gerados['Resumo/CONFIRMADOS_RESUMO.xlsx'] = os.path.join(temp_dir, 'CONFIRMADOS_RESUMO.xlsx')
-
-        if gerar_xlsx_resumo(resultado['previsao'], os.path.join(temp_dir, 'PREVISAO_RESUMO.xlsx')):
-            arquivos_gerados['Resumo/PREVISAO_RESUMO.xlsx'] = os.path.join(temp_dir, 'PREVISAO_RESUMO.xlsx')
-
-        if gerar_xlsx_resumo(resultado['transferencias'], os.path.join(temp_dir, 'TRANSFERENCIAS_RESUMO.xlsx')):
-            arquivos_gerados['Resumo/TRANSFERENCIAS_RESUMO.xlsx'] = os.path.join(temp_dir, 'TRANSFERENCIAS_RESUMO.xlsx')
-
-        if gerar_xlsx_resumo(resultado['pagamentos'], os.path.join(temp_dir, 'PAGAMENTO_CONTAS_RESUMO.xlsx')):
-            arquivos_gerados['Resumo/PAGAMENTO_CONTAS_RESUMO.xlsx'] = os.path.join(temp_dir, 'PAGAMENTO_CONTAS_RESUMO.xlsx')
-
-        # =====================================================================
-        # PASTA: Outros (CSVs e arquivos auxiliares)
-        # =====================================================================
+    # =====================================================================
+    # PASTA: Resumo (arquivos agrupados por data/categoria)
+    # Todos os livros são agregados em uma única passada
+    # =====================================================================
+    with medicao.escrita('agregar_resumos', 'Resumo/'):
+        resumos = agregar_resumos({
+            'CONFIRMADOS': resultado['confirmados'],
+            'PREVISAO': resultado['previsao'],
+            'TRANSFERENCIAS': resultado['transferencias'],
+            'PAGAMENTO_CONTAS': resultado['pagamentos'],
+        })
+    for nome_livro, df_resumo in resumos.items():
+        resumo_path = os.path.join(temp_dir, f'{nome_livro}_RESUMO.xlsx')
+        with medicao.escrita('gerar_xlsx_resumo_agrupado', f'Resumo/{nome_livro}_RESUMO.xlsx'):
+            if gerar_xlsx_resumo_agrupado(df_resumo, resumo_path):
+                arquivos_gerados[f'Resumo/{nome_livro}_RESUMO.xlsx'] = resumo_path
+
+    # =====================================================================
+    # PASTA: Outros (CSVs e arquivos auxiliares)
+    # =====================================================================
+    with medicao.escrita('gerar_csv_conta_azul', 'Outros/CONFIRMADOS.csv'):
         if gerar_csv_conta_azul(resultado['confirmados'], os.path.join(temp_dir, 'CONFIRMADOS.csv')):
             arquivos_gerados['Outros/CONFIRMADOS.csv'] = os.path.join(temp_dir, 'CONFIRMADOS.csv')
 
+    with medicao.escrita('gerar_csv_conta_azul', 'Outros/PREVISAO.csv'):
         if gerar_csv_conta_azul(resultado['previsao'], os.path.join(temp_dir, 'PREVISAO.csv')):
             arquivos_gerados['Outros/PREVISAO.csv'] = os.path.join(temp_dir, 'PREVISAO.csv')
 
+    with medicao.escrita('gerar_csv_conta_azul', 'Outros/PAGAMENTO_CONTAS.csv'):
         if gerar_csv_conta_azul(resultado['pagamentos'], os.path.join(temp_dir, 'PAGAMENTO_CONTAS.csv')):
             arquivos_gerados['Outros/PAGAMENTO_CONTAS.csv'] = os.path.join(temp_dir, 'PAGAMENTO_CONTAS.csv')
 
+    with medicao.escrita('gerar_csv_conta_azul', 'Outros/TRANSFERENCIAS.csv'):
         if gerar_csv_conta_azul(resultado['transferencias'], os.path.join(temp_dir, 'TRANSFERENCIAS.csv')):
             arquivos_gerados['Outros/TRANSFERENCIAS.csv'] = os.path.join(temp_dir, 'TRANSFERENCIAS.csv')
 
-        # V2.5.1: Gerar arquivo de divergências para conferência
-        if resultado.get('divergencias_fallback'):
-            div_path = os.path.join(temp_dir, 'DIVERGENCIAS_FALLBACK.csv')
+    # V2.5.1: Gerar arquivo de divergências para conferência
+    if resultado.get('divergencias_fallback'):
+        div_path = os.path.join(temp_dir, 'DIVERGENCIAS_FALLBACK.csv')
+        with medicao.escrita('to_csv', 'Outros/DIVERGENCIAS_FALLBACK.csv'):
             df_div = pd.DataFrame(resultado['divergencias_fallback'])
             df_div.to_csv(div_path, sep=';', index=False, encoding='utf-8-sig')
-            arquivos_gerados['Outros/DIVERGENCIAS_FALLBACK.csv'] = div_path
-            logger.info(f"Gerado arquivo de divergências com {len(resultado['divergencias_fallback'])} registros")
+        arquivos_gerados['Outros/DIVERGENCIAS_FALLBACK.csv'] = div_path
+        logger.info(f"Gerado arquivo de divergências com {len(resultado['divergencias_fallback'])} registros")
 
+    with medicao.escrita('gerar_xlsx_completo', 'Outros/PREVISAO.xlsx'):
         if gerar_xlsx_completo(resultado['previsao'], os.path.join(temp_dir, 'PREVISAO.xlsx')):
             arquivos_gerados['Outros/PREVISAO.xlsx'] = os.path.join(temp_dir, 'PREVISAO.xlsx')
 
-        # Gerar OFX completo (confirmados + transferencias + pagamentos) com saldo inicial
-        todas_transacoes = resultado['confirmados'] + resultado['transferencias'] + resultado['pagamentos']
-        if gerar_ofx_mercadopago(todas_transacoes, os.path.join(temp_dir, 'EXTRATO_MERCADOPAGO.ofx'), saldo_inicial_extrato):
+    # Gerar OFX completo (confirmados + transferencias + pagamentos) com saldo inicial
+    todas_transacoes = transacoes_ofx(resultado)
+    with medicao.escrita('gerar_ofx_mercadopago', 'Outros/EXTRATO_MERCADOPAGO.ofx'):
+        if gerar_ofx_mercadopago(todas_transacoes, os.path.join(temp_dir, 'EXTRATO_MERCADOPAGO.ofx'), saldo_inicial_extrato,
+                                 ofx_exportados):
             arquivos_gerados['Outros/EXTRATO_MERCADOPAGO.ofx'] = os.path.join(temp_dir, 'EXTRATO_MERCADOPAGO.ofx')
 
-        if not arquivos_gerados:
-            raise HTTPException(status_code=500, detail="Nenhum arquivo foi gerado. Verifique os dados de entrada.")
+    if diagnosticos and diagnosticos.guardar_todos:
+        with medicao.escrita('gravar_csv', 'Outros/DIAGNOSTICOS.csv'):
+            if diagnosticos.gravar_csv(os.path.join(temp_dir, 'DIAGNOSTICOS.csv')):
+                arquivos_gerados['Outros/DIAGNOSTICOS.csv'] = os.path.join(temp_dir, 'DIAGNOSTICOS.csv')
 
-        # Criar ZIP em memória com estrutura de pastas
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for caminho_zip, caminho_local in arquivos_gerados.items():
-                zip_file.write(caminho_local, caminho_zip)
+    return arquivos_gerados
 
-        zip_buffer.seek(0)
 
-        # Gerar nome do arquivo com timestamp
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"conciliacao_{timestamp}.zip"
+def gerar_arquivos_por_mes(por_mes: Dict[str, Dict[str, List[Dict]]], saldo_inicial_extrato: float,
+                           temp_dir: str, medicao: Optional[MedicaoConciliacao] = None) -> Dict[str, str]:
+    """
+    Arquivos de saída de cada mês (processar_conciliacao_por_mes) em Meses/AAAA-MM/,
+    com a mesma estrutura de gerar_arquivos_saida (sem previsões). O OFX de cada mês
+    começa no saldo do fim do mês anterior.
 
-        return StreamingResponse(
-            zip_buffer,
-            media_type="application/zip",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}",
-                "X-Stats-Confirmados": str(resultado['stats']['confirmados']),
-                "X-Stats-Previsao": str(resultado['stats']['previsao']),
-                "X-Stats-Pagamentos": str(resultado['stats']['pagamentos']),
-                "X-Stats-Transferencias": str(resultado['stats']['transferencias']),
-            }
-        )
+    Returns:
+        {caminho_no_zip: caminho_local}
+    """
+    arquivos_gerados = {}
+    saldo = saldo_inicial_extrato
+    for mes, livros in por_mes.items():
+        dir_mes = os.path.join(temp_dir, 'Meses', mes)
+        os.makedirs(dir_mes, exist_ok=True)
+        gerados = gerar_arquivos_saida({**livros, 'previsao': []}, saldo, dir_mes, medicao)
+        arquivos_gerados.update({f'Meses/{mes}/{caminho}': local for caminho, local in gerados.items()})
+        saldo += sum(round(row['Valor'], 2) for livro in ('confirmados', 'transferencias', 'pagamentos')
+                     for row in livros[livro])
+    return arquivos_gerados
 
-    finally:
-        # Limpar diretório temporário
-        shutil.rmtree(temp_dir, ignore_errors=True)
 
+# Livros emitidos no NDJSON, na ordem em que ficam prontos (livros_prontos de
+# processar_conciliacao): os do extrato e depois as previsões
+LIVROS_NDJSON = ['confirmados', 'pagamentos', 'transferencias', 'previsao']
 
-@app.get("/health")
-async def health_check():
-    """Endpoint de health check detalhado"""
+
+def gerar_ndjson_lancamentos(livro: str, rows: List[Dict], output_path: str) -> int:
+    """
+    Acrescenta os lançamentos de um livro ao NDJSON - uma linha por lançamento, com o
+    campo "livro" e os campos de criar_lancamento(). O arquivo é fechado a cada livro:
+    o /conciliar/lancamentos transmite o que já foi gravado enquanto a conciliação
+    continua (transmitir_ndjson).
+
+    Returns:
+        Quantidade de linhas gravadas
+    """
+    with open(output_path, 'a', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps({'livro': livro, **row}, ensure_ascii=False, default=str))
+            f.write('\n')
+    return len(rows)
+
+
+def compactar_arquivos(arquivos_gerados: Dict[str, str]) -> bytes:
+    """Cria o ZIP de saída (em memória) com a estrutura de pastas"""
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for caminho_zip, caminho_local in arquivos_gerados.items():
+            zip_file.write(caminho_local, caminho_zip)
+    return zip_buffer.getvalue()
+
+
+# ==============================================================================
+# DIFERENÇAS ENTRE EXECUÇÕES (relatórios reemitidos)
+# ==============================================================================
+#
+# Quando o Mercado Pago reemite um relatório, a conciliação é refeita e só o que mudou
+# precisa ser reimportado no Conta Azul. Os livros importáveis são os CSVs de Outros/
+# (gerar_csv_conta_azul), que o ZIP de qualquer execução anterior já contém. Cada
+# lançamento tem uma chave (Categoria, Descrição, ocorrência): a Descrição começa
+# pelo ID da operação e a ocorrência numera os lançamentos com a mesma categoria e
+# descrição pelo conteúdo (data de pagamento, valor, demais campos), não pela ordem
+# do livro. O cruzamento (merge, um hash join) tem duas etapas: lançamentos idênticos
+# nos dois livros são inalterados; os que sobram são pareados por categoria,
+# descrição e posição entre as sobras - nos dois = alterado, só no novo = adicionado,
+# só no anterior = removido. Assim, um reembolso parcial a mais para o mesmo ID não
+# desloca os outros lançamentos da operação.
+
+LIVROS_DIFERENCA = {
+    'confirmados': 'Outros/CONFIRMADOS.csv',
+    'previsao': 'Outros/PREVISAO.csv',
+    'pagamentos': 'Outros/PAGAMENTO_CONTAS.csv',
+    'transferencias': 'Outros/TRANSFERENCIAS.csv',
+}
+CHAVE_LANCAMENTO = ['Categoria', 'Descrição', 'Ocorrência']
+
+
+def ler_livros_resultado(conteudo_zip: bytes) -> Dict[str, 'pd.DataFrame']:
+    """
+    {livro: DataFrame} dos CSVs de Outros/ de um ZIP de resultado (/conciliar ou
+    /jobs), com a coluna Ocorrência (numerar_ocorrencias). Livro sem CSV (sem
+    lançamentos) fica vazio.
+
+    Raises:
+        ValueError: se o conteúdo não for um ZIP de resultado da conciliação
+    """
+    try:
+        zip_file = zipfile.ZipFile(io.BytesIO(conteudo_zip))
+    except zipfile.BadZipFile:
+        raise ValueError("Resultado anterior não é um arquivo ZIP válido")
+
+    livros = {}
+    with zip_file:
+        nomes = set(zip_file.namelist())
+        if not any(n.startswith(('Outros/', 'Conta Azul/')) for n in nomes):
+            raise ValueError("ZIP enviado não é um resultado da conciliação (sem Outros/ e Conta Azul/)")
+        for livro, caminho in LIVROS_DIFERENCA.items():
+            if caminho in nomes:
+                with zip_file.open(caminho) as f:
+                    df = pd.read_csv(f, sep=';', encoding='utf-8-sig', dtype=str, keep_default_na=False)
+            else:
+                df = pd.DataFrame(columns=COLUNAS_CSV_CONTA_AZUL, dtype=str)
+            df['Ocorrência'] = numerar_ocorrencias(df, ['Categoria', 'Descrição'])
+            livros[livro] = df
+    return livros
+
+
+def numerar_ocorrencias(df: 'pd.DataFrame', chave: List[str]) -> 'pd.Series':
+    """
+    Posição (0, 1, ...) de cada lançamento entre os de mesma `chave`, pela ordem do
+    conteúdo - data de pagamento, valor e demais campos do CSV - e não pela ordem
+    do livro, que muda quando um relatório reemitido insere ou remove linhas
+    """
+    desempate = [c for c in COLUNAS_CSV_CONTA_AZUL if c in df.columns and c not in chave]
+    ordenado = df.assign(
+        _data=pd.to_datetime(df['Data de Pagamento'], format='%d/%m/%Y', errors='coerce'),
+        _valor=pd.to_numeric(df['Valor'], errors='coerce'),
+    ).sort_values(chave + ['_data', '_valor'] + desempate, kind='stable')
+    return ordenado.groupby(chave, sort=False).cumcount().reindex(df.index)
+
+
+def diferencas_livro(anterior: 'pd.DataFrame', novo: 'pd.DataFrame') -> Dict[str, 'pd.DataFrame']:
+    """{'adicionados', 'removidos', 'alterados'} entre duas versões de um livro"""
+    base = ['Categoria', 'Descrição']
+    campos = [c for c in COLUNAS_CSV_CONTA_AZUL if c not in CHAVE_LANCAMENTO]
+
+    # 1) Lançamentos idênticos (repetições idênticas numeradas entre si) - inalterados
+    identica = base + campos + ['_repeticao']
+    anterior = anterior.assign(_repeticao=numerar_ocorrencias(anterior, base + campos))
+    novo = novo.assign(_repeticao=numerar_ocorrencias(novo, base + campos))
+    iguais = anterior[identica].reset_index().merge(novo[identica].reset_index(), on=identica,
+                                                    suffixes=('_anterior', '_novo'))
+    anterior = anterior.drop(index=iguais['index_anterior'])
+    novo = novo.drop(index=iguais['index_novo'])
+
+    # 2) Sobras pareadas por categoria + descrição + posição entre as sobras
+    anterior = anterior.assign(_par=numerar_ocorrencias(anterior, base))
+    novo = novo.assign(_par=numerar_ocorrencias(novo, base))
+    colunas = base + ['_par', 'Ocorrência'] + campos
+    cruzado = anterior[colunas].merge(
+        novo[colunas], on=base + ['_par'], how='outer',
+        suffixes=('_anterior', '_novo'), indicator=True, sort=False
+    )
+
+    def lado(linhas: 'pd.DataFrame', sufixo: str) -> 'pd.DataFrame':
+        return linhas[base + ['Ocorrência' + sufixo] + [c + sufixo for c in campos]].rename(
+            columns={c + sufixo: c for c in campos + ['Ocorrência']})
+
+    em_ambos = cruzado[cruzado['_merge'] == 'both']
     return {
-        "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
-        "dependencies": {
-            "pandas": pd.__version__,
-            "numpy": np.__version__
+        'adicionados': lado(cruzado[cruzado['_merge'] == 'right_only'], '_novo'),
+        'removidos': lado(cruzado[cruzado['_merge'] == 'left_only'], '_anterior'),
+        'alterados': em_ambos.rename(columns={'Ocorrência_novo': 'Ocorrência'}),
+        'inalterados': len(iguais),
+    }
+
+
+def diferencas_resultados(anteriores: Dict[str, 'pd.DataFrame'],
+                          novos: Dict[str, 'pd.DataFrame']) -> Dict[str, Any]:
+    """
+    Compara os livros de duas execuções (ler_livros_resultado).
+
+    Returns:
+        {'resumo': {livro: contagens},
+         'adicionados' / 'removidos': [{'livro', campos do CSV, 'Ocorrência'}],
+         'alterados': [{'livro', 'Categoria', 'Descrição', 'Ocorrência',
+                        'campos' (alterados), 'antes', 'depois'}]}
+    """
+    campos = [c for c in COLUNAS_CSV_CONTA_AZUL if c not in CHAVE_LANCAMENTO]
+    resultado = {'resumo': {}, 'adicionados': [], 'removidos': [], 'alterados': []}
+    for livro in LIVROS_DIFERENCA:
+        diferencas = diferencas_livro(anteriores[livro], novos[livro])
+        resultado['resumo'][livro] = {
+            'adicionados': len(diferencas['adicionados']),
+            'removidos': len(diferencas['removidos']),
+            'alterados': len(diferencas['alterados']),
+            'inalterados': diferencas['inalterados'],
         }
+        for tipo in ('adicionados', 'removidos'):
+            resultado[tipo].extend({'livro': livro, **linha, 'Ocorrência': int(linha['Ocorrência'])}
+                                   for linha in diferencas[tipo].to_dict('records'))
+        for linha in diferencas['alterados'].to_dict('records'):
+            antes = {c: linha[c + '_anterior'] for c in campos}
+            depois = {c: linha[c + '_novo'] for c in campos}
+            resultado['alterados'].append({
+                'livro': livro,
+                'Categoria': linha['Categoria'],
+                'Descrição': linha['Descrição'],
+                'Ocorrência': int(linha['Ocorrência']),
+                'campos': [c for c in campos if antes[c] != depois[c]],
+                'antes': antes,
+                'depois': depois,
+            })
+    return resultado
+
+
+def executar_conciliacao(caminhos: Dict[str, str], centro_custo: str = "NETAIR",
+                         progresso: Optional[Callable[[str], None]] = None,
+                         perfilar: bool = False, saida_ndjson: Optional[str] = None,
+                         usar_indice_vendas: bool = True, motor: Optional[str] = None,
+                         por_mes: bool = False, pasta_por_mes: bool = False,
+                         ofx_incremental: bool = False) -> Dict[str, Any]:
+    """
+    Executa o pipeline completo: leitura dos relatórios, conciliação, geração dos
+    arquivos de saída e compactação.
+
+    É uma função de módulo (picklable) para rodar nos workers do pool de processos,
+    fora do event loop da API.
+
+    Args:
+        caminhos: {nome_relatorio: caminho_local} dos arquivos enviados
+        centro_custo: Centro de custo para os lançamentos
+        progresso: Callback opcional chamado com o nome de cada fase (FASES_PIPELINE)
+        perfilar: Executa a conciliação e os escritores sob profiling e inclui a
+            pasta Profiling/ no ZIP (PerfilConciliacao)
+        saida_ndjson: Em vez de gerar os arquivos e o ZIP, grava os lançamentos
+            neste caminho como NDJSON (gerar_ndjson_lancamentos), cada livro assim
+            que fica definitivo; 'zip' fica None
+        usar_indice_vendas: Grava/consulta o índice persistente de vendas
+            (INDICE_VENDAS_PATH); desligado na conciliação sintética do aquecimento
+        motor: Motor das junções (MOTORES_CONCILIACAO); None usa MOTOR_PADRAO
+        por_mes: Concilia os meses do extrato em paralelo (processar_conciliacao_por_mes)
+        pasta_por_mes: Inclui no ZIP uma pasta Meses/AAAA-MM/ por mês com os
+            arquivos daquele mês (gerar_arquivos_por_mes); implica por_mes
+        ofx_incremental: Outros/EXTRATO_MERCADOPAGO.ofx só com as transações ainda
+            não exportadas para a conta (`centro_custo`). Os FITIDs do OFX gerado
+            voltam em 'ofx_pendentes' e só são gravados no RegistroOfx quando o ZIP
+            é entregue ao cliente (registrar_ofx_entregue)
+
+    Returns:
+        {'zip': bytes do ZIP de saída, 'stats': estatísticas da conciliação,
+         'metricas': tempos por fase e contadores (MedicaoConciliacao.como_dict),
+         'ofx_pendentes': FITIDs novos do OFX incremental (só com ofx_incremental)}
+
+    Raises:
+        ErroConciliacao: com status 400 (arquivo inválido) ou 500 (erro de processamento)
+    """
+    medicao = MedicaoConciliacao()
+    diagnosticos = DiagnosticosConciliacao(guardar_todos=DIAGNOSTICOS_CSV)
+    perfil = PerfilConciliacao() if perfilar else None
+    indice_vendas = IndiceVendas(INDICE_VENDAS_PATH) if usar_indice_vendas and INDICE_VENDAS_PATH else None
+    registro_ofx = RegistroOfx(OFX_EXPORTADOS_PATH, centro_custo) if ofx_incremental else None
+
+    def avancar_fase(fase: str):
+        medicao.iniciar_fase(fase)
+        if perfil:
+            perfil.marcar_fase(fase)
+        if progresso:
+            progresso(fase)
+
+    avancar_fase('leitura')
+    arquivos, saldo_inicial_extrato = carregar_arquivos(caminhos, medicao, diagnosticos)
+    linhas_duplicadas = {key: df.attrs['linhas_duplicadas'] for key, df in arquivos.items()
+                         if df.attrs.get('linhas_duplicadas')}
+
+    livros_gravados = set()
+
+    def gravar_livros_ndjson(livros: Dict[str, List[Dict]]):
+        for livro in LIVROS_NDJSON:
+            if livro in livros and livro not in livros_gravados:
+                with medicao.escrita('gerar_ndjson_lancamentos', livro):
+                    gerar_ndjson_lancamentos(livro, livros[livro], saida_ndjson)
+                livros_gravados.add(livro)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        if perfil:
+            perfil.iniciar()
+        try:
+            # Processar conciliação
+            try:
+                processar = processar_conciliacao_por_mes if por_mes or pasta_por_mes else processar_conciliacao
+                extras = {}
+                if saida_ndjson and processar is processar_conciliacao:
+                    extras['livros_prontos'] = gravar_livros_ndjson
+                resultado = processar(arquivos, centro_custo=centro_custo, progresso=avancar_fase,
+                                      diagnosticos=diagnosticos, indice_vendas=indice_vendas, motor=motor,
+                                      **extras)
+            except Exception as e:
+                raise ErroConciliacao(500, f"Erro ao processar conciliação: {str(e)}")
+            finally:
+                if indice_vendas:
+                    indice_vendas.fechar()
+            diagnosticos.resumir()
+            medicao.registrar_stats(resultado['stats'])
+            for tipo, quantidade in diagnosticos.contagens.items():
+                medicao.contar('conciliador_diagnosticos_total', quantidade, tipo=tipo)
+            resultado['stats']['linhas_entrada'] = {
+                key: len(df) for key, df in arquivos.items() if caminhos.get(key)
+            }
+            if linhas_duplicadas:
+                resultado['stats']['linhas_duplicadas'] = linhas_duplicadas
+            if isinstance(arquivos['liberacoes'], LiberacoesEmDisco):
+                resultado['stats']['liberacoes_em_disco'] = True
+
+            avancar_fase('arquivos')
+            if saida_ndjson:
+                gravar_livros_ndjson(resultado)
+                medicao.encerrar_fase()
+                return {'zip': None, 'stats': resultado['stats'], 'metricas': medicao.como_dict()}
+
+            ofx_exportados = None
+            if registro_ofx:
+                fitids_ofx = fitids_transacoes_ofx(transacoes_ofx(resultado))
+                ofx_exportados = registro_ofx.ja_exportados(fitids_ofx)
+            arquivos_gerados = gerar_arquivos_saida(resultado, saldo_inicial_extrato, temp_dir, medicao,
+                                                    diagnosticos, ofx_exportados)
+            if pasta_por_mes and 'por_mes' in resultado:
+                arquivos_gerados.update(gerar_arquivos_por_mes(resultado['por_mes'], saldo_inicial_extrato,
+                                                               temp_dir, medicao))
+        finally:
+            if perfil:
+                perfil.encerrar()
+
+        if not arquivos_gerados:
+            raise ErroConciliacao(500, "Nenhum arquivo foi gerado. Verifique os dados de entrada.")
+
+        if perfil:
+            arquivos_gerados.update(perfil.gravar(os.path.join(temp_dir, 'Profiling')))
+
+        avancar_fase('zip')
+        conteudo_zip = compactar_arquivos(arquivos_gerados)
+        medicao.encerrar_fase()
+
+        ofx_pendentes = None
+        if registro_ofx:
+            ofx_pendentes = [fitid for fitid in dict.fromkeys(fitids_ofx) if fitid not in ofx_exportados]
+            resultado['stats']['ofx_incremental'] = {'novas': len(ofx_pendentes),
+                                                     'ja_exportadas': len(ofx_exportados)}
+
+        # Vendas do índice de que o resultado depende (cache_ler); None se o índice
+        # falhou no meio da conciliação - resultado que não pode ir para o cache
+        dependencias_indice = resumo_consultas_indice({})
+        if indice_vendas:
+            consultas = resultado.get('consultas_indice')
+            dependencias_indice = resumo_consultas_indice(consultas) if consultas is not None else None
+
+        return {
+            'zip': conteudo_zip,
+            'stats': resultado['stats'],
+            'metricas': medicao.como_dict(),
+            'dependencias_indice': dependencias_indice,
+            **({'ofx_pendentes': ofx_pendentes} if registro_ofx else {}),
+        }
+    finally:
+        # Limpar diretório temporário
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        fechar_liberacoes_em_disco(arquivos)
+        if registro_ofx:
+            registro_ofx.fechar()
+
+
+# ==============================================================================
+# AQUECIMENTO DOS WORKERS (cold start)
+# ==============================================================================
+#
+# O processo da API não importa pandas/numpy/openpyxl (ver ModuloTardio). Cada
+# worker do pool, ao ser criado, importa a pilha pesada e roda uma conciliação
+# sintética mínima (initializer do pool), pagando os custos de primeiro uso antes
+# da primeira requisição real. No startup da API os workers são criados em
+# segundo plano; os tempos ficam em /health.
+
+RELATORIOS_SINTETICOS = {
+    'dinheiro': (
+        "SOURCE_ID,TRANSACTION_TYPE,TRANSACTION_DATE,MONEY_RELEASE_DATE,TRANSACTION_AMOUNT,REAL_AMOUNT,"
+        "SHIPPING_FEE_AMOUNT,SUB_UNIT,EXTERNAL_REFERENCE,ORDER_ID,METADATA\n"
+        "10000000001,SETTLEMENT,2025-01-02,2025-01-02,100.0,88.0,0,checkout,EXT1,2000000001,\n"
+        "10000000002,SETTLEMENT,2025-01-02,2025-02-02,50.0,44.0,0,checkout,EXT2,2000000002,\n"
+    ),
+    'vendas': (
+        "Número da transação do Mercado Pago (operation_id);Número da venda no Mercado Livre (order_id);"
+        "Valor do produto (transaction_amount);Frete (shipping_cost);Descrição da operação (reason);"
+        "Data da compra (date_created);Data de liberação do dinheiro (date_released);Status do envio (shipment_status)\n"
+        "10000000001;2000000001;100.0;0.0;Produto;2025-01-02T10:00:00.000-03:00;2025-01-02;delivered\n"
+    ),
+    'pos_venda': (
+        "ID da transação (operation_id);Motivo detalhado (reason_detail);"
+        "Data de criação da transação (operation_date_created);Data de criação (date_created)\n"
+    ),
+    'liberacoes': (
+        "DATE,SOURCE_ID,EXTERNAL_REFERENCE,RECORD_TYPE,DESCRIPTION,NET_CREDIT_AMOUNT,NET_DEBIT_AMOUNT,"
+        "GROSS_AMOUNT,MP_FEE_AMOUNT,FINANCING_FEE_AMOUNT,SHIPPING_FEE_AMOUNT,METADATA\n"
+        "2025-01-02,10000000001,EXT1,release,payment,88.0,0,100.0,-12.0,0,0,\n"
+    ),
+    'extrato': (
+        "INITIAL_BALANCE;CREDITS;DEBITS;FINAL_BALANCE\n"
+        "100,00;0;0;0\n"
+        "\n"
+        "RELEASE_DATE;TRANSACTION_TYPE;REFERENCE_ID;TRANSACTION_NET_AMOUNT;PARTIAL_BALANCE\n"
+        "02-01-2025;Liberação de dinheiro;10000000001;88,00;188,00\n"
+        "02-01-2025;Pagamento de contas;800000001;-10,00;178,00\n"
+    ),
+}
+
+_aquecimento_worker: Dict[str, Any] = {}  # Tempos do aquecimento (definido no próprio worker)
+
+
+def aquecer_worker():
+    """
+    Initializer dos workers: importa pandas/numpy/openpyxl e executa uma conciliação
+    sintética mínima. Falhas só são registradas - o worker segue utilizável.
+    """
+    global _aquecimento_worker, _rss_worker_ocioso
+
+    inicio = time.perf_counter()
+    info: Dict[str, Any] = {'pid': os.getpid()}
+    try:
+        for nome in ('numpy', 'pandas', 'openpyxl'):
+            importar_modulo(nome)
+        info['importacao_s'] = dict(TEMPOS_IMPORTACAO)
+
+        inicio_conciliacao = time.perf_counter()
+        temp_dir = tempfile.mkdtemp()
+        nivel_log = logger.level
+        logger.setLevel(logging.ERROR)  # A conciliação sintética não deve poluir o log
+        try:
+            caminhos = {}
+            for key, conteudo in RELATORIOS_SINTETICOS.items():
+                caminhos[key] = os.path.join(temp_dir, key)
+                with open(caminhos[key], 'w', encoding='utf-8') as f:
+                    f.write(conteudo)
+            executar_conciliacao(caminhos, usar_indice_vendas=False)
+        finally:
+            logger.setLevel(nivel_log)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        info['conciliacao_sintetica_s'] = round(time.perf_counter() - inicio_conciliacao, 3)
+    except Exception as e:
+        info['erro'] = str(e)
+        logger.warning(f"Aquecimento do worker {os.getpid()} falhou: {str(e)}")
+
+    info['total_s'] = round(time.perf_counter() - inicio, 3)
+    _aquecimento_worker = info
+    # Memória do worker aquecido é a base para medir o pico de cada conciliação
+    _rss_worker_ocioso, _ = ler_memoria_processo()
+
+
+def informar_aquecimento(espera: float = 0.0) -> Dict[str, Any]:
+    """
+    Retorna os tempos de aquecimento do worker que executar a tarefa. A `espera`
+    segura o worker para que as demais tarefas da mesma rodada caiam em outros workers.
+    """
+    time.sleep(espera)
+    return _aquecimento_worker
+
+
+# Estado do aquecimento no processo da API (exposto em /health)
+_aquecimento: Dict[str, Any] = {'estado': 'desativado' if not AQUECIMENTO_HABILITADO else 'pendente'}
+
+
+async def aquecer_pool():
+    """
+    Cria os workers do pool em segundo plano logo após o startup.
+
+    Cada tarefa enviada a um pool sem workers ociosos cria um novo worker, então
+    POOL_WORKERS tarefas simultâneas sobem o pool inteiro (cada um roda aquecer_worker).
+    """
+    inicio = time.perf_counter()
+    _aquecimento['estado'] = 'em_andamento'
+    loop = asyncio.get_running_loop()
+    try:
+        respostas = await asyncio.gather(*[
+            loop.run_in_executor(obter_pool(), informar_aquecimento, 0.5) for _ in range(POOL_WORKERS)
+        ])
+    except Exception as e:
+        _aquecimento.update(estado='erro', erro=str(e))
+        logger.warning(f"Aquecimento do pool falhou: {str(e)}")
+        return
+
+    workers = list({info['pid']: info for info in respostas if info}.values())
+    _aquecimento.update(
+        estado='concluido',
+        duracao_s=round(time.perf_counter() - inicio, 3),
+        workers=workers,
+    )
+    logger.info(f"Pool aquecido em {_aquecimento['duracao_s']:.1f}s ({len(workers)} worker(s))")
+
+
+# ==============================================================================
+# POOL DE PROCESSOS (trabalho pesado fora do event loop)
+# ==============================================================================
+
+_pool: Optional[ProcessPoolExecutor] = None
+_tarefas_no_pool = 0  # Em execução + aguardando na fila (acessado só pelo event loop)
+
+
+def obter_pool() -> ProcessPoolExecutor:
+    """Retorna o pool de processos, criando-o no primeiro uso"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=POOL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            max_tasks_per_child=POOL_TAREFAS_POR_WORKER or None,
+            initializer=aquecer_worker if AQUECIMENTO_HABILITADO else None,
+        )
+        logger.info(f"Pool de processos criado: {POOL_WORKERS} worker(s), fila máxima {POOL_FILA_MAX}")
+    return _pool
+
+
+def encerrar_pool():
+    """Encerra o pool de processos (shutdown da API)"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def executar_no_pool(func, *args, rejeitar_se_cheio: bool = True):
+    """
+    Executa `func(*args)` em um worker do pool sem bloquear o event loop.
+
+    A fila é limitada: com POOL_WORKERS tarefas em execução e POOL_FILA_MAX
+    aguardando, novas requisições recebem 503 com Retry-After. Jobs assíncronos
+    (rejeitar_se_cheio=False) já foram aceitos e apenas aguardam a vez.
+    """
+    global _tarefas_no_pool
+
+    if rejeitar_se_cheio and _tarefas_no_pool >= POOL_WORKERS + POOL_FILA_MAX:
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor ocupado com outras conciliações. Tente novamente em instantes.",
+            headers={"Retry-After": str(POOL_RETRY_AFTER)}
+        )
+
+    _tarefas_no_pool += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(obter_pool(), functools.partial(func, *args))
+    except BrokenProcessPool:
+        # Worker morreu (ex: falta de memória) - descarta o pool para recriar no próximo uso
+        logger.error("Pool de processos quebrado - será recriado na próxima requisição")
+        encerrar_pool()
+        raise HTTPException(status_code=500, detail="Erro ao processar conciliação: worker encerrado inesperadamente")
+    finally:
+        _tarefas_no_pool -= 1
+
+
+# ==============================================================================
+# CONTROLE DE ADMISSÃO POR MEMÓRIA
+# ==============================================================================
+
+_memoria_reservada = 0
+_memoria_correcao = 1.0  # Razão medido/estimado (média móvel), recalibrada a cada execução
+_memoria_condicao = asyncio.Condition()
+
+
+def tamanho_descompactado(caminho: str) -> int:
+    """
+    Tamanho do relatório em bytes; para ZIP, soma dos CSVs descompactados; para
+    gzip, o tamanho original do trailer; zstd e Parquet, FATOR_COMPRESSAO vezes o arquivo
+    """
+    formato = formato_do_arquivo(caminho)
+    tamanho = os.path.getsize(caminho)
+    if formato == 'zip':
+        try:
+            with zipfile.ZipFile(caminho) as zip_file:
+                return sum(info.file_size for info in zip_file.infolist()
+                           if info.filename.lower().endswith('.csv'))
+        except zipfile.BadZipFile:
+            pass
+    elif formato == 'gzip' and tamanho >= 18:
+        with open(caminho, 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            original = int.from_bytes(f.read(4), 'little')  # ISIZE: módulo 2^32
+        return original if original >= tamanho else tamanho * FATOR_COMPRESSAO
+    elif formato in ('zstd', 'parquet'):
+        return tamanho * FATOR_COMPRESSAO
+    return tamanho
+
+
+def estimar_memoria_bruta(caminhos: Dict[str, str]) -> int:
+    """
+    Σ(bytes do relatório * fator do tipo de relatório), sem base nem correção. O
+    LIBERAÇÕES lido fora da memória (LIBERACOES_EM_DISCO_BYTES) conta até o limite.
+    """
+    bruta = 0
+    for key, caminho in caminhos.items():
+        tamanho = tamanho_descompactado(caminho)
+        if key == 'liberacoes' and LIBERACOES_EM_DISCO_BYTES:
+            tamanho = min(tamanho, LIBERACOES_EM_DISCO_BYTES)
+        bruta += tamanho * FATORES_MEMORIA.get(key, 10)
+    return int(bruta)
+
+
+def estimar_memoria(bruta: int) -> int:
+    """Estimativa calibrada do pico de memória de uma conciliação"""
+    return int(MEMORIA_BASE + _memoria_correcao * bruta)
+
+
+def memoria_processos_por_mes(opcoes: Optional[Dict[str, Any]]) -> int:
+    """Memória dos processos de mês (por_mes), fora do pico medido no worker"""
+    return PROCESSOS_POR_MES * MEMORIA_PROCESSO_MES if (opcoes or {}).get('por_mes') else 0
+
+
+def calibrar_memoria(bruta: int, pico_medido: Optional[int]):
+    """Ajusta a correção das estimativas com o pico medido no worker (média móvel)"""
+    global _memoria_correcao
+    if not pico_medido or bruta < 1024 * 1024:
+        return  # Entradas pequenas são dominadas por ruído
+    razao = max(pico_medido - MEMORIA_BASE, 0) / bruta
+    _memoria_correcao = min(max(0.8 * _memoria_correcao + 0.2 * razao, 0.25), 4.0)
+    logger.info(f"Memória: estimado {estimar_memoria(bruta) / 1048576:.0f}MB, medido {pico_medido / 1048576:.0f}MB, "
+                f"correção {_memoria_correcao:.2f}")
+
+
+@asynccontextmanager
+async def reservar_memoria(estimativa: int, espera_max: Optional[float] = MEMORIA_ESPERA_MAX):
+    """
+    Reserva `estimativa` bytes do orçamento de memória enquanto o bloco executa.
+
+    Se não couber, aguarda até `espera_max` segundos (None = sem limite) por
+    conciliações em andamento terminarem; depois disso responde 503 com Retry-After.
+    Uma conciliação maior que o orçamento inteiro só roda sozinha.
+    """
+    global _memoria_reservada
+    estimativa = min(estimativa, MEMORIA_ORCAMENTO_BYTES)
+
+    def cabe() -> bool:
+        return _memoria_reservada + estimativa <= MEMORIA_ORCAMENTO_BYTES
+
+    async with _memoria_condicao:
+        if not cabe():
+            logger.info(f"Memória: aguardando {estimativa / 1048576:.0f}MB "
+                        f"(reservado {_memoria_reservada / 1048576:.0f}MB de {MEMORIA_ORCAMENTO_BYTES / 1048576:.0f}MB)")
+            try:
+                if espera_max is not None and espera_max <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(_memoria_condicao.wait_for(cabe), espera_max)
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Memória insuficiente para processar agora. Tente novamente em instantes.",
+                    headers={"Retry-After": str(POOL_RETRY_AFTER)}
+                )
+        _memoria_reservada += estimativa
+
+    try:
+        yield
+    finally:
+        async with _memoria_condicao:
+            _memoria_reservada -= estimativa
+            _memoria_condicao.notify_all()
+
+
+def ler_memoria_processo() -> Tuple[int, int]:
+    """(RSS atual, pico de RSS) do processo em bytes, via /proc; (0, 0) se indisponível"""
+    valores = {}
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for linha in f:
+                if linha.startswith(('VmRSS:', 'VmHWM:')):
+                    chave, valor = linha.split(':', 1)
+                    valores[chave] = int(valor.split()[0]) * 1024
+    except OSError:
+        pass
+    return valores.get('VmRSS', 0), valores.get('VmHWM', 0)
+
+
+def zerar_pico_memoria() -> bool:
+    """Zera o pico de RSS (VmHWM) do processo via /proc/self/clear_refs; False se indisponível"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+_rss_worker_ocioso = 0  # RSS do worker antes da primeira tarefa (definido no próprio worker)
+
+
+def executar_medindo(func, *args) -> Tuple[Any, Optional[int]]:
+    """
+    Executa `func(*args)` no worker medindo o pico de RSS da tarefa.
+
+    Zera o pico do processo (/proc/self/clear_refs) antes de executar e mede em
+    relação ao RSS do worker ocioso - memória retida de tarefas anteriores (que o
+    alocador não devolve ao SO) conta como ocupada, igual ao que o container vê.
+
+    Returns:
+        Tuple[resultado, pico em bytes ou None se não for possível medir]
+    """
+    global _rss_worker_ocioso
+
+    medir = zerar_pico_memoria()
+
+    if not _rss_worker_ocioso:
+        _rss_worker_ocioso, _ = ler_memoria_processo()
+
+    resultado = func(*args)
+    _, pico = ler_memoria_processo()
+
+    return resultado, (max(pico - _rss_worker_ocioso, 0) if medir and pico else None)
+
+
+async def salvar_upload(upload_file: UploadFile, destino: str) -> str:
+    """
+    Copia o arquivo enviado para o disco sem bloquear o event loop.
+
+    Returns:
+        SHA-256 (hex) do conteúdo, calculado durante a cópia
+    """
+    def copiar() -> str:
+        sha = hashlib.sha256()
+        upload_file.file.seek(0)
+        with open(destino, 'wb') as f:
+            while True:
+                bloco = upload_file.file.read(1024 * 1024)
+                if not bloco:
+                    break
+                sha.update(bloco)
+                f.write(bloco)
+        return sha.hexdigest()
+    return await run_in_threadpool(copiar)
+
+
+async def salvar_uploads(uploads: Dict[str, Optional[UploadFile]], diretorio: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Salva os relatórios enviados em `diretorio` (um arquivo por relatório).
+
+    Returns:
+        Tuple[Dict, Dict]: ({relatorio: caminho_local}, {relatorio: sha256})
+    """
+    caminhos = {}
+    hashes = {}
+    for key, upload_file in uploads.items():
+        if upload_file:
+            caminhos[key] = os.path.join(diretorio, key)
+            hashes[key] = await salvar_upload(upload_file, caminhos[key])
+    return caminhos, hashes
+
+
+# ==============================================================================
+# CACHE DE RESULTADOS (requisições idênticas)
+# ==============================================================================
+#
+# A chave (fingerprint) combina o SHA-256 de cada arquivo enviado, o centro de custo
+# e VERSAO_MOTOR. O cache fica em disco (CACHE_DIR), limitado a CACHE_MAX_BYTES,
+# com descarte LRU pelo mtime (atualizado a cada acerto).
+#
+# O índice persistente de vendas não entra na chave: a própria conciliação grava nele
+# as vendas do upload, e um reenvio idêntico não acertaria o cache. Cada item guarda
+# as vendas do índice que a conciliação consultou (IDs ausentes do upload, encontrados
+# ou não); a leitura só é um acerto se o índice ainda retorna o mesmo para esses IDs.
+
+_conciliacoes_em_andamento: Dict[str, asyncio.Task] = {}  # fingerprint -> task em execução
+
+
+def digest_consultas_indice(consultas: Dict[str, Dict[str, Optional[Dict[str, Any]]]]) -> str:
+    """SHA-256 do que o índice retornou para cada ID consultado, por tabela"""
+    conteudo = json.dumps({tabela: sorted(por_id.items()) for tabela, por_id in consultas.items()},
+                          sort_keys=True, default=str)
+    return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+
+
+def resumo_consultas_indice(consultas: Dict[str, Dict[str, Optional[Dict[str, Any]]]]) -> Dict[str, Any]:
+    """{'ids': {tabela: IDs consultados}, 'digest'} - gravado com o item do cache"""
+    return {'ids': {tabela: sorted(por_id) for tabela, por_id in consultas.items() if por_id},
+            'digest': digest_consultas_indice({tabela: por_id for tabela, por_id in consultas.items() if por_id})}
+
+
+def indice_vendas_inalterado(dependencias: Dict[str, Any]) -> bool:
+    """
+    O índice ainda retorna o mesmo para os IDs consultados por um resultado do cache?
+    Conexão somente leitura: roda fora do event loop (cache_ler) e não disputa
+    escrita com os workers.
+    """
+    ids = dependencias.get('ids') or {}
+    if not ids:
+        return True
+    if not INDICE_VENDAS_PATH:
+        return False
+    if not os.path.exists(INDICE_VENDAS_PATH):
+        consultas = {tabela: dict.fromkeys(op_ids) for tabela, op_ids in ids.items()}
+    else:
+        indice = IndiceVendas(INDICE_VENDAS_PATH, somente_leitura=True)
+        try:
+            consultas = {tabela: indice.buscar_varios(tabela, op_ids) for tabela, op_ids in ids.items()}
+        except sqlite3.Error as e:
+            logger.warning(f"Cache: índice de vendas indisponível para validar o resultado: {str(e)}")
+            return False
+        finally:
+            indice.fechar()
+    return digest_consultas_indice(consultas) == dependencias.get('digest')
+
+
+def calcular_fingerprint(hashes: Dict[str, str], centro_custo: str,
+                         opcoes: Optional[Dict[str, Any]] = None) -> str:
+    """Chave do cache: hashes dos arquivos + centro de custo + versão do motor + opções da saída"""
+    chave = json.dumps({
+        'motor': VERSAO_MOTOR,
+        'centro_custo': centro_custo,
+        'arquivos': hashes,
+        # O motor das junções não muda os lançamentos; por_mes/pasta_por_mes mudam stats e ZIP
+        'opcoes': {nome: valor for nome, valor in (opcoes or {}).items() if nome != 'motor'},
+        'diagnosticos_csv': DIAGNOSTICOS_CSV,  # Muda o conteúdo do ZIP
+    }, sort_keys=True)
+    return hashlib.sha256(chave.encode('utf-8')).hexdigest()
+
+
+def cache_ler(fingerprint: str) -> Optional[Dict[str, Any]]:
+    """
+    Retorna {'zip', 'stats'} do cache ou None; marca o item como usado recentemente.
+    Um item cujas vendas do índice mudaram (indice_vendas_inalterado) é tratado como ausente.
+    """
+    zip_path = os.path.join(CACHE_DIR, f'{fingerprint}.zip')
+    try:
+        with open(os.path.join(CACHE_DIR, f'{fingerprint}.json'), 'r', encoding='utf-8') as f:
+            item = json.load(f)
+        stats, dependencias_indice = item['stats'], item['dependencias_indice']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if not indice_vendas_inalterado(dependencias_indice):
+        logger.info(f"Cache {fingerprint[:12]}: vendas do índice mudaram - reprocessando")
+        return None
+    try:
+        with open(zip_path, 'rb') as f:
+            conteudo = f.read()
+        os.utime(zip_path)
+    except OSError:
+        return None
+    return {'zip': conteudo, 'stats': stats}
+
+
+def cache_gravar(fingerprint: str, saida: Dict[str, Any]):
+    """Grava o resultado no cache e descarta os itens menos usados acima do limite"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    item = json.dumps({'stats': saida['stats'], 'dependencias_indice': saida['dependencias_indice']})
+    for extensao, conteudo, modo in [('json', item, 'w'), ('zip', saida['zip'], 'wb')]:
+        tmp_path = os.path.join(CACHE_DIR, f'{fingerprint}.{extensao}.tmp')
+        with open(tmp_path, modo) as f:
+            f.write(conteudo)
+        os.replace(tmp_path, os.path.join(CACHE_DIR, f'{fingerprint}.{extensao}'))
+
+    itens = []
+    for nome in os.listdir(CACHE_DIR):
+        if nome.endswith('.zip'):
+            try:
+                info = os.stat(os.path.join(CACHE_DIR, nome))
+            except OSError:
+                continue
+            itens.append((info.st_mtime, info.st_size, nome[:-4]))
+
+    total = sum(tamanho for _, tamanho, _ in itens)
+    for _, tamanho, fp in sorted(itens):
+        if total <= CACHE_MAX_BYTES:
+            break
+        for extensao in ('zip', 'json'):
+            try:
+                os.remove(os.path.join(CACHE_DIR, f'{fp}.{extensao}'))
+            except OSError:
+                pass
+        total -= tamanho
+
+
+async def _computar_conciliacao(fingerprint: Optional[str], caminhos: Dict[str, str], centro_custo: str,
+                                temp_dir: str, perfilar: bool = False,
+                                opcoes: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Executa a conciliação no pool, grava no cache e libera os uploads.
+    Sem fingerprint (profiling, OFX incremental) o resultado não é gravado no cache.
+    `opcoes` são repassadas a executar_conciliacao (motor, por_mes, pasta_por_mes,
+    ofx_incremental).
+    """
+    opcoes = opcoes or {}
+    try:
+        bruta = await run_in_threadpool(estimar_memoria_bruta, caminhos)
+        estimativa = estimar_memoria(bruta) + memoria_processos_por_mes(opcoes)
+        func = functools.partial(executar_conciliacao, **opcoes)
+        if perfilar:
+            estimativa *= PROFILING_FATOR_MEMORIA
+            func = functools.partial(func, perfilar=True)
+        async with reservar_memoria(estimativa):
+            try:
+                saida, pico = await executar_no_pool(executar_medindo, func, caminhos, centro_custo)
+            except (ErroConciliacao, HTTPException):
+                metricas.incrementar('conciliador_execucoes_total', resultado='erro')
+                raise
+        if not perfilar and not opcoes.get('por_mes'):
+            # O pico sob tracemalloc não representa uma execução normal, e o dos
+            # processos de mês não é medido
+            calibrar_memoria(bruta, pico)
+        metricas.registrar_execucao(saida['metricas'], pico)
+        saida['pico_memoria'] = pico
+
+        if fingerprint and CACHE_MAX_BYTES > 0 and saida.get('dependencias_indice') is not None:
+            try:
+                await run_in_threadpool(cache_gravar, fingerprint, saida)
+            except OSError as e:
+                logger.warning(f"Cache: não foi possível gravar resultado: {str(e)}")
+        return saida
+    finally:
+        if fingerprint:
+            _conciliacoes_em_andamento.pop(fingerprint, None)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+async def conciliar_com_cache(caminhos: Dict[str, str], hashes: Dict[str, str], centro_custo: str,
+                              temp_dir: str, perfilar: bool = False,
+                              opcoes: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], str]:
+    """
+    Retorna o resultado da conciliação usando o cache e agrupando requisições idênticas.
+
+    - HIT: resultado servido do cache em disco
+    - COALESCED: requisição idêntica já em execução; aguarda o mesmo resultado
+    - MISS: executa a conciliação no pool
+    - BYPASS: execução com profiling (`perfilar`) ou OFX incremental (depende do que já
+      foi exportado); sempre executa e não grava no cache
+
+    Assume a posse de `temp_dir` (diretório dos uploads), que é removido quando
+    não for mais necessário - inclusive se esta requisição for cancelada.
+
+    `opcoes` são os argumentos de executar_conciliacao (motor, por_mes,
+    pasta_por_mes). O motor (MOTORES_CONCILIACAO) não entra na chave do cache:
+    todos produzem os mesmos lançamentos (bench/equivalencia.py).
+
+    Returns:
+        Tuple[Dict, str]: ({'zip', 'stats'}, origem do resultado)
+    """
+    if perfilar or (opcoes or {}).get('ofx_incremental'):
+        return await _computar_conciliacao(None, caminhos, centro_custo, temp_dir, perfilar=perfilar,
+                                           opcoes=opcoes), 'BYPASS'
+
+    fingerprint = calcular_fingerprint(hashes, centro_custo, opcoes)
+    executando = False
+
+    try:
+        if CACHE_MAX_BYTES > 0:
+            saida = await run_in_threadpool(cache_ler, fingerprint)
+            if saida is not None:
+                logger.info(f"Cache HIT {fingerprint[:12]}")
+                return saida, 'HIT'
+
+        tarefa = _conciliacoes_em_andamento.get(fingerprint)
+        origem = 'COALESCED'
+        if tarefa is None:
+            tarefa = asyncio.create_task(_computar_conciliacao(fingerprint, caminhos, centro_custo, temp_dir,
+                                                               opcoes=opcoes))
+            # Evita "exception was never retrieved" se todas as requisições forem canceladas
+            tarefa.add_done_callback(lambda t: t.cancelled() or t.exception())
+            _conciliacoes_em_andamento[fingerprint] = tarefa
+            executando = True
+            origem = 'MISS'
+        else:
+            logger.info(f"Requisição idêntica em andamento {fingerprint[:12]} - aguardando resultado")
+
+        # shield: cancelar esta requisição não cancela a conciliação compartilhada
+        return await asyncio.shield(tarefa), origem
+    finally:
+        if not executando:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# ==============================================================================
+# JOBS ASSÍNCRONOS (conciliações longas)
+# ==============================================================================
+#
+# Cada job tem um diretório próprio em JOBS_DIR:
+#   <job_id>/status.json     - estado e progresso por fase (escrito pelo worker)
+#   <job_id>/entrada/        - relatórios enviados (removidos ao terminar)
+#   <job_id>/resultado.zip   - ZIP de saída (quando concluído)
+
+JOB_STATUS_FILA = 'na_fila'
+JOB_STATUS_PROCESSANDO = 'processando'
+JOB_STATUS_CONCLUIDO = 'concluido'
+JOB_STATUS_ERRO = 'erro'
+
+_tarefas_jobs = set()  # Referências das tasks em andamento (evita coleta pelo GC)
+
+
+def caminho_job(job_id: str) -> Optional[str]:
+    """Retorna o diretório do job ou None se o ID for inválido"""
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+        return None
+    return os.path.join(JOBS_DIR, job_id)
+
+
+def ler_status_job(job_dir: str) -> Optional[Dict[str, Any]]:
+    """Lê o status.json do job (None se não existir)"""
+    try:
+        with open(os.path.join(job_dir, 'status.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def atualizar_status_job(job_dir: str, **campos) -> Dict[str, Any]:
+    """Atualiza o status.json do job de forma atômica (escreve e renomeia)"""
+    status = ler_status_job(job_dir) or {}
+    status.update(campos)
+    tmp_path = os.path.join(job_dir, 'status.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(status, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(job_dir, 'status.json'))
+    return status
+
+
+def registrar_fase_job(job_dir: str, fase: str):
+    """Callback de progresso: marca o fim da fase anterior e o início de `fase`"""
+    status = ler_status_job(job_dir) or {}
+    agora = datetime.now().isoformat()
+    fases = status.get('fases', {})
+    anterior = status.get('fase')
+    if anterior in fases and not fases[anterior].get('fim'):
+        fases[anterior]['fim'] = agora
+    fases[fase] = {'inicio': agora, 'fim': None}
+
+    indice = FASES_PIPELINE.index(fase) if fase in FASES_PIPELINE else 0
+    atualizar_status_job(
+        job_dir,
+        fase=fase,
+        fases=fases,
+        progresso=round(indice / len(FASES_PIPELINE), 2)
+    )
+
+
+def executar_job(job_dir: str, caminhos: Dict[str, str], centro_custo: str,
+                 opcoes: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Executa um job no worker: roda o pipeline, grava o resultado.zip e atualiza
+    o status. Erros ficam registrados no status.json (não são propagados).
+    `opcoes` são repassadas a executar_conciliacao (motor, por_mes, pasta_por_mes).
+
+    Returns:
+        Métricas da execução (MedicaoConciliacao.como_dict) ou None em caso de erro
+    """
+    atualizar_status_job(job_dir, status=JOB_STATUS_PROCESSANDO, iniciado_em=datetime.now().isoformat())
+
+    try:
+        saida = executar_conciliacao(caminhos, centro_custo,
+                                     progresso=functools.partial(registrar_fase_job, job_dir), **(opcoes or {}))
+
+        resultado_tmp = os.path.join(job_dir, 'resultado.zip.tmp')
+        with open(resultado_tmp, 'wb') as f:
+            f.write(saida['zip'])
+        os.replace(resultado_tmp, os.path.join(job_dir, 'resultado.zip'))
+
+        status = ler_status_job(job_dir) or {}
+        fases = status.get('fases', {})
+        agora = datetime.now().isoformat()
+        for dados_fase in fases.values():
+            dados_fase['fim'] = dados_fase.get('fim') or agora
+
+        atualizar_status_job(
+            job_dir,
+            status=JOB_STATUS_CONCLUIDO,
+            fases=fases,
+            progresso=1.0,
+            stats=saida['stats'],
+            ofx_pendentes=saida.get('ofx_pendentes', []),  # gravados no primeiro /result completo
+            concluido_em=agora
+        )
+        return saida['metricas']
+    except ErroConciliacao as e:
+        atualizar_status_job(job_dir, status=JOB_STATUS_ERRO, erro=e.detail, codigo_erro=e.status_code,
+                             concluido_em=datetime.now().isoformat())
+    except Exception as e:
+        logger.error(f"Job {os.path.basename(job_dir)}: erro inesperado: {str(e)}")
+        atualizar_status_job(job_dir, status=JOB_STATUS_ERRO, erro=f"Erro ao processar conciliação: {str(e)}",
+                             codigo_erro=500, concluido_em=datetime.now().isoformat())
+    finally:
+        shutil.rmtree(os.path.join(job_dir, 'entrada'), ignore_errors=True)
+    return None
+
+
+async def acompanhar_job(job_dir: str, caminhos: Dict[str, str], centro_custo: str,
+                         opcoes: Optional[Dict[str, Any]] = None):
+    """Task do event loop que envia o job ao pool e registra falhas do próprio pool"""
+    try:
+        bruta = await run_in_threadpool(estimar_memoria_bruta, caminhos)
+        estimativa = estimar_memoria(bruta) + memoria_processos_por_mes(opcoes)
+        # Job já aceito: aguarda memória disponível sem limite de tempo
+        async with reservar_memoria(estimativa, espera_max=None):
+            metricas_job, pico = await executar_no_pool(executar_medindo, executar_job, job_dir, caminhos,
+                                                        centro_custo, opcoes, rejeitar_se_cheio=False)
+        if not (opcoes or {}).get('por_mes'):
+            calibrar_memoria(bruta, pico)
+        if metricas_job:
+            metricas.registrar_execucao(metricas_job, pico)
+            atualizar_status_job(job_dir, pico_memoria=pico)  # X-Stats-Pico-Memoria-MB do /result
+        else:
+            metricas.incrementar('conciliador_execucoes_total', resultado='erro')
+    except HTTPException as e:
+        metricas.incrementar('conciliador_execucoes_total', resultado='erro')
+        atualizar_status_job(job_dir, status=JOB_STATUS_ERRO, erro=e.detail, codigo_erro=e.status_code,
+                             concluido_em=datetime.now().isoformat())
+
+
+def novo_job() -> Tuple[str, str, str]:
+    """Cria o diretório de um job novo; (job_id, job_dir, entrada_dir)"""
+    if contar_jobs_pendentes() >= JOBS_MAX_PENDENTES:
+        raise HTTPException(
+            status_code=503,
+            detail="Muitos jobs pendentes. Tente novamente em instantes.",
+            headers={"Retry-After": str(POOL_RETRY_AFTER)}
+        )
+    job_id = uuid.uuid4().hex
+    job_dir = caminho_job(job_id)
+    entrada_dir = os.path.join(job_dir, 'entrada')
+    os.makedirs(entrada_dir)
+    return job_id, job_dir, entrada_dir
+
+
+def enfileirar_job(job_id: str, job_dir: str, caminhos: Dict[str, str], centro_custo: str,
+                   opcoes: Dict[str, Any], **campos) -> Dict[str, Any]:
+    """Grava o status inicial do job e inicia acompanhar_job no event loop"""
+    status = atualizar_status_job(
+        job_dir,
+        job_id=job_id,
+        status=JOB_STATUS_FILA,
+        centro_custo=centro_custo,
+        **opcoes,
+        **campos,
+        criado_em=datetime.now().isoformat(),
+        fase=None,
+        fases={},
+        progresso=0.0
+    )
+
+    tarefa = asyncio.create_task(acompanhar_job(job_dir, caminhos, centro_custo, opcoes))
+    _tarefas_jobs.add(tarefa)
+    tarefa.add_done_callback(_tarefas_jobs.discard)
+
+    logger.info(f"Job {job_id} criado")
+    return status
+
+
+def contar_jobs_pendentes() -> int:
+    """Quantidade de jobs na fila ou em processamento"""
+    pendentes = 0
+    if os.path.isdir(JOBS_DIR):
+        for job_id in os.listdir(JOBS_DIR):
+            status = ler_status_job(os.path.join(JOBS_DIR, job_id))
+            if status and status.get('status') in (JOB_STATUS_FILA, JOB_STATUS_PROCESSANDO):
+                pendentes += 1
+    return pendentes
+
+
+def limpar_jobs(ao_iniciar: bool = False) -> int:
+    """
+    Remove jobs finalizados há mais de JOBS_TTL segundos.
+
+    Ao iniciar a API, jobs que estavam na fila/processando pertenciam ao processo
+    anterior e nunca vão terminar: são marcados como erro.
+
+    Returns:
+        Quantidade de jobs removidos
+    """
+    if not os.path.isdir(JOBS_DIR):
+        return 0
+
+    removidos = 0
+    agora = datetime.now().timestamp()
+    for job_id in os.listdir(JOBS_DIR):
+        job_dir = os.path.join(JOBS_DIR, job_id)
+        status = ler_status_job(job_dir)
+
+        if ao_iniciar and status and status.get('status') in (JOB_STATUS_FILA, JOB_STATUS_PROCESSANDO):
+            status = atualizar_status_job(job_dir, status=JOB_STATUS_ERRO, codigo_erro=500,
+                                          erro="Job interrompido por reinício da API",
+                                          concluido_em=datetime.now().isoformat())
+            shutil.rmtree(os.path.join(job_dir, 'entrada'), ignore_errors=True)
+
+        if status and status.get('status') in (JOB_STATUS_FILA, JOB_STATUS_PROCESSANDO):
+            continue
+
+        try:
+            idade = agora - os.path.getmtime(job_dir if status is None else os.path.join(job_dir, 'status.json'))
+        except OSError:
+            continue
+        if idade > JOBS_TTL:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            removidos += 1
+
+    if removidos:
+        logger.info(f"Limpeza de jobs: {removidos} job(s) expirado(s) removido(s)")
+    return removidos
+
+
+async def loop_limpeza_jobs():
+    """Varre periodicamente JOBS_DIR e UPLOADS_DIR removendo jobs e sessões de upload expirados"""
+    while True:
+        await asyncio.sleep(JOBS_INTERVALO_LIMPEZA)
+        try:
+            await run_in_threadpool(limpar_jobs)
+            await run_in_threadpool(limpar_sessoes_upload)
+        except Exception as e:
+            logger.warning(f"Limpeza de jobs falhou: {str(e)}")
+
+
+# ==============================================================================
+# SESSÕES DE UPLOAD EM PARTES (relatórios muito grandes)
+# ==============================================================================
+#
+# Um upload de centenas de MB em uma única requisição se perde inteiro se a conexão
+# cair no fim. Na sessão de upload, cada relatório é enviado em partes numeradas
+# (PUT, com o SHA-256 da parte), em qualquer ordem e em paralelo; uma parte que
+# falhou é reenviada sozinha. A finalização monta os relatórios a partir das partes
+# e cria um job com eles. Cada sessão tem um diretório próprio em UPLOADS_DIR:
+#   <sessao_id>/sessao.json                  - estado da sessão (e o job_id, se finalizada)
+#   <sessao_id>/partes/<relatorio>/<numero>  - partes recebidas (removidas na finalização)
+
+RELATORIOS_UPLOAD = ('dinheiro', 'vendas', 'pos_venda', 'liberacoes', 'extrato', 'retirada')
+RELATORIOS_OBRIGATORIOS = ('dinheiro', 'vendas', 'pos_venda', 'liberacoes', 'extrato')
+
+SESSAO_ABERTA = 'aberta'
+SESSAO_FINALIZADA = 'finalizada'
+
+_sessoes_finalizando = set()  # Sessões em finalização neste processo (evita dois jobs)
+
+
+def caminho_sessao_upload(sessao_id: str) -> Optional[str]:
+    """Retorna o diretório da sessão ou None se o ID for inválido"""
+    if not re.fullmatch(r'[0-9a-f]{32}', sessao_id or ''):
+        return None
+    return os.path.join(UPLOADS_DIR, sessao_id)
+
+
+def ler_sessao_upload(sessao_dir: str) -> Optional[Dict[str, Any]]:
+    """Lê o sessao.json (None se não existir)"""
+    try:
+        with open(os.path.join(sessao_dir, 'sessao.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def gravar_sessao_upload(sessao_dir: str, **campos) -> Dict[str, Any]:
+    """Atualiza o sessao.json de forma atômica (escreve e renomeia)"""
+    sessao = ler_sessao_upload(sessao_dir) or {}
+    sessao.update(campos)
+    tmp_path = os.path.join(sessao_dir, f'sessao.json.{uuid.uuid4().hex}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(sessao, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(sessao_dir, 'sessao.json'))
+    return sessao
+
+
+def partes_recebidas(sessao_dir: str) -> Dict[str, Dict[int, int]]:
+    """{relatorio: {numero: bytes}} das partes já recebidas"""
+    partes = {}
+    for relatorio in RELATORIOS_UPLOAD:
+        diretorio = os.path.join(sessao_dir, 'partes', relatorio)
+        if not os.path.isdir(diretorio):
+            continue
+        numeros = {int(nome): os.path.getsize(os.path.join(diretorio, nome))
+                   for nome in os.listdir(diretorio) if nome.isdigit()}
+        if numeros:
+            partes[relatorio] = dict(sorted(numeros.items()))
+    return partes
+
+
+def resumo_sessao_upload(sessao_dir: str, sessao: Dict[str, Any]) -> Dict[str, Any]:
+    """Estado da sessão + partes recebidas por relatório (para retomar um upload)"""
+    return {
+        **sessao,
+        'relatorios': {relatorio: {'partes': list(numeros), 'bytes': sum(numeros.values())}
+                       for relatorio, numeros in partes_recebidas(sessao_dir).items()},
     }
 
 
+def montar_relatorios_upload(sessao_dir: str, destino: str,
+                             checksums: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    Concatena as partes de cada relatório (1..N, em ordem) em `destino`.
+
+    Args:
+        checksums: {relatorio: SHA-256 do arquivo completo} - opcional; confere
+                   também que nenhuma parte final ficou de fora
+
+    Returns:
+        {relatorio: caminho_local} - o mesmo formato de salvar_uploads
+
+    Raises:
+        HTTPException: 400 (relatório obrigatório sem partes), 409 (partes faltando)
+                       ou 422 (checksum do arquivo completo não confere)
+    """
+    checksums = checksums or {}
+    partes = partes_recebidas(sessao_dir)
+
+    sem_partes = [r for r in RELATORIOS_OBRIGATORIOS + tuple(checksums) if r not in partes]
+    if sem_partes:
+        raise HTTPException(status_code=400, detail=f"Relatórios sem partes: {', '.join(sem_partes)}")
+    lacunas = {relatorio: sorted(set(range(1, max(numeros) + 1)) - set(numeros))
+               for relatorio, numeros in partes.items()}
+    lacunas = {relatorio: faltando for relatorio, faltando in lacunas.items() if faltando}
+    if lacunas:
+        raise HTTPException(status_code=409, detail="Partes faltando: " + '; '.join(
+            f"{relatorio} {', '.join(map(str, faltando[:20]))}" for relatorio, faltando in lacunas.items()))
+
+    caminhos = {}
+    for relatorio, numeros in partes.items():
+        caminhos[relatorio] = os.path.join(destino, relatorio)
+        sha = hashlib.sha256()
+        with open(caminhos[relatorio], 'wb') as saida:
+            for numero in numeros:
+                with open(os.path.join(sessao_dir, 'partes', relatorio, f'{numero:05d}'), 'rb') as parte:
+                    while True:
+                        bloco = parte.read(1024 * 1024)
+                        if not bloco:
+                            break
+                        sha.update(bloco)
+                        saida.write(bloco)
+        if relatorio in checksums and sha.hexdigest() != checksums[relatorio]:
+            raise HTTPException(status_code=422, detail=f"Checksum de '{relatorio}' não confere com as partes "
+                                                        f"recebidas (montado: {sha.hexdigest()})")
+    return caminhos
+
+
+def limpar_sessoes_upload() -> int:
+    """
+    Remove sessões de upload sem atividade há mais de UPLOADS_TTL segundos (abertas
+    e abandonadas, ou finalizadas - o job tem os próprios arquivos).
+
+    Returns:
+        Quantidade de sessões removidas
+    """
+    if not os.path.isdir(UPLOADS_DIR):
+        return 0
+
+    removidas = 0
+    agora = datetime.now().timestamp()
+    for sessao_id in os.listdir(UPLOADS_DIR):
+        sessao_dir = os.path.join(UPLOADS_DIR, sessao_id)
+        if sessao_id in _sessoes_finalizando:
+            continue
+        try:
+            caminho = os.path.join(sessao_dir, 'sessao.json')
+            idade = agora - os.path.getmtime(caminho if os.path.exists(caminho) else sessao_dir)
+        except OSError:
+            continue
+        if idade > UPLOADS_TTL:
+            shutil.rmtree(sessao_dir, ignore_errors=True)
+            removidas += 1
+
+    if removidas:
+        logger.info(f"Limpeza de uploads: {removidas} sessão(ões) expirada(s) removida(s)")
+    return removidas
+
+
+# ==============================================================================
+# ENDPOINTS DA API
+# ==============================================================================
+
+@app.get("/")
+async def root():
+    """Endpoint de health check"""
+    return {
+        "status": "online",
+        "service": "Super Conciliador API",
+        "version": "1.0.0"
+    }
+
+
+def montar_server_timing(saida: Dict[str, Any], origem: str, duracao_cache: float, duracao_total: float) -> str:
+    """
+    Monta o header Server-Timing (durações em ms). Resultados vindos do cache não
+    trazem as fases - só o tempo de leitura do cache e o total da requisição.
+    """
+    partes = []
+    fases = saida.get('metricas', {}).get('fases', {}) if origem != 'HIT' else {}
+    for nome, fases_somadas, descricao in SERVER_TIMING_FASES:
+        if any(fase in fases for fase in fases_somadas):
+            duracao = sum(fases.get(fase, 0.0) for fase in fases_somadas)
+            partes.append(f'{nome};dur={duracao * 1000:.1f};desc="{descricao}"')
+    if origem == 'HIT':
+        partes.append(f'cache;dur={duracao_cache * 1000:.1f};desc="HIT"')
+    partes.append(f'total;dur={duracao_total * 1000:.1f}')
+    return ', '.join(partes)
+
+
+def motor_da_requisicao(motor: Optional[str]) -> str:
+    """Valida o campo `motor` do formulário (400 se desconhecido ou não instalado)"""
+    try:
+        return resolver_motor(motor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def ofx_incremental_da_requisicao(ofx_incremental: bool) -> bool:
+    """Valida o campo `ofx_incremental` (400 se o registro de OFX estiver desativado)"""
+    if ofx_incremental and not OFX_EXPORTADOS_PATH:
+        raise HTTPException(status_code=400, detail="OFX incremental desativado (CONCILIADOR_OFX_EXPORTADOS)")
+    return ofx_incremental
+
+
+def ler_em_blocos(path: str, tamanho: int = 1 << 20) -> Iterator[bytes]:
+    """Conteúdo do arquivo em blocos de `tamanho` bytes"""
+    with open(path, 'rb') as f:
+        while bloco := f.read(tamanho):
+            yield bloco
+
+
+async def entregar_registrando_ofx(blocos: Iterable[bytes], registrar: Callable[[], Any]) -> AsyncIterator[bytes]:
+    """
+    Corpo de uma resposta com OFX incremental: envia os blocos e só então chama
+    `registrar` (no threadpool). O gerador só retoma depois que o último bloco foi
+    enviado; se o cliente desconectar antes, nada é gravado como exportado.
+    """
+    async for bloco in iterate_in_threadpool(iter(blocos)):
+        yield bloco
+    try:
+        await run_in_threadpool(registrar)
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"OFX incremental: não foi possível gravar as transações entregues: {str(e)}")
+
+
+# /conciliar/lancamentos: intervalo entre leituras do NDJSON que o worker ainda está
+# gravando e tamanho de cada leitura
+NDJSON_INTERVALO_LEITURA = 0.05
+NDJSON_BLOCO_BYTES = 1 << 20
+
+
+def erro_http(erro: BaseException) -> Tuple[int, str]:
+    """(status, detail) de um erro da conciliação no pool"""
+    if isinstance(erro, (ErroConciliacao, HTTPException)):
+        return erro.status_code, erro.detail
+    return 500, f"Erro ao processar conciliação: {str(erro)}"
+
+
+def encerrar_transmissao_ndjson(temp_dir: str, tarefa: 'asyncio.Future'):
+    """Remove os uploads e o NDJSON quando a conciliação termina (cliente pode ter desconectado)"""
+    if not tarefa.cancelled():
+        tarefa.exception()  # marca a exceção como tratada
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+async def transmitir_ndjson(destino: str, tarefa: 'asyncio.Future', temp_dir: str,
+                            comprimir: bool) -> AsyncIterator[bytes]:
+    """
+    Corpo do /conciliar/lancamentos: acompanha o NDJSON gravado pelo worker e envia
+    as linhas completas assim que aparecem no arquivo (gzip feito aqui, por bloco),
+    até a conciliação terminar; fecha com a linha de stats ou de erro.
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if comprimir else None  # formato gzip
+
+    def codificar(dados: bytes) -> bytes:
+        return compressor.compress(dados) if compressor else dados
+
+    try:
+        with open(destino, 'rb') as f:
+            pendente = b''
+            while True:
+                terminou = tarefa.done()  # antes da leitura: depois dela o arquivo está completo
+                bloco = await run_in_threadpool(f.read, NDJSON_BLOCO_BYTES)
+                if bloco:
+                    pendente += bloco
+                    fim = pendente.rfind(b'\n') + 1  # só linhas completas
+                    if fim:
+                        dados = codificar(pendente[:fim])
+                        pendente = pendente[fim:]
+                        if dados:
+                            yield dados
+                elif terminou:
+                    break
+                else:
+                    await asyncio.sleep(NDJSON_INTERVALO_LEITURA)
+
+        if tarefa.exception() is not None:
+            status_code, detail = erro_http(tarefa.exception())
+            final = {'livro': 'erro', 'status': status_code, 'detail': detail}
+        else:
+            saida = tarefa.result()
+            final = {'livro': 'stats', **saida['stats'], 'pico_memoria': saida.get('pico_memoria')}
+        dados = codificar(json.dumps(final, ensure_ascii=False, default=str).encode('utf-8') + b'\n')
+        yield dados + compressor.flush() if compressor else dados
+    finally:
+        tarefa.add_done_callback(functools.partial(encerrar_transmissao_ndjson, temp_dir))
+
+
+def montar_headers_stats(saida: Dict[str, Any]) -> Dict[str, str]:
+    """Headers X-Stats-* com as estatísticas da conciliação"""
+    stats = saida['stats']
+    headers = {
+        "X-Stats-Confirmados": str(stats.get('confirmados', 0)),
+        "X-Stats-Previsao": str(stats.get('previsao', 0)),
+        "X-Stats-Pagamentos": str(stats.get('pagamentos', 0)),
+        "X-Stats-Transferencias": str(stats.get('transferencias', 0)),
+        "X-Stats-Divergencias": str(stats.get('divergencias_fallback', 0)),
+        "X-Stats-Nao-Classificados": str(stats.get('nao_classificados', 0)),
+    }
+    # Entradas antigas do cache podem não ter as linhas de entrada
+    for key, linhas in stats.get('linhas_entrada', {}).items():
+        headers[f"X-Stats-Linhas-{key.replace('_', '-').title()}"] = str(linhas)
+    if stats.get('linhas_duplicadas'):
+        headers["X-Stats-Linhas-Duplicadas"] = str(sum(linhas for por_csv in stats['linhas_duplicadas'].values()
+                                                        for linhas in por_csv.values()))
+    if stats.get('ofx_incremental'):
+        headers["X-Stats-Ofx-Novas"] = str(stats['ofx_incremental']['novas'])
+    if saida.get('pico_memoria'):
+        headers["X-Stats-Pico-Memoria-MB"] = f"{saida['pico_memoria'] / 1048576:.1f}"
+    return headers
+
+
+@app.post("/conciliar")
+async def conciliar(
+    dinheiro: UploadFile = File(..., description="Arquivo settlement (dinheiro em conta) - CSV ou ZIP"),
+    vendas: UploadFile = File(..., description="Arquivo collection (vendas) - CSV ou ZIP"),
+    pos_venda: UploadFile = File(..., description="Arquivo after_collection (pós venda) - CSV ou ZIP"),
+    liberacoes: UploadFile = File(..., description="Arquivo reserve-release (liberações) - CSV ou ZIP"),
+    extrato: UploadFile = File(..., description="Arquivo account_statement (extrato) - CSV ou ZIP"),
+    retirada: Optional[UploadFile] = File(None, description="Arquivo withdraw (retirada) - opcional - CSV ou ZIP"),
+    centro_custo: str = Form("NETAIR", description="Centro de custo para os lançamentos"),
+    profile: bool = Form(False, description="Inclui a pasta Profiling/ no ZIP (requer CONCILIADOR_PROFILING=1)"),
+    motor: Optional[str] = Form(None, description="Motor da conciliação: pandas, duckdb ou polars (padrão: CONCILIADOR_MOTOR)"),
+    por_mes: bool = Form(False, description="Concilia os meses do extrato em paralelo (fechamentos longos)"),
+    pasta_por_mes: bool = Form(False, description="Inclui no ZIP uma pasta Meses/AAAA-MM/ por mês (implica por_mes)"),
+    ofx_incremental: bool = Form(False, description="OFX só com as transações ainda não exportadas para o centro de custo")
+):
+    """
+    Processa os relatórios do Mercado Livre e retorna um ZIP com os arquivos de importação.
+
+    ## Arquivos de entrada (CSV ou ZIP):
+    Cada campo aceita um arquivo CSV individual OU um arquivo ZIP contendo múltiplos CSVs.
+    Quando um ZIP é enviado, todos os CSVs dentro dele são extraídos e concatenados automaticamente.
+    Isso é útil para períodos longos que geram múltiplos arquivos compactados.
+    O CSV também pode vir compactado com gzip ou zstd, e o relatório pode vir em Parquet ou
+    Arrow IPC (detectados pelo conteúdo).
+
+    - **dinheiro**: settlement report (obrigatório) - CSV ou ZIP
+    - **vendas**: collection report (obrigatório) - CSV ou ZIP
+    - **pos_venda**: after_collection report (obrigatório) - CSV ou ZIP
+    - **liberacoes**: reserve-release report (obrigatório) - CSV ou ZIP
+    - **extrato**: account_statement report (obrigatório) - CSV ou ZIP
+    - **retirada**: withdraw report (opcional) - CSV ou ZIP
+
+    ## Parâmetros adicionais:
+    - **centro_custo**: Centro de custo para os lançamentos (padrão: NETAIR)
+    - **profile**: Executa com profiling e inclui a pasta Profiling/ no ZIP (padrão: false;
+      só aceito com CONCILIADOR_PROFILING=1)
+    - **motor**: Motor das junções da conciliação - `pandas`, `duckdb` ou `polars`
+      (padrão: CONCILIADOR_MOTOR); os lançamentos são os mesmos em qualquer motor
+    - **por_mes**: Particiona o extrato por mês da RELEASE_DATE e concilia os meses em
+      paralelo (CONCILIADOR_PROCESSOS_POR_MES processos); mesmos lançamentos
+    - **pasta_por_mes**: Inclui a pasta Meses/AAAA-MM/ com os arquivos de cada mês
+      (implica por_mes)
+    - **ofx_incremental**: Outros/EXTRATO_MERCADOPAGO.ofx só com as transações ainda não
+      exportadas para o centro de custo (FITIDs estáveis); não usa o cache
+
+    ## Arquivos de saída (ZIP com pastas):
+
+    ### Conta Azul/ (arquivos principais para importação)
+    - CONFIRMADOS.xlsx
+    - TRANSFERENCIAS.xlsx
+    - PAGAMENTO_CONTAS.xlsx
+
+    ### Resumo/ (agrupados por data e categoria)
+    - CONFIRMADOS_RESUMO.xlsx
+    - PREVISAO_RESUMO.xlsx
+    - TRANSFERENCIAS_RESUMO.xlsx
+    - PAGAMENTO_CONTAS_RESUMO.xlsx
+
+    ### Outros/ (CSVs e auxiliares)
+    - CONFIRMADOS.csv
+    - PREVISAO.csv
+    - PREVISAO.xlsx
+    - PAGAMENTO_CONTAS.csv
+    - TRANSFERENCIAS.csv
+
+    ### Meses/AAAA-MM/ (apenas com pasta_por_mes=true)
+    - Conta Azul/, Resumo/ e Outros/ com os lançamentos do mês (sem previsões)
+
+    ### Profiling/ (apenas com profile=true)
+    - conciliacao.pstats (cProfile)
+    - top_funcoes.txt
+    - pilhas_colapsadas.txt (formato flamegraph)
+    - memoria_por_fase.csv (pico do tracemalloc por fase)
+    """
+
+    if profile and not PROFILING_HABILITADO:
+        raise HTTPException(status_code=403, detail="Profiling desabilitado (CONCILIADOR_PROFILING)")
+    opcoes = {'motor': motor_da_requisicao(motor), 'por_mes': por_mes or pasta_por_mes,
+              'pasta_por_mes': pasta_por_mes, 'ofx_incremental': ofx_incremental_da_requisicao(ofx_incremental)}
+
+    inicio_requisicao = time.perf_counter()
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        # Salvar uploads em disco - os workers leem os relatórios a partir dos arquivos
+        caminhos, hashes = await salvar_uploads({
+            'dinheiro': dinheiro,
+            'vendas': vendas,
+            'pos_venda': pos_venda,
+            'liberacoes': liberacoes,
+            'extrato': extrato,
+            'retirada': retirada,
+        }, temp_dir)
+    except Exception:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+    # Leitura, conciliação e geração dos arquivos rodam no pool de processos
+    # (ou vêm do cache / de uma requisição idêntica em andamento)
+    inicio_conciliacao = time.perf_counter()
+    try:
+        saida, origem_resultado = await conciliar_com_cache(caminhos, hashes, centro_custo, temp_dir,
+                                                            perfilar=profile, opcoes=opcoes)
+    except ErroConciliacao as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    fim_conciliacao = time.perf_counter()
+
+    metricas.incrementar('conciliador_requisicoes_total', origem=origem_resultado)
+
+    # Gerar nome do arquivo com timestamp
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f"conciliacao_{timestamp}.zip"
+
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        **montar_headers_stats(saida),
+        "X-Cache": origem_resultado,
+        "Server-Timing": montar_server_timing(saida, origem_resultado, fim_conciliacao - inicio_conciliacao,
+                                              fim_conciliacao - inicio_requisicao),
+    }
+
+    conteudo = io.BytesIO(saida['zip'])
+    if saida.get('ofx_pendentes'):
+        conteudo = entregar_registrando_ofx(
+            [saida['zip']], functools.partial(registrar_ofx_entregue, centro_custo, saida['ofx_pendentes']))
+
+    return StreamingResponse(
+        conteudo,
+        media_type="application/zip",
+        headers=headers
+    )
+
+
+@app.post("/conciliar/lancamentos")
+async def conciliar_lancamentos(
+    request: Request,
+    dinheiro: UploadFile = File(..., description="Arquivo settlement (dinheiro em conta) - CSV ou ZIP"),
+    vendas: UploadFile = File(..., description="Arquivo collection (vendas) - CSV ou ZIP"),
+    pos_venda: UploadFile = File(..., description="Arquivo after_collection (pós venda) - CSV ou ZIP"),
+    liberacoes: UploadFile = File(..., description="Arquivo reserve-release (liberações) - CSV ou ZIP"),
+    extrato: UploadFile = File(..., description="Arquivo account_statement (extrato) - CSV ou ZIP"),
+    retirada: Optional[UploadFile] = File(None, description="Arquivo withdraw (retirada) - opcional - CSV ou ZIP"),
+    centro_custo: str = Form("NETAIR", description="Centro de custo para os lançamentos"),
+    motor: Optional[str] = Form(None, description="Motor da conciliação: pandas, duckdb ou polars (padrão: CONCILIADOR_MOTOR)"),
+    por_mes: bool = Form(False, description="Concilia os meses do extrato em paralelo (fechamentos longos)")
+):
+    """
+    Mesma conciliação do `/conciliar`, mas retorna os lançamentos como NDJSON em vez do ZIP.
+
+    Para integrações: nenhum XLSX/CSV/OFX/ZIP é gerado. Cada linha é um objeto JSON
+    com o campo `livro` (`confirmados`, `pagamentos`, `transferencias` ou `previsao`)
+    e os campos do lançamento (ID Operação, Data de Competência, Data de Pagamento,
+    Categoria, Valor, Centro de Custo, Descrição, Observações).
+
+    A resposta é transmitida enquanto a conciliação roda: cada livro sai assim que
+    fica definitivo (os do extrato antes das previsões; com `por_mes`, todos ao fim).
+    A última linha traz as estatísticas (`{"livro": "stats", ...}`, os mesmos campos
+    dos headers X-Stats-* do `/conciliar`) ou, se a conciliação falhar depois do
+    início da resposta, o erro (`{"livro": "erro", "status": ..., "detail": ...}`).
+
+    Com `Accept-Encoding: gzip` a resposta vem comprimida (`Content-Encoding: gzip`).
+    """
+    motor = motor_da_requisicao(motor)
+    opcoes = {'motor': motor, 'por_mes': por_mes}
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        caminhos, _ = await salvar_uploads({
+            'dinheiro': dinheiro,
+            'vendas': vendas,
+            'pos_venda': pos_venda,
+            'liberacoes': liberacoes,
+            'extrato': extrato,
+            'retirada': retirada,
+        }, temp_dir)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+    destino = os.path.join(temp_dir, 'lancamentos.ndjson')
+
+    async def conciliar_no_pool() -> Dict[str, Any]:
+        bruta = await run_in_threadpool(estimar_memoria_bruta, caminhos)
+        async with reservar_memoria(estimar_memoria(bruta) + memoria_processos_por_mes(opcoes)):
+            try:
+                saida, pico = await executar_no_pool(
+                    executar_medindo, functools.partial(executar_conciliacao, saida_ndjson=destino, **opcoes),
+                    caminhos, centro_custo
+                )
+            except (ErroConciliacao, HTTPException):
+                metricas.incrementar('conciliador_execucoes_total', resultado='erro')
+                raise
+        # Sem XLSX/ZIP o pico é menor que o da conciliação completa: não recalibra a estimativa
+        metricas.registrar_execucao(saida['metricas'], pico)
+        saida['pico_memoria'] = pico
+        return saida
+
+    tarefa = asyncio.ensure_future(conciliar_no_pool())
+    try:
+        # Só responde quando o primeiro livro foi gravado: erros de leitura e da
+        # conciliação em si ainda saem com o status HTTP (400, 503...)
+        while not tarefa.done() and not await run_in_threadpool(os.path.exists, destino):
+            await asyncio.sleep(NDJSON_INTERVALO_LEITURA)
+        if tarefa.done() and tarefa.exception() is not None:
+            status_code, detail = erro_http(tarefa.exception())
+            raise HTTPException(status_code=status_code, detail=detail)
+    except BaseException:
+        tarefa.add_done_callback(functools.partial(encerrar_transmissao_ndjson, temp_dir))
+        raise
+
+    comprimir = 'gzip' in request.headers.get('accept-encoding', '').lower()
+    return StreamingResponse(
+        transmitir_ndjson(destino, tarefa, temp_dir, comprimir),
+        media_type="application/x-ndjson",
+        headers={"Content-Encoding": "gzip"} if comprimir else None
+    )
+
+
+@app.post("/conciliar/diferencas")
+async def conciliar_diferencas(
+    dinheiro: UploadFile = File(..., description="Arquivo settlement (dinheiro em conta) - CSV ou ZIP"),
+    vendas: UploadFile = File(..., description="Arquivo collection (vendas) - CSV ou ZIP"),
+    pos_venda: UploadFile = File(..., description="Arquivo after_collection (pós venda) - CSV ou ZIP"),
+    liberacoes: UploadFile = File(..., description="Arquivo reserve-release (liberações) - CSV ou ZIP"),
+    extrato: UploadFile = File(..., description="Arquivo account_statement (extrato) - CSV ou ZIP"),
+    retirada: Optional[UploadFile] = File(None, description="Arquivo withdraw (retirada) - opcional - CSV ou ZIP"),
+    anterior: Optional[UploadFile] = File(None, description="ZIP de uma conciliação anterior (/conciliar ou /jobs)"),
+    job_anterior: Optional[str] = Form(None, description="ID de um job concluído (alternativa a `anterior`)"),
+    centro_custo: str = Form("NETAIR", description="Centro de custo para os lançamentos"),
+    motor: Optional[str] = Form(None, description="Motor da conciliação: pandas, duckdb ou polars (padrão: CONCILIADOR_MOTOR)"),
+    por_mes: bool = Form(False, description="Concilia os meses do extrato em paralelo (fechamentos longos)")
+):
+    """
+    Refaz a conciliação com os relatórios novos (ex: reemitidos pelo Mercado Pago) e
+    retorna só o que mudou em relação a uma execução anterior - o ZIP dela (`anterior`)
+    ou um job ainda disponível (`job_anterior`).
+
+    Os lançamentos dos livros importáveis (confirmados, previsao, pagamentos,
+    transferencias - os CSVs de Outros/) são cruzados pela chave Categoria +
+    Descrição + ocorrência (diferencas_livro): lançamentos idênticos nas duas
+    execuções são inalterados, e os demais são pareados pela posição entre os de
+    mesma categoria e descrição, na ordem de data de pagamento e valor.
+    - **adicionados**: só na execução nova (importar)
+    - **removidos**: só na anterior (excluir no Conta Azul)
+    - **alterados**: mesma chave com data, valor, centro de custo ou observações
+      diferentes (`antes` e `depois`)
+    - **resumo**: contagens por livro, incluindo os inalterados
+
+    Ambiguidade que resta: com vários lançamentos alterados da mesma categoria e
+    descrição (ex: dois reembolsos parciais do mesmo ID com valores novos), o
+    pareamento antes/depois segue a ordem de data e valor, que pode não ser o
+    par "real" - a soma do que excluir e importar continua correta.
+    """
+    if (anterior is None) == (not job_anterior):
+        raise HTTPException(status_code=400, detail="Informe a execução anterior: `anterior` (ZIP) "
+                                                    "ou `job_anterior` (ID do job), um dos dois")
+    opcoes = {'motor': motor_da_requisicao(motor), 'por_mes': por_mes, 'pasta_por_mes': False}
+
+    if job_anterior:
+        job_dir = caminho_job(job_anterior)
+        status = ler_status_job(job_dir) if job_dir else None
+        if status is None:
+            raise HTTPException(status_code=404, detail="Job anterior não encontrado ou expirado")
+        if status.get('status') != JOB_STATUS_CONCLUIDO:
+            raise HTTPException(status_code=409, detail=f"Job anterior não concluído (status: {status.get('status')})")
+        with open(os.path.join(job_dir, 'resultado.zip'), 'rb') as f:
+            conteudo_anterior = await run_in_threadpool(f.read)
+    else:
+        conteudo_anterior = await anterior.read()
+    try:
+        livros_anteriores = await run_in_threadpool(ler_livros_resultado, conteudo_anterior)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    del conteudo_anterior
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        caminhos, hashes = await salvar_uploads({
+            'dinheiro': dinheiro,
+            'vendas': vendas,
+            'pos_venda': pos_venda,
+            'liberacoes': liberacoes,
+            'extrato': extrato,
+            'retirada': retirada,
+        }, temp_dir)
+    except Exception:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+    # Mesma execução do /conciliar (cache, pool e requisições idênticas agrupadas)
+    try:
+        saida, origem_resultado = await conciliar_com_cache(caminhos, hashes, centro_custo, temp_dir,
+                                                            opcoes=opcoes)
+    except ErroConciliacao as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    metricas.incrementar('conciliador_requisicoes_total', origem=origem_resultado)
+
+    livros_novos = await run_in_threadpool(ler_livros_resultado, saida['zip'])
+    diferencas = await run_in_threadpool(diferencas_resultados, livros_anteriores, livros_novos)
+    logger.info("Diferenças: " + ', '.join(
+        f"{livro} +{r['adicionados']} -{r['removidos']} ~{r['alterados']}"
+        for livro, r in diferencas['resumo'].items()))
+    return diferencas
+
+
+@app.post("/jobs", status_code=202)
+async def criar_job(
+    dinheiro: UploadFile = File(..., description="Arquivo settlement (dinheiro em conta) - CSV ou ZIP"),
+    vendas: UploadFile = File(..., description="Arquivo collection (vendas) - CSV ou ZIP"),
+    pos_venda: UploadFile = File(..., description="Arquivo after_collection (pós venda) - CSV ou ZIP"),
+    liberacoes: UploadFile = File(..., description="Arquivo reserve-release (liberações) - CSV ou ZIP"),
+    extrato: UploadFile = File(..., description="Arquivo account_statement (extrato) - CSV ou ZIP"),
+    retirada: Optional[UploadFile] = File(None, description="Arquivo withdraw (retirada) - opcional - CSV ou ZIP"),
+    centro_custo: str = Form("NETAIR", description="Centro de custo para os lançamentos"),
+    motor: Optional[str] = Form(None, description="Motor da conciliação: pandas, duckdb ou polars (padrão: CONCILIADOR_MOTOR)"),
+    por_mes: bool = Form(False, description="Concilia os meses do extrato em paralelo (fechamentos longos)"),
+    pasta_por_mes: bool = Form(False, description="Inclui no ZIP uma pasta Meses/AAAA-MM/ por mês (implica por_mes)"),
+    ofx_incremental: bool = Form(False, description="OFX só com as transações ainda não exportadas para o centro de custo")
+):
+    """
+    Cria um job assíncrono de conciliação com os mesmos arquivos de `/conciliar`.
+
+    Retorna imediatamente o `job_id`. Acompanhe com `GET /jobs/{job_id}` e baixe
+    o ZIP com `GET /jobs/{job_id}/result` quando o status for `concluido`.
+    O resultado fica disponível por CONCILIADOR_JOBS_TTL segundos.
+    """
+    opcoes = {'motor': motor_da_requisicao(motor), 'por_mes': por_mes or pasta_por_mes,
+              'pasta_por_mes': pasta_por_mes, 'ofx_incremental': ofx_incremental_da_requisicao(ofx_incremental)}
+    job_id, job_dir, entrada_dir = await run_in_threadpool(novo_job)
+
+    try:
+        caminhos, _ = await salvar_uploads({
+            'dinheiro': dinheiro,
+            'vendas': vendas,
+            'pos_venda': pos_venda,
+            'liberacoes': liberacoes,
+            'extrato': extrato,
+            'retirada': retirada,
+        }, entrada_dir)
+    except Exception:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+
+    return enfileirar_job(job_id, job_dir, caminhos, centro_custo, opcoes)
+
+
+@app.get("/jobs/{job_id}")
+async def consultar_job(job_id: str):
+    """
+    Retorna o status do job e o progresso por fase.
+
+    - **status**: `na_fila`, `processando`, `concluido` ou `erro`
+    - **fase**: fase atual (leitura, indexacao, liberacoes, extrato, previsoes, arquivos, zip)
+    - **fases**: início/fim de cada fase já executada
+    - **progresso**: fração de 0 a 1
+    - **stats**: estatísticas da conciliação (quando concluído)
+    """
+    job_dir = caminho_job(job_id)
+    status = ler_status_job(job_dir) if job_dir else None
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado ou expirado")
+    status.pop('ofx_pendentes', None)
+    return status
+
+
+@app.get("/jobs/{job_id}/result")
+async def resultado_job(job_id: str):
+    """
+    Baixa o ZIP de saída de um job concluído. Com OFX incremental, as transações do
+    OFX são gravadas como exportadas ao fim do primeiro download completo.
+    """
+    job_dir = caminho_job(job_id)
+    status = ler_status_job(job_dir) if job_dir else None
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado ou expirado")
+
+    if status.get('status') == JOB_STATUS_ERRO:
+        raise HTTPException(status_code=409, detail=f"Job terminou com erro: {status.get('erro', '')}")
+    if status.get('status') != JOB_STATUS_CONCLUIDO:
+        raise HTTPException(status_code=409, detail=f"Job ainda não concluído (status: {status.get('status')})")
+
+    resultado_path = os.path.join(job_dir, 'resultado.zip')
+    headers = montar_headers_stats({'stats': status.get('stats', {}), 'pico_memoria': status.get('pico_memoria')})
+    if status.get('ofx_pendentes'):
+        # Sem FileResponse: um download parcial (Range) não pode gravar o OFX como exportado
+        def registrar():
+            registrar_ofx_entregue(status['centro_custo'], status['ofx_pendentes'])
+            atualizar_status_job(job_dir, ofx_pendentes=[])
+
+        return StreamingResponse(
+            entregar_registrando_ofx(ler_em_blocos(resultado_path), registrar),
+            media_type="application/zip",
+            headers={"Content-Disposition": f"attachment; filename=conciliacao_{job_id}.zip",
+                     "Content-Length": str(os.path.getsize(resultado_path)), **headers}
+        )
+
+    return FileResponse(
+        resultado_path,
+        media_type="application/zip",
+        filename=f"conciliacao_{job_id}.zip",
+        headers=headers
+    )
+
+
+@app.post("/uploads", status_code=201)
+async def criar_sessao_upload():
+    """
+    Abre uma sessão de upload em partes (relatórios grandes demais para uma única
+    requisição). Envie as partes com `PUT /uploads/{sessao_id}/{relatorio}/{numero}`
+    e finalize com `POST /uploads/{sessao_id}/finalizar`.
+    """
+    sessao_id = uuid.uuid4().hex
+    sessao_dir = caminho_sessao_upload(sessao_id)
+    os.makedirs(os.path.join(sessao_dir, 'partes'))
+    sessao = gravar_sessao_upload(sessao_dir, sessao_id=sessao_id, status=SESSAO_ABERTA,
+                                  criado_em=datetime.now().isoformat())
+    return {**sessao, 'parte_max_bytes': UPLOADS_PARTE_MAX_BYTES, 'partes_max': UPLOADS_PARTES_MAX,
+            'relatorios': list(RELATORIOS_UPLOAD)}
+
+
+def sessao_upload_da_requisicao(sessao_id: str) -> Tuple[str, Dict[str, Any]]:
+    """(sessao_dir, sessao) - 404 se a sessão não existir ou tiver expirado"""
+    sessao_dir = caminho_sessao_upload(sessao_id)
+    sessao = ler_sessao_upload(sessao_dir) if sessao_dir else None
+    if sessao is None:
+        raise HTTPException(status_code=404, detail="Sessão de upload não encontrada ou expirada")
+    return sessao_dir, sessao
+
+
+@app.put("/uploads/{sessao_id}/{relatorio}/{numero}")
+async def enviar_parte_upload(sessao_id: str, relatorio: str, numero: int, request: Request):
+    """
+    Recebe uma parte de um relatório (corpo bruto da requisição).
+
+    - **numero**: 1, 2, 3... - as partes são concatenadas nessa ordem na finalização
+    - **X-Checksum-SHA256** (header obrigatório): SHA-256 da parte; se não conferir,
+      a parte é descartada (422) e deve ser reenviada
+
+    Reenviar uma parte substitui a anterior, então é seguro repetir um PUT que falhou.
+    """
+    sessao_dir, sessao = sessao_upload_da_requisicao(sessao_id)
+    if sessao.get('status') != SESSAO_ABERTA:
+        raise HTTPException(status_code=409, detail="Sessão de upload já finalizada")
+    if relatorio not in RELATORIOS_UPLOAD:
+        raise HTTPException(status_code=400, detail=f"Relatório desconhecido '{relatorio}'. "
+                                                    f"Disponíveis: {', '.join(RELATORIOS_UPLOAD)}")
+    if not 1 <= numero <= UPLOADS_PARTES_MAX:
+        raise HTTPException(status_code=400, detail=f"Número da parte deve estar entre 1 e {UPLOADS_PARTES_MAX}")
+    checksum = request.headers.get('x-checksum-sha256', '').strip().lower()
+    if not re.fullmatch(r'[0-9a-f]{64}', checksum):
+        raise HTTPException(status_code=400, detail="Header X-Checksum-SHA256 ausente ou inválido")
+
+    diretorio = os.path.join(sessao_dir, 'partes', relatorio)
+    os.makedirs(diretorio, exist_ok=True)
+    tmp_path = os.path.join(diretorio, f'{numero:05d}.{uuid.uuid4().hex}.tmp')
+    sha = hashlib.sha256()
+    tamanho = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            buffer = bytearray()
+            async for bloco in request.stream():
+                tamanho += len(bloco)
+                if tamanho > UPLOADS_PARTE_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Parte maior que o limite de "
+                                                                f"{UPLOADS_PARTE_MAX_BYTES} bytes")
+                sha.update(bloco)
+                buffer += bloco
+                if len(buffer) >= 1024 * 1024:
+                    await run_in_threadpool(f.write, bytes(buffer))
+                    buffer.clear()
+            await run_in_threadpool(f.write, bytes(buffer))
+
+        if sha.hexdigest() != checksum:
+            metricas.incrementar('conciliador_upload_partes_total', resultado='checksum_invalido')
+            raise HTTPException(status_code=422, detail=f"Checksum da parte {numero} de '{relatorio}' não confere "
+                                                        f"(recebido: {sha.hexdigest()})")
+        os.replace(tmp_path, os.path.join(diretorio, f'{numero:05d}'))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # Atualiza o mtime do sessao.json: a limpeza conta o TTL a partir da última parte
+    os.utime(os.path.join(sessao_dir, 'sessao.json'))
+    metricas.incrementar('conciliador_upload_partes_total', resultado='ok')
+    return {'relatorio': relatorio, 'numero': numero, 'bytes': tamanho, 'sha256': checksum}
+
+
+@app.get("/uploads/{sessao_id}")
+async def consultar_sessao_upload(sessao_id: str):
+    """
+    Estado da sessão e as partes já recebidas de cada relatório - para retomar um
+    upload interrompido, reenvie apenas as partes que não aparecem aqui.
+    """
+    sessao_dir, sessao = sessao_upload_da_requisicao(sessao_id)
+    return await run_in_threadpool(resumo_sessao_upload, sessao_dir, sessao)
+
+
+@app.post("/uploads/{sessao_id}/finalizar", status_code=202)
+async def finalizar_sessao_upload(
+    sessao_id: str,
+    centro_custo: str = Form("NETAIR", description="Centro de custo para os lançamentos"),
+    motor: Optional[str] = Form(None, description="Motor da conciliação: pandas, duckdb ou polars (padrão: CONCILIADOR_MOTOR)"),
+    por_mes: bool = Form(False, description="Concilia os meses do extrato em paralelo (fechamentos longos)"),
+    pasta_por_mes: bool = Form(False, description="Inclui no ZIP uma pasta Meses/AAAA-MM/ por mês (implica por_mes)"),
+    ofx_incremental: bool = Form(False, description="OFX só com as transações ainda não exportadas para o centro de custo"),
+    checksums: Optional[str] = Form(None, description='SHA-256 dos arquivos completos (JSON: {"vendas": "..."}) - opcional')
+):
+    """
+    Monta os relatórios a partir das partes recebidas e cria um job de conciliação
+    (mesma resposta de `POST /jobs`). Acompanhe com `GET /jobs/{job_id}`.
+
+    Finalizar de novo uma sessão já finalizada retorna o status do mesmo job.
+    """
+    sessao_dir, sessao = sessao_upload_da_requisicao(sessao_id)
+    if sessao.get('status') == SESSAO_FINALIZADA:
+        status = ler_status_job(caminho_job(sessao['job_id']))
+        if status is None:
+            raise HTTPException(status_code=404, detail="Job da sessão não encontrado ou expirado")
+        return status
+    if sessao_id in _sessoes_finalizando:
+        raise HTTPException(status_code=409, detail="Sessão de upload já está sendo finalizada")
+
+    try:
+        checksums_arquivos = json.loads(checksums) if checksums else {}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Campo checksums deve ser um JSON {relatorio: sha256}")
+    if not isinstance(checksums_arquivos, dict) or not set(checksums_arquivos) <= set(RELATORIOS_UPLOAD):
+        raise HTTPException(status_code=400, detail="Campo checksums deve ser um JSON {relatorio: sha256}")
+    checksums_arquivos = {relatorio: str(sha).lower() for relatorio, sha in checksums_arquivos.items()}
+
+    opcoes = {'motor': motor_da_requisicao(motor), 'por_mes': por_mes or pasta_por_mes,
+              'pasta_por_mes': pasta_por_mes, 'ofx_incremental': ofx_incremental_da_requisicao(ofx_incremental)}
+    _sessoes_finalizando.add(sessao_id)
+    try:
+        job_id, job_dir, entrada_dir = await run_in_threadpool(novo_job)
+        try:
+            caminhos = await run_in_threadpool(montar_relatorios_upload, sessao_dir, entrada_dir, checksums_arquivos)
+        except Exception:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+
+        gravar_sessao_upload(sessao_dir, status=SESSAO_FINALIZADA, job_id=job_id,
+                             finalizado_em=datetime.now().isoformat())
+        shutil.rmtree(os.path.join(sessao_dir, 'partes'), ignore_errors=True)
+        return enfileirar_job(job_id, job_dir, caminhos, centro_custo, opcoes, sessao_upload=sessao_id)
+    finally:
+        _sessoes_finalizando.discard(sessao_id)
+
+
+@app.get("/health")
+async def health_check():
+    """Endpoint de health check detalhado"""
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "dependencies": {
+            # Versões instaladas, sem importar os módulos no processo da API
+            "pandas": importlib.metadata.version('pandas'),
+            "numpy": importlib.metadata.version('numpy')
+        },
+        "memoria": {
+            "orcamento_mb": round(MEMORIA_ORCAMENTO_BYTES / 1024 / 1024),
+            "reservado_mb": round(_memoria_reservada / 1024 / 1024),
+            "correcao_estimativa": round(_memoria_correcao, 2)
+        },
+        "inicializacao": {
+            "importacao_api_s": TEMPO_IMPORTACAO_API,
+            "modulos_pesados_carregados": sorted(TEMPOS_IMPORTACAO),
+            "aquecimento": _aquecimento
+        }
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def exportar_metricas():
+    """
+    Métricas no formato Prometheus: duração por fase e por escritor (histogramas),
+    pico de memória por conciliação, linhas lidas, lançamentos emitidos,
+    fallbacks, divergências e não classificados (contadores).
+    """
+    return PlainTextResponse(metricas.exportar(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# Tempo de importação deste módulo (FastAPI + definições, sem pandas/numpy/openpyxl)
+TEMPO_IMPORTACAO_API = round(time.perf_counter() - _inicio_importacao, 3)
+
+
 # ==============================================================================
 # EXECUÇÃO
 # ==============================================================================
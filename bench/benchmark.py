@@ -0,0 +1,174 @@
+"""
+Benchmark do pipeline de conciliação sobre relatórios sintéticos (gerar_relatorios.py).
+
+Para cada volume, gera (ou reaproveita) os relatórios e executa o pipeline completo
+no próprio processo (api.executar_conciliacao, sem pool e sem cache), registrando o
+tempo de cada fase (leitura por relatório, indexação, liberações, extrato,
+previsões, arquivos, zip) e de cada escritor gerar_*. O resultado vai para um JSON
+para comparação entre versões.
+
+Uso:
+    python bench/benchmark.py --operacoes 10000 100000 --repeticoes 3
+    python bench/benchmark.py --operacoes 1000000 --saida bench/resultados/1m.json
+    python bench/benchmark.py --operacoes 100000 --motor duckdb
+    python bench/benchmark.py --operacoes 1000000 --por-mes
+
+Cada repetição é registrada; o resumo por volume usa a mediana das repetições.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+from datetime import datetime
+from typing import Any, Dict, List
+
+DIR_BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(DIR_BENCH))
+
+import api  # noqa: E402
+from gerar_relatorios import gerar_relatorios  # noqa: E402
+
+
+def revisao_git() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=DIR_BENCH,
+                              capture_output=True, text=True, timeout=5).stdout.strip()
+    except Exception:
+        return ''
+
+
+def ambiente() -> Dict[str, Any]:
+    dependencias = {}
+    for nome in ('pandas', 'numpy', 'openpyxl', 'duckdb', 'polars'):
+        try:
+            dependencias[nome] = api.importlib.metadata.version(nome)
+        except Exception:
+            dependencias[nome] = None
+    return {
+        'versao_motor': api.VERSAO_MOTOR,
+        'git': revisao_git(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'dependencias': dependencias,
+    }
+
+
+def preparar_dados(operacoes: int, seed: int, zip_partes: int, dir_dados: str) -> Dict[str, Any]:
+    """Reaproveita os relatórios já gerados com os mesmos parâmetros; senão gera de novo"""
+    destino = os.path.join(dir_dados, f'{operacoes}_s{seed}_z{zip_partes}')
+    caminho_manifesto = os.path.join(destino, 'manifesto.json')
+    if os.path.exists(caminho_manifesto):
+        with open(caminho_manifesto, encoding='utf-8') as f:
+            manifesto = json.load(f)
+        if all(os.path.exists(p) for p in manifesto['caminhos'].values()):
+            return manifesto
+    return gerar_relatorios(destino, operacoes, seed=seed, zip_partes=zip_partes)
+
+
+def executar_uma_vez(caminhos: Dict[str, str], motor: str = None, por_mes: bool = False) -> Dict[str, Any]:
+    inicio = time.perf_counter()
+    saida = api.executar_conciliacao(caminhos, motor=motor, por_mes=por_mes)
+    total = time.perf_counter() - inicio
+
+    escritores: Dict[str, float] = {}
+    for escrita in saida['metricas']['escritas']:
+        escritores[escrita['escritor']] = escritores.get(escrita['escritor'], 0.0) + escrita['segundos']
+
+    stats = saida['stats']
+    return {
+        'total_s': total,
+        'fases_s': saida['metricas']['fases'],
+        'escritores_s': escritores,
+        'escritas': saida['metricas']['escritas'],
+        'zip_bytes': len(saida['zip']),
+        'lancamentos': {livro: stats.get(livro, 0)
+                        for livro in ('confirmados', 'previsao', 'pagamentos', 'transferencias')},
+        'divergencias_fallback': stats.get('divergencias_fallback', 0),
+        'nao_classificados': stats.get('nao_classificados', 0),
+    }
+
+
+def mediana_por_chave(execucoes: List[Dict[str, float]]) -> Dict[str, float]:
+    chaves = {chave for execucao in execucoes for chave in execucao}
+    return {chave: round(statistics.median(e.get(chave, 0.0) for e in execucoes), 4)
+            for chave in sorted(chaves)}
+
+
+def medir_volume(operacoes: int, repeticoes: int, seed: int, zip_partes: int, dir_dados: str,
+                 motor: str = None, por_mes: bool = False) -> Dict[str, Any]:
+    manifesto = preparar_dados(operacoes, seed, zip_partes, dir_dados)
+    execucoes = [executar_uma_vez(manifesto['caminhos'], motor, por_mes) for _ in range(repeticoes)]
+
+    resumo = {
+        'total_s': round(statistics.median(e['total_s'] for e in execucoes), 4),
+        'fases_s': mediana_por_chave([e['fases_s'] for e in execucoes]),
+        'escritores_s': mediana_por_chave([e['escritores_s'] for e in execucoes]),
+    }
+    return {
+        'operacoes': operacoes,
+        'seed': seed,
+        'zip_partes': zip_partes,
+        'linhas_entrada': manifesto['linhas'],
+        'bytes_entrada': manifesto['bytes'],
+        'lancamentos': execucoes[0]['lancamentos'],
+        'divergencias_fallback': execucoes[0]['divergencias_fallback'],
+        'nao_classificados': execucoes[0]['nao_classificados'],
+        'zip_bytes': execucoes[0]['zip_bytes'],
+        'mediana': resumo,
+        'execucoes': execucoes,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline de conciliação")
+    parser.add_argument('--operacoes', type=int, nargs='+', default=[10_000, 100_000],
+                        help="Volumes (número de operações) a medir")
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--zip-partes', type=int, default=0)
+    parser.add_argument('--motor', default=None, help="Motor da conciliação (padrão: CONCILIADOR_MOTOR)")
+    parser.add_argument('--por-mes', action='store_true',
+                        help="Concilia os meses do extrato em paralelo (processar_conciliacao_por_mes)")
+    parser.add_argument('--dados', default=os.path.join(DIR_BENCH, 'dados'),
+                        help="Diretório dos relatórios gerados (reaproveitados entre execuções)")
+    parser.add_argument('--saida', default=os.path.join(DIR_BENCH, 'resultados', 'benchmark.json'))
+    args = parser.parse_args(argv)
+
+    # O log por conciliação e os avisos de parsing de data não interessam aqui
+    api.logger.setLevel(logging.ERROR)
+    warnings.filterwarnings('ignore')
+    # IDs sintéticos não podem entrar no índice persistente de vendas do servidor
+    api.INDICE_VENDAS_PATH = ''
+
+    resultado = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'ambiente': ambiente(),
+        'repeticoes': args.repeticoes,
+        'motor': args.motor or api.MOTOR_PADRAO,
+        'por_mes': args.por_mes,
+        'volumes': [],
+    }
+    for operacoes in args.operacoes:
+        medicao = medir_volume(operacoes, args.repeticoes, args.seed, args.zip_partes, args.dados, args.motor,
+                               args.por_mes)
+        resultado['volumes'].append(medicao)
+        fases = ', '.join(f"{fase}={segundos:.2f}s" for fase, segundos in medicao['mediana']['fases_s'].items()
+                          if not fase.startswith('leitura_'))
+        print(f"{operacoes:>9} operações: total={medicao['mediana']['total_s']:.2f}s ({fases})", flush=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"Resultados em {args.saida}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Corpus de casos difíceis para o harness de equivalência (equivalencia.py).
+
+Cada caso é um conjunto mínimo e completo dos 5 relatórios que exercita um caminho
+específico da conciliação - os que mais quebram quando processar_conciliacao é
+reescrito (vetorizado, particionado, incremental). Os IDs de cada caso estão
+indicados nos comentários para facilitar a leitura do relatório de diferenças.
+"""
+
+from typing import Dict, List
+
+from gerar_relatorios import CABECALHOS
+
+SALDO_INICIAL_EXTRATO = "1.000,00"
+
+
+def montar_caso(descricao: str, dinheiro: List[str] = (), vendas: List[str] = (), pos_venda: List[str] = (),
+                liberacoes: List[str] = (), extrato: List[str] = ()) -> Dict[str, object]:
+    """Monta os 5 relatórios de um caso (cabeçalhos de gerar_relatorios.CABECALHOS)"""
+    linhas = {'dinheiro': dinheiro, 'vendas': vendas, 'pos_venda': pos_venda,
+              'liberacoes': liberacoes, 'extrato': extrato}
+    relatorios = {}
+    for key, rows in linhas.items():
+        prefixo = ''
+        if key == 'extrato':
+            prefixo = f"INITIAL_BALANCE;CREDITS;DEBITS;FINAL_BALANCE\n{SALDO_INICIAL_EXTRATO};0;0;0\n\n"
+        relatorios[key] = prefixo + '\n'.join([CABECALHOS[key], *rows]) + '\n'
+    return {'descricao': descricao, 'relatorios': relatorios}
+
+
+CASOS = {
+    # 30000000001: extrato mostra uma única linha com payment - refund já aplicado
+    # 30000000002: mesmo cenário, mas o extrato mostra só o payment (não consolidado)
+    'reembolso_consolidado': montar_caso(
+        "Reembolso parcial consolidado no valor da liberação (ID único no extrato)",
+        dinheiro=[
+            "30000000001,SETTLEMENT,2025-03-03,2025-03-10,100.0,88.0,0.0,checkout,EXT1,4000000001,",
+            "30000000002,SETTLEMENT,2025-03-03,2025-03-10,100.0,88.0,0.0,checkout,EXT2,4000000002,",
+        ],
+        vendas=[
+            "30000000001;4000000001;100.0;0.0;Produto A;2025-03-03T10:00:00.000-03:00;2025-03-10;delivered",
+            "30000000002;4000000002;100.0;0.0;Produto B;2025-03-03T10:00:00.000-03:00;2025-03-10;delivered",
+        ],
+        pos_venda=[
+            "30000000001;Produto com defeito;2025-03-03;2025-03-08",
+            "30000000002;Arrependimento;2025-03-03;2025-03-08",
+        ],
+        liberacoes=[
+            "2025-03-10,30000000001,EXT1,release,payment,88.0,0,100.0,-12.0,0,0,",
+            "2025-03-10,30000000001,EXT1,release,refund,0,44.0,-50.0,6.0,0,0,",
+            "2025-03-10,30000000002,EXT2,release,payment,88.0,0,100.0,-12.0,0,0,",
+            "2025-03-10,30000000002,EXT2,release,refund,0,44.0,-50.0,6.0,0,0,",
+        ],
+        extrato=[
+            "10-03-2025;Liberação de dinheiro;30000000001;44,00;1.044,00",
+            "10-03-2025;Liberação de dinheiro;30000000002;88,00;1.132,00",
+        ],
+    ),
+
+    # 30000000011: liberação + reembolso (refund) em linhas separadas
+    # 30000000012: liberação + débito por dívida de reclamação (mediation)
+    # 30000000013: liberação + dinheiro retido e desbloqueado (reserve_for_dispute)
+    # 30000000014: liberação + liberação cancelada (chargeback)
+    'id_multiplo_extrato': montar_caso(
+        "Mesmo ID em várias linhas do extrato (detalhamento assertivo)",
+        dinheiro=[
+            "30000000011,SETTLEMENT,2025-03-04,2025-03-11,150.0,132.0,0.0,checkout,EXT11,4000000011,",
+            "30000000012,SETTLEMENT,2025-03-04,2025-03-11,80.0,70.4,0.0,checkout,EXT12,4000000012,",
+            "30000000013,SETTLEMENT,2025-03-04,2025-03-11,60.0,52.8,0.0,checkout,EXT13,,",
+            "30000000014,SETTLEMENT,2025-03-04,2025-03-11,300.0,264.0,0.0,point,EXT14,,",
+        ],
+        vendas=[
+            "30000000011;4000000011;150.0;0.0;Produto C;2025-03-04T09:30:00.000-03:00;2025-03-11;delivered",
+            "30000000012;4000000012;80.0;0.0;Produto D;2025-03-04T09:30:00.000-03:00;2025-03-11;delivered",
+        ],
+        pos_venda=[
+            "30000000011;Produto diferente do anunciado;2025-03-04;2025-03-12",
+            "30000000012;Não recebeu o produto;2025-03-04;2025-03-12",
+        ],
+        liberacoes=[
+            "2025-03-11,30000000011,EXT11,release,payment,132.0,0,150.0,-18.0,0,0,",
+            "2025-03-12,30000000011,EXT11,release,refund,0,132.0,-150.0,18.0,0,0,",
+            "2025-03-11,30000000012,EXT12,release,payment,70.4,0,80.0,-9.6,0,0,",
+            "2025-03-12,30000000012,EXT12,release,mediation,0,80.0,-80.0,0,0,0,",
+            "2025-03-11,30000000013,EXT13,release,payment,52.8,0,60.0,-7.2,0,0,",
+            "2025-03-12,30000000013,EXT13,release,reserve_for_dispute,0,52.8,-52.8,0,0,0,",
+            "2025-03-13,30000000013,EXT13,release,reserve_for_dispute,52.8,0,52.8,0,0,0,",
+            "2025-03-11,30000000014,EXT14,release,payment,264.0,0,300.0,-36.0,0,0,",
+            "2025-03-13,30000000014,EXT14,release,chargeback,0,264.0,-264.0,0,0,0,",
+        ],
+        extrato=[
+            "11-03-2025;Liberação de dinheiro;30000000011;132,00;1.132,00",
+            "11-03-2025;Liberação de dinheiro;30000000012;70,40;1.202,40",
+            "11-03-2025;Liberação de dinheiro;30000000013;52,80;1.255,20",
+            "11-03-2025;Liberação de dinheiro;30000000014;264,00;1.519,20",
+            "12-03-2025;Reembolso Reclamações e devoluções;30000000011;-132,00;1.387,20",
+            "12-03-2025;Débito por dívida Reclamações no Mercado Livre;30000000012;-80,00;1.307,20",
+            "12-03-2025;Dinheiro retido por reclamação;30000000013;-52,80;1.254,40",
+            "13-03-2025;Dinheiro retido por reclamação;30000000013;52,80;1.307,20",
+            "13-03-2025;Liberação de dinheiro cancelada;30000000014;-264,00;1.043,20",
+        ],
+    ),
+
+    # 30000000021: vendedor paga frete, frete no LIBERAÇÕES (já descontado do líquido)
+    # 30000000022: vendedor paga frete, frete só no VENDAS (debitado à parte no extrato)
+    # 30000000023: comprador paga frete (repasse no SHIPPING_FEE, receita = produto)
+    'frete_vendedor': montar_caso(
+        "Frete pago pelo vendedor (LIBERAÇÕES vs VENDAS) e pelo comprador",
+        dinheiro=[
+            "30000000021,SETTLEMENT,2025-03-05,2025-03-12,200.0,156.0,20.0,checkout,EXT21,4000000021,",
+            "30000000022,SETTLEMENT,2025-03-05,2025-03-12,200.0,176.0,0.0,checkout,EXT22,4000000022,",
+            "30000000023,SETTLEMENT,2025-03-05,2025-03-12,115.0,86.2,15.0,checkout,EXT23,4000000023,",
+        ],
+        vendas=[
+            "30000000021;4000000021;200.0;-20.0;Produto E;2025-03-05T14:00:00.000-03:00;2025-03-12;delivered",
+            "30000000022;4000000022;200.0;-20.0;Produto F;2025-03-05T14:00:00.000-03:00;2025-03-12;delivered",
+            "30000000023;4000000023;100.0;0.0;Produto G;2025-03-05T14:00:00.000-03:00;2025-03-12;delivered",
+        ],
+        liberacoes=[
+            "2025-03-12,30000000021,EXT21,release,payment,156.0,0,200.0,-24.0,0,-20.0,",
+            "2025-03-12,30000000022,EXT22,release,payment,176.0,0,200.0,-24.0,0,0,",
+            "2025-03-12,30000000023,EXT23,release,payment,86.2,0,115.0,-13.8,0,-15.0,",
+        ],
+        extrato=[
+            "12-03-2025;Liberação de dinheiro;30000000021;156,00;1.156,00",
+            "12-03-2025;Liberação de dinheiro;30000000022;156,00;1.312,00",
+            "12-03-2025;Liberação de dinheiro;30000000023;86,20;1.398,20",
+        ],
+    ),
+
+    # Contas internas (netparts/jonathan/netair) vão para transferências; PIX recebido
+    # de terceiros vira receita; ';' no nome gera campo extra na linha do extrato
+    'pix_contas_internas': montar_caso(
+        "PIX entre contas internas, PIX recebido de cliente e pagamentos avulsos",
+        extrato=[
+            "14-03-2025;Transferência Pix recebida NETPARTS COMERCIO LTDA;50000000001;5.000,00;6.000,00",
+            "14-03-2025;Transferência Pix enviada JONATHAN SILVA;50000000002;-1.500,00;4.500,00",
+            "14-03-2025;Transferência Pix recebida NETAIR; LTDA;50000000003;700,00;5.200,00",
+            "14-03-2025;Transferência Pix recebida MARIA CLIENTE;50000000004;350,00;5.550,00",
+            "14-03-2025;Transferência Pix enviada FORNECEDOR; PECAS LTDA;50000000005;-820,00;4.730,00",
+            "14-03-2025;Pagamento de contas;50000000006;-230,00;4.500,00",
+            "14-03-2025;Pagamento com Código QR Pix CLIENTE;50000000007;99,90;4.599,90",
+        ],
+    ),
+
+    # 30000000031: extrato diverge do LIBERAÇÕES (DIVERGENCIAS_FALLBACK)
+    # 30000000032: liberação sem registro no LIBERAÇÕES (valor direto do extrato)
+    'divergencias': montar_caso(
+        "Extrato divergente do LIBERAÇÕES e liberação sem LIBERAÇÕES",
+        dinheiro=[
+            "30000000031,SETTLEMENT,2025-03-06,2025-03-13,120.0,105.6,0.0,checkout,EXT31,4000000031,",
+            "30000000032,SETTLEMENT,2025-03-06,2025-03-13,90.0,79.2,0.0,checkout,EXT32,4000000032,",
+        ],
+        vendas=[
+            "30000000031;4000000031;120.0;0.0;Produto H;2025-03-06T08:00:00.000-03:00;2025-03-13;delivered",
+            "30000000032;4000000032;90.0;0.0;Produto I;2025-03-06T08:00:00.000-03:00;2025-03-13;delivered",
+        ],
+        liberacoes=[
+            "2025-03-13,30000000031,EXT31,release,payment,105.6,0,120.0,-14.4,0,0,",
+        ],
+        extrato=[
+            "13-03-2025;Liberação de dinheiro;30000000031;101,10;1.101,10",
+            "13-03-2025;Liberação de dinheiro;30000000032;79,20;1.180,30",
+        ],
+    ),
+
+    # Operações ainda não liberadas: venda, pagamento (SETTLEMENT negativo) e chargeback
+    'previsoes': montar_caso(
+        "Previsões: venda a liberar, pagamento via MP e chargeback pendente",
+        dinheiro=[
+            "30000000041,SETTLEMENT,2025-03-20,2025-04-20,250.0,205.0,15.0,checkout,EXT41,4000000041,",
+            "30000000042,SETTLEMENT,2025-03-20,2025-03-20,-75.5,-75.5,0.0,checkout,EXT42,,",
+            "30000000043,CHARGEBACK,2025-03-21,2025-04-21,180.0,-180.0,0.0,point,EXT43,,",
+            "30000000044,PAYOUT,2025-03-21,2025-03-21,-500.0,-500.0,0.0,checkout,EXT44,,",
+        ],
+        vendas=[
+            "30000000041;4000000041;250.0;-15.0;Produto J;2025-03-20T16:45:00.000-03:00;2025-04-20;shipped",
+        ],
+    ),
+}
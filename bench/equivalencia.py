@@ -0,0 +1,218 @@
+"""
+Harness de equivalência entre motores de conciliação.
+
+Executa a implementação de referência (api.processar_conciliacao) e um motor
+candidato (vetorizado, particionado, incremental...) sobre as MESMAS entradas e
+compara os livros de saída lançamento a lançamento, agrupados por ID de operação.
+Qualquer diferença é reportada com o ID, o livro e os lançamentos que só existem
+em um dos lados.
+
+Canonicalização: cada lançamento vira uma tupla ordenada de (campo, valor), com
+números arredondados a 2 casas; os lançamentos de um ID são comparados como
+multiconjunto (a ordem entre IDs e dentro do mesmo ID não importa).
+
+Entradas:
+- o corpus de casos difíceis (casos_equivalencia.CASOS) - sempre
+- relatórios sintéticos (--operacoes, via gerar_relatorios.py)
+- diretórios com relatórios reais (--dados DIR, com dinheiro/vendas/pos_venda/
+  liberacoes/extrato em .csv ou .zip)
+
+O candidato é qualquer função com a assinatura de processar_conciliacao
+(`arquivos, centro_custo`) que retorne os mesmos livros:
+
+    python bench/equivalencia.py --candidato meu_modulo:processar_conciliacao_vetorizado
+    python bench/equivalencia.py --candidato api:processar_conciliacao --operacoes 20000
+
+Os motores de junção de api.processar_conciliacao (MOTORES_CONCILIACAO) são
+comparados com --motor-candidato:
+
+    python bench/equivalencia.py --motor-candidato duckdb --operacoes 20000
+
+Sem --candidato, compara a referência com ela mesma (verifica determinismo).
+Sai com código 1 se houver qualquer diferença.
+"""
+
+import argparse
+import copy
+import functools
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import warnings
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Tuple
+
+DIR_BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(DIR_BENCH))
+sys.path.insert(0, DIR_BENCH)
+
+import api  # noqa: E402
+from benchmark import preparar_dados  # noqa: E402
+from casos_equivalencia import CASOS  # noqa: E402
+
+# Livros comparados e o campo com o ID de operação em cada um
+LIVROS_EQUIVALENCIA = {
+    'confirmados': 'ID Operação',
+    'previsao': 'ID Operação',
+    'pagamentos': 'ID Operação',
+    'transferencias': 'ID Operação',
+    'nao_classificados': 'ID Operação',
+    'divergencias_fallback': 'ID',
+}
+
+MAX_DIFERENCAS_EXIBIDAS = 20
+
+
+def carregar_motor(especificacao: str) -> Callable:
+    """'modulo:funcao' -> função (o diretório atual e bench/ estão no path)"""
+    modulo, _, funcao = especificacao.partition(':')
+    if not funcao:
+        raise SystemExit(f"Motor inválido '{especificacao}' - use modulo:funcao")
+    sys.path.insert(0, os.getcwd())
+    return getattr(importlib.import_module(modulo), funcao)
+
+
+def canonicalizar_valor(valor: Any) -> Any:
+    if isinstance(valor, float):
+        return round(valor, 2) + 0.0  # -0.0 -> 0.0
+    if valor is None:
+        return ''
+    if isinstance(valor, (int, str, bool)):
+        return valor
+    return str(valor)
+
+
+def canonicalizar(resultado: Dict[str, Any]) -> Dict[str, Dict[str, Counter]]:
+    """{livro: {op_id: Counter(lançamentos canônicos)}}"""
+    livros = {}
+    for livro, campo_id in LIVROS_EQUIVALENCIA.items():
+        por_id: Dict[str, Counter] = defaultdict(Counter)
+        for lancamento in resultado.get(livro, []):
+            chave = tuple(sorted((campo, canonicalizar_valor(valor)) for campo, valor in lancamento.items()))
+            por_id[str(lancamento.get(campo_id, ''))][chave] += 1
+        livros[livro] = por_id
+    return livros
+
+
+def comparar(referencia: Dict[str, Any], candidato: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Lista de diferenças por (livro, op_id), com os lançamentos exclusivos de cada lado"""
+    canon_ref, canon_cand = canonicalizar(referencia), canonicalizar(candidato)
+    diferencas = []
+    for livro in LIVROS_EQUIVALENCIA:
+        ref, cand = canon_ref[livro], canon_cand[livro]
+        for op_id in sorted(set(ref) | set(cand)):
+            so_referencia = ref.get(op_id, Counter()) - cand.get(op_id, Counter())
+            so_candidato = cand.get(op_id, Counter()) - ref.get(op_id, Counter())
+            if so_referencia or so_candidato:
+                diferencas.append({
+                    'livro': livro,
+                    'op_id': op_id,
+                    'so_referencia': [dict(l) for l in so_referencia.elements()],
+                    'so_candidato': [dict(l) for l in so_candidato.elements()],
+                })
+    return diferencas
+
+
+def executar_motores(caminhos: Dict[str, str], referencia: Callable, candidato: Callable,
+                     centro_custo: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Lê os relatórios uma vez e roda cada motor sobre uma cópia própria dos DataFrames"""
+    arquivos, _ = api.carregar_arquivos(caminhos)
+    resultado_ref = referencia(copy.deepcopy(arquivos), centro_custo=centro_custo)
+    resultado_cand = candidato(copy.deepcopy(arquivos), centro_custo=centro_custo)
+    return resultado_ref, resultado_cand
+
+
+def entradas_do_corpus(temp_dir: str) -> List[Tuple[str, Dict[str, str]]]:
+    entradas = []
+    for nome, caso in CASOS.items():
+        diretorio = os.path.join(temp_dir, nome)
+        os.makedirs(diretorio)
+        caminhos = {}
+        for key, conteudo in caso['relatorios'].items():
+            caminhos[key] = os.path.join(diretorio, f'{key}.csv')
+            with open(caminhos[key], 'w', encoding='utf-8') as f:
+                f.write(conteudo)
+        entradas.append((f'corpus/{nome}', caminhos))
+    return entradas
+
+
+def entradas_de_diretorio(diretorio: str) -> Tuple[str, Dict[str, str]]:
+    caminhos = {}
+    for key in ('dinheiro', 'vendas', 'pos_venda', 'liberacoes', 'extrato', 'retirada'):
+        for extensao in ('.csv', '.zip'):
+            caminho = os.path.join(diretorio, key + extensao)
+            if os.path.exists(caminho):
+                caminhos[key] = caminho
+    faltando = {'dinheiro', 'vendas', 'pos_venda', 'liberacoes', 'extrato'} - set(caminhos)
+    if faltando:
+        raise SystemExit(f"{diretorio}: relatórios ausentes: {', '.join(sorted(faltando))}")
+    return diretorio, caminhos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Equivalência entre motores de conciliação")
+    parser.add_argument('--referencia', default='api:processar_conciliacao')
+    parser.add_argument('--candidato', default='api:processar_conciliacao')
+    parser.add_argument('--motor-candidato', default=None,
+                        help="Passa motor=<nome> ao candidato (ex: duckdb)")
+    parser.add_argument('--operacoes', type=int, nargs='*', default=[],
+                        help="Também comparar em relatórios sintéticos com estes volumes")
+    parser.add_argument('--dados', nargs='*', default=[],
+                        help="Também comparar nos relatórios destes diretórios")
+    parser.add_argument('--dados-sinteticos', default=os.path.join(DIR_BENCH, 'dados'))
+    parser.add_argument('--centro-custo', default='NETAIR')
+    parser.add_argument('--saida', default=None, help="Grava o relatório completo de diferenças (JSON)")
+    args = parser.parse_args(argv)
+
+    api.logger.setLevel('ERROR')
+    warnings.filterwarnings('ignore')
+    referencia = carregar_motor(args.referencia)
+    candidato = carregar_motor(args.candidato)
+    if args.motor_candidato:
+        candidato = functools.partial(candidato, motor=args.motor_candidato)
+
+    temp_dir = tempfile.mkdtemp()
+    relatorio = {'referencia': args.referencia, 'candidato': args.candidato,
+                 'motor_candidato': args.motor_candidato, 'entradas': []}
+    try:
+        entradas = entradas_do_corpus(temp_dir)
+        for operacoes in args.operacoes:
+            manifesto = preparar_dados(operacoes, 1, 0, args.dados_sinteticos)
+            entradas.append((f'sintetico/{operacoes}', manifesto['caminhos']))
+        entradas.extend(entradas_de_diretorio(diretorio) for diretorio in args.dados)
+
+        for nome, caminhos in entradas:
+            resultado_ref, resultado_cand = executar_motores(caminhos, referencia, candidato, args.centro_custo)
+            diferencas = comparar(resultado_ref, resultado_cand)
+            lancamentos = sum(len(resultado_ref.get(livro, [])) for livro in LIVROS_EQUIVALENCIA)
+            relatorio['entradas'].append({'entrada': nome, 'lancamentos_referencia': lancamentos,
+                                          'diferencas': diferencas})
+
+            ids = {(d['livro'], d['op_id']) for d in diferencas}
+            print(f"{'OK ' if not diferencas else 'DIF'} {nome}: {lancamentos} lançamentos, "
+                  f"{len(ids)} ID(s) divergente(s)")
+            for diferenca in diferencas[:MAX_DIFERENCAS_EXIBIDAS]:
+                print(f"      [{diferenca['livro']}] {diferenca['op_id']}")
+                for lado in ('so_referencia', 'so_candidato'):
+                    for lancamento in diferenca[lado]:
+                        valores = ', '.join(f"{campo}={valor}" for campo, valor in lancamento.items()
+                                            if campo in ('Categoria', 'Valor', 'Observações', 'Data de Competência',
+                                                         'Valor_Extrato', 'Valor_Calculado'))
+                        print(f"        {'-' if lado == 'so_referencia' else '+'} {valores}")
+            if len(diferencas) > MAX_DIFERENCAS_EXIBIDAS:
+                print(f"      ... mais {len(diferencas) - MAX_DIFERENCAS_EXIBIDAS} (use --saida)")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False, default=str)
+
+    return 1 if any(entrada['diferencas'] for entrada in relatorio['entradas']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
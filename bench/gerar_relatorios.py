@@ -0,0 +1,284 @@
+"""
+Gerador de relatórios sintéticos do Mercado Pago para benchmarks do conciliador.
+
+Produz os 5 relatórios obrigatórios (dinheiro, vendas, pos_venda, liberacoes e
+extrato) nos layouts de colunas exatos do Mercado Pago, coerentes entre si:
+cada operação liberada aparece no DINHEIRO, no LIBERAÇÕES e no EXTRATO com os
+mesmos valores (bruto, tarifa, financiamento, frete e líquido); devoluções,
+chargebacks e disputas geram os registros correspondentes em todos os relatórios.
+
+Uso:
+    python bench/gerar_relatorios.py --operacoes 100000 --destino bench/dados/100k
+    python bench/gerar_relatorios.py --operacoes 1000000 --zip-partes 4 --seed 7
+
+Volume: de 10 mil a 5 milhões de operações. A escrita é em streaming (linha a
+linha), então a memória não cresce com o volume.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zipfile
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+
+# Proporções padrão (fração das operações)
+TAXAS_PADRAO = {
+    'pendentes': 0.15,     # Ainda não liberadas - só no DINHEIRO (viram PREVISÃO)
+    'reembolso': 0.08,     # Devolução total ou parcial (refund + pos_venda)
+    'chargeback': 0.01,    # Liberação cancelada (chargeback no LIBERAÇÕES)
+    'multiplo': 0.05,      # Dinheiro retido e desbloqueado (mesmo ID 3x no EXTRATO)
+    'malformadas': 0.002,  # Linhas quebradas (separador extra, campos faltando, JSON sem escape)
+    'avulsas': 0.08,       # Pix, pagamento de contas e lançamentos sem operação de venda
+}
+
+CABECALHOS = {
+    'dinheiro': (
+        "SOURCE_ID,TRANSACTION_TYPE,TRANSACTION_DATE,MONEY_RELEASE_DATE,TRANSACTION_AMOUNT,"
+        "REAL_AMOUNT,SHIPPING_FEE_AMOUNT,SUB_UNIT,EXTERNAL_REFERENCE,ORDER_ID,METADATA"
+    ),
+    'vendas': (
+        "Número da transação do Mercado Pago (operation_id);Número da venda no Mercado Livre (order_id);"
+        "Valor do produto (transaction_amount);Frete (shipping_cost);Descrição da operação (reason);"
+        "Data da compra (date_created);Data de liberação do dinheiro (date_released);Status do envio (shipment_status)"
+    ),
+    'pos_venda': (
+        "ID da transação (operation_id);Motivo detalhado (reason_detail);"
+        "Data de criação da transação (operation_date_created);Data de criação (date_created)"
+    ),
+    'liberacoes': (
+        "DATE,SOURCE_ID,EXTERNAL_REFERENCE,RECORD_TYPE,DESCRIPTION,NET_CREDIT_AMOUNT,NET_DEBIT_AMOUNT,"
+        "GROSS_AMOUNT,MP_FEE_AMOUNT,FINANCING_FEE_AMOUNT,SHIPPING_FEE_AMOUNT,METADATA"
+    ),
+    'extrato': "RELEASE_DATE;TRANSACTION_TYPE;REFERENCE_ID;TRANSACTION_NET_AMOUNT;PARTIAL_BALANCE",
+}
+
+MOTIVOS_DEVOLUCAO = ['Produto com defeito', 'Arrependimento', 'Produto diferente do anunciado',
+                     'Não recebeu o produto']
+
+AVULSAS = [
+    ('Transferência Pix enviada FORNECEDOR; LTDA', -1),  # ';' no nome - linha com campo extra
+    ('Transferência Pix enviada FORNECEDOR', -1),
+    ('Transferência Pix recebida CLIENTE', 1),
+    ('Pagamento de contas', -1),
+    ('Débito por dívida Envio do Mercado Livre', -1),
+    ('Entrada de dinheiro', 1),
+    ('Bônus por envio', 1),
+]
+
+DATA_INICIAL = date(2025, 1, 1)
+ID_OPERACAO_BASE = 10_000_000_000
+ID_PEDIDO_BASE = 2_000_000_000
+ID_AVULSO_BASE = 90_000_000_000
+
+
+def formatar_br(valor: float) -> str:
+    """Formato numérico do extrato: 1.234,56"""
+    texto = f"{valor:,.2f}"
+    return texto.replace(',', 'X').replace('.', ',').replace('X', '.')
+
+
+def gerar_relatorios(destino: str, operacoes: int, seed: int = 1, dias: int = 90,
+                     zip_partes: int = 0, taxas: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """
+    Gera os relatórios sintéticos em `destino`.
+
+    Args:
+        destino: Diretório de saída (criado se não existir)
+        operacoes: Número de operações de venda
+        seed: Semente do gerador (mesma seed = mesmos arquivos)
+        dias: Período coberto pelas operações, a partir de DATA_INICIAL
+        zip_partes: Se > 1, DINHEIRO e LIBERAÇÕES saem em ZIP com este número de
+            CSVs (como o Mercado Pago entrega períodos longos)
+        taxas: Sobrescreve proporções de TAXAS_PADRAO
+
+    Returns:
+        Manifesto: {'caminhos': {relatorio: caminho}, 'linhas': {relatorio: n}, parâmetros...}
+        (também gravado em destino/manifesto.json)
+    """
+    taxas = {**TAXAS_PADRAO, **(taxas or {})}
+    rnd = random.Random(seed)
+    os.makedirs(destino, exist_ok=True)
+    inicio = time.perf_counter()
+
+    caminhos = {key: os.path.join(destino, f'{key}.csv') for key in CABECALHOS}
+    arquivos = {key: open(path, 'w', encoding='utf-8', newline='') for key, path in caminhos.items()}
+    linhas = dict.fromkeys(CABECALHOS, 0)
+    saldo_inicial = 10_000.0
+    saldo = saldo_inicial
+    fim_periodo = DATA_INICIAL + timedelta(days=dias)
+
+    def escrever(key: str, linha: str):
+        arquivos[key].write(linha)
+        arquivos[key].write('\n')
+        linhas[key] += 1
+
+    def extrato(dia: date, tipo: str, ref: str, valor: float):
+        nonlocal saldo
+        saldo = round(saldo + valor, 2)
+        escrever('extrato', f"{dia:%d-%m-%Y};{tipo};{ref};{formatar_br(valor)};{formatar_br(saldo)}")
+
+    def malformada() -> bool:
+        return rnd.random() < taxas['malformadas']
+
+    try:
+        for key, cabecalho in CABECALHOS.items():
+            if key == 'extrato':
+                arquivos[key].write("INITIAL_BALANCE;CREDITS;DEBITS;FINAL_BALANCE\n"
+                                    f"{formatar_br(saldo_inicial)};0;0;0\n\n")
+            arquivos[key].write(cabecalho + '\n')
+
+        for i in range(operacoes):
+            op = str(ID_OPERACAO_BASE + i)
+            dia = DATA_INICIAL + timedelta(days=i * dias // operacoes)
+            ext_ref = f"EXT{i}"
+
+            # Origem: Mercado Livre (com pedido), loja própria ou balcão (point)
+            sorteio_origem = rnd.random()
+            pedido = str(ID_PEDIDO_BASE + i) if sorteio_origem < 0.7 else ''
+            sub_unit = 'point' if sorteio_origem > 0.9 else 'checkout'
+
+            bruto = round(rnd.uniform(20, 800), 2)
+            tarifa = -round(bruto * rnd.choice([0.11, 0.12, 0.16, 0.19]), 2)
+            financiamento = -round(bruto * 0.03, 2) if rnd.random() < 0.2 else 0.0
+            frete_vendedor = pedido != '' and rnd.random() < 0.4
+            frete = -round(rnd.uniform(10, 45), 2) if frete_vendedor else 0.0
+            liquido = round(bruto + tarifa + financiamento + frete, 2)
+
+            if pedido:
+                linha_venda = (f"{op};{pedido};{bruto};{frete};Produto {i};"
+                               f"{dia.isoformat()}T10:00:00.000-03:00;{dia.isoformat()};delivered")
+                if malformada():
+                    linha_venda += ";campo;extra"  # Descartada pelo leitor (on_bad_lines='skip')
+                escrever('vendas', linha_venda)
+
+            metadata = '"{"origem":"bench"}"' if malformada() else ''  # JSON sem escape (clean_json)
+
+            # Pendentes: só no DINHEIRO, com liberação depois do período
+            if rnd.random() < taxas['pendentes']:
+                liberacao = fim_periodo + timedelta(days=rnd.randint(1, 30))
+                tipo = 'CHARGEBACK' if rnd.random() < taxas['chargeback'] * 5 else 'SETTLEMENT'
+                escrever('dinheiro', f"{op},{tipo},{dia.isoformat()},{liberacao.isoformat()},{bruto},"
+                                     f"{liquido},{abs(frete)},{sub_unit},{ext_ref},{pedido},{metadata}")
+                continue
+
+            escrever('dinheiro', f"{op},SETTLEMENT,{dia.isoformat()},{dia.isoformat()},{bruto},"
+                                 f"{liquido},{abs(frete)},{sub_unit},{ext_ref},{pedido},{metadata}")
+            escrever('liberacoes', f"{dia.isoformat()},{op},{ext_ref},release,payment,"
+                                   f"{max(liquido, 0)},{max(-liquido, 0)},{bruto},{tarifa},"
+                                   f"{financiamento},{frete},{metadata}")
+            extrato(dia, 'Liberação de dinheiro', op, liquido)
+
+            sorteio = rnd.random()
+            if sorteio < taxas['reembolso']:
+                # Devolução total ou parcial, com estorno proporcional da tarifa
+                valor = round(bruto * rnd.choice([1, 0.5]), 2)
+                estorno_tarifa = round(-tarifa * valor / bruto, 2)
+                liquido_refund = round(-valor + estorno_tarifa, 2)
+                escrever('pos_venda', f"{op};{rnd.choice(MOTIVOS_DEVOLUCAO)};{dia.isoformat()};{dia.isoformat()}")
+                if rnd.random() < 0.5:
+                    escrever('liberacoes', f"{dia.isoformat()},{op},{ext_ref},release,refund,"
+                                           f"{max(liquido_refund, 0)},{max(-liquido_refund, 0)},{-valor},"
+                                           f"{estorno_tarifa},0,0,")
+                    extrato(dia, 'Reembolso Reclamações e devoluções', op, liquido_refund)
+                else:
+                    # Reclamação resolvida como dívida (mediation) em vez de reembolso
+                    escrever('liberacoes', f"{dia.isoformat()},{op},{ext_ref},release,mediation,"
+                                           f"0,{valor},{-valor},0,0,0,")
+                    extrato(dia, 'Débito por dívida Reclamações no Mercado Livre', op, -valor)
+            elif sorteio < taxas['reembolso'] + taxas['chargeback']:
+                escrever('liberacoes', f"{dia.isoformat()},{op},{ext_ref},release,chargeback,"
+                                       f"0,{liquido},{-liquido},0,0,0,")
+                extrato(dia, 'Liberação de dinheiro cancelada', op, -liquido)
+            elif sorteio < taxas['reembolso'] + taxas['chargeback'] + taxas['multiplo']:
+                # Disputa: bloqueio e desbloqueio do mesmo valor - o ID aparece 3x no extrato
+                retido = round(liquido * rnd.choice([1, 0.5]), 2)
+                escrever('liberacoes', f"{dia.isoformat()},{op},{ext_ref},release,reserve_for_dispute,"
+                                       f"0,{retido},{-retido},0,0,0,")
+                extrato(dia, 'Dinheiro retido por reclamação', op, -retido)
+                escrever('liberacoes', f"{dia.isoformat()},{op},{ext_ref},release,reserve_for_dispute,"
+                                       f"{retido},0,{retido},0,0,0,")
+                extrato(dia, 'Dinheiro retido por reclamação', op, retido)
+
+            # Lançamentos avulsos (sem venda) e linhas quebradas do extrato
+            if rnd.random() < taxas['avulsas']:
+                tipo, sinal = rnd.choice(AVULSAS)
+                extrato(dia, tipo, str(ID_AVULSO_BASE + i), sinal * round(rnd.uniform(10, 2000), 2))
+            if malformada():
+                escrever('extrato', f"{dia:%d-%m-%Y};Linha truncada")
+    finally:
+        for f in arquivos.values():
+            f.close()
+
+    if zip_partes > 1:
+        for key in ('dinheiro', 'liberacoes'):
+            caminhos[key] = dividir_em_zip(caminhos[key], zip_partes)
+
+    manifesto = {
+        'operacoes': operacoes,
+        'seed': seed,
+        'dias': dias,
+        'zip_partes': zip_partes,
+        'taxas': taxas,
+        'linhas': linhas,
+        'caminhos': caminhos,
+        'bytes': {key: os.path.getsize(path) for key, path in caminhos.items()},
+        'segundos': round(time.perf_counter() - inicio, 3),
+    }
+    with open(os.path.join(destino, 'manifesto.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, indent=2, ensure_ascii=False)
+    return manifesto
+
+
+def dividir_em_zip(caminho_csv: str, partes: int) -> str:
+    """Divide o CSV em `partes` CSVs (cada um com o cabeçalho) dentro de um ZIP e remove o original"""
+    with open(caminho_csv, 'r', encoding='utf-8') as f:
+        total = sum(1 for _ in f) - 1
+    por_parte = max(1, -(-total // partes))
+    caminho_zip = caminho_csv[:-len('.csv')] + '.zip'
+    nome = os.path.basename(caminho_csv)[:-len('.csv')]
+
+    with open(caminho_csv, 'r', encoding='utf-8') as f, \
+            zipfile.ZipFile(caminho_zip, 'w', zipfile.ZIP_DEFLATED) as zf:
+        cabecalho = f.readline()
+        parte = None
+        for n, linha in enumerate(f):
+            if n % por_parte == 0:
+                if parte:
+                    parte.close()
+                parte = zf.open(f'{nome}_{n // por_parte + 1:02d}.csv', 'w')
+                parte.write(cabecalho.encode('utf-8'))
+            parte.write(linha.encode('utf-8'))
+        if parte:
+            parte.close()
+
+    os.remove(caminho_csv)
+    return caminho_zip
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera relatórios sintéticos do Mercado Pago")
+    parser.add_argument('--operacoes', type=int, default=10_000,
+                        help="Número de operações de venda (10 mil a 5 milhões)")
+    parser.add_argument('--destino', default=None, help="Diretório de saída (padrão: bench/dados/<operacoes>)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dias', type=int, default=90, help="Período coberto, em dias")
+    parser.add_argument('--zip-partes', type=int, default=0,
+                        help="Entregar DINHEIRO e LIBERAÇÕES em ZIP com N CSVs")
+    for taxa, padrao in TAXAS_PADRAO.items():
+        parser.add_argument(f'--taxa-{taxa}', type=float, default=padrao)
+    args = parser.parse_args(argv)
+
+    destino = args.destino or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dados', str(args.operacoes))
+    taxas = {taxa: getattr(args, f'taxa_{taxa}') for taxa in TAXAS_PADRAO}
+    manifesto = gerar_relatorios(destino, args.operacoes, seed=args.seed, dias=args.dias,
+                                 zip_partes=args.zip_partes, taxas=taxas)
+    print(json.dumps({'destino': destino, 'linhas': manifesto['linhas'], 'segundos': manifesto['segundos']},
+                     ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+Benchmark de memória do pipeline por etapa, com orçamentos (regressão de memória).
+
+Para cada volume, executa leitura (ler_csv / extrair_csvs_do_zip / ler_extrato),
+processar_conciliacao (por fase) e cada escritor gerar_* sobre relatórios sintéticos
+(gerar_relatorios.py) e registra, por etapa:
+
+- rss_pico_mb: pico de RSS do processo durante a etapa (VmHWM, zerado no início
+  de cada etapa via /proc/self/clear_refs) - é o que o limite do container vê
+- rss_delta_mb: rss_pico_mb menos o RSS no início da etapa
+- tracemalloc_pico_mb: pico de memória alocada pelo Python na etapa, acima do que
+  já estava alocado no início (medido numa segunda passada, com tracemalloc ativo,
+  para não inflar o RSS da primeira)
+
+Cada volume roda num processo novo (como um worker do pool), para que a memória
+retida de um volume não contamine o seguinte.
+
+Orçamentos (bench/orcamentos_memoria.json):
+- rss_pico_mb: limite de RSS de qualquer etapa, em qualquer volume (container)
+- etapas: {etapa: {"base_mb": x, "mb_por_100k": y}} - limite do tracemalloc_pico_mb
+  da etapa = base_mb + mb_por_100k * operacoes / 100.000
+
+Uso:
+    python bench/memoria.py --operacoes 10000 25000 50000
+    python bench/memoria.py --operacoes 50000 --orcamentos outro.json --saida /tmp/mem.json
+
+Sai com código 1 se algum orçamento for excedido.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List
+
+DIR_BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(DIR_BENCH))
+
+import api  # noqa: E402
+from benchmark import ambiente, preparar_dados  # noqa: E402
+
+MB = 1024 * 1024
+
+
+class MedidorMemoria:
+    """
+    Pico de RSS e de tracemalloc por etapa. Etapas podem ser aninhadas (ex: os
+    escritores dentro de 'arquivos'): antes de zerar os picos para uma etapa nova,
+    o pico até ali é repassado às etapas abertas. Etapas repetidas (o mesmo escritor
+    chamado para vários arquivos) ficam com o maior valor.
+    """
+
+    def __init__(self):
+        self.etapas: Dict[str, Dict[str, float]] = {}
+        self._abertas: List[Dict[str, Any]] = []
+
+    def _zerar_picos(self):
+        _, rss_pico = api.ler_memoria_processo()
+        alocado_pico = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+        for etapa in self._abertas:
+            etapa['rss_pico'] = max(etapa['rss_pico'], rss_pico)
+            etapa['alocado_pico'] = max(etapa['alocado_pico'], alocado_pico)
+        api.zerar_pico_memoria()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    def iniciar(self, nome: str):
+        self._zerar_picos()
+        rss, _ = api.ler_memoria_processo()
+        alocado = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        self._abertas.append({'nome': nome, 'rss_inicio': rss, 'rss_pico': rss,
+                              'alocado_inicio': alocado, 'alocado_pico': alocado})
+
+    def encerrar(self, nome: str):
+        self._zerar_picos()
+        indice = max(i for i, etapa in enumerate(self._abertas) if etapa['nome'] == nome)
+        etapa = self._abertas.pop(indice)
+        medida = {
+            'rss_pico_mb': etapa['rss_pico'] / MB,
+            'rss_delta_mb': (etapa['rss_pico'] - etapa['rss_inicio']) / MB,
+            'tracemalloc_pico_mb': (etapa['alocado_pico'] - etapa['alocado_inicio']) / MB,
+        }
+        anterior = self.etapas.get(nome)
+        if anterior:
+            medida = {chave: max(valor, anterior[chave]) for chave, valor in medida.items()}
+        self.etapas[nome] = medida
+
+    @contextmanager
+    def etapa(self, nome: str):
+        self.iniciar(nome)
+        try:
+            yield
+        finally:
+            self.encerrar(nome)
+
+
+class MedicaoMemoria(api.MedicaoConciliacao):
+    """MedicaoConciliacao que também mede memória nas fases e escritores que o pipeline já marca"""
+
+    def __init__(self, medidor: MedidorMemoria):
+        super().__init__()
+        self.medidor = medidor
+
+    def iniciar_fase(self, fase: str):
+        super().iniciar_fase(fase)
+        self.medidor.iniciar(fase)
+
+    def encerrar_fase(self):
+        if self._fase_atual is not None:
+            self.medidor.encerrar(self._fase_atual)
+        super().encerrar_fase()
+
+    @contextmanager
+    def fase(self, nome: str):
+        with self.medidor.etapa(nome), super().fase(nome):
+            yield
+
+    @contextmanager
+    def escrita(self, escritor: str, arquivo: str):
+        with self.medidor.etapa(escritor), super().escrita(escritor, arquivo):
+            yield
+
+
+def executar_etapas(caminhos: Dict[str, str]) -> Dict[str, Dict[str, float]]:
+    """Mesmo fluxo de api.executar_conciliacao, com cada etapa medida"""
+    medidor = MedidorMemoria()
+    medicao = MedicaoMemoria(medidor)
+    diagnosticos = api.DiagnosticosConciliacao()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        with medidor.etapa('total'):
+            medicao.iniciar_fase('leitura')
+            arquivos, saldo_inicial = api.carregar_arquivos(caminhos, medicao, diagnosticos)
+            medicao.encerrar_fase()
+
+            with medidor.etapa('processar_conciliacao'):
+                resultado = api.processar_conciliacao(arquivos, progresso=medicao.iniciar_fase,
+                                                      diagnosticos=diagnosticos)
+                medicao.encerrar_fase()
+
+            medicao.iniciar_fase('arquivos')
+            arquivos_gerados = api.gerar_arquivos_saida(resultado, saldo_inicial, temp_dir, medicao, diagnosticos)
+            medicao.iniciar_fase('zip')
+            api.compactar_arquivos(arquivos_gerados)
+            medicao.encerrar_fase()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return medidor.etapas
+
+
+def medir_volume_no_processo(caminhos: Dict[str, str]) -> Dict[str, Any]:
+    """Roda num processo novo: uma passada medindo RSS e outra com tracemalloc"""
+    api.logger.setLevel('ERROR')
+    warnings.filterwarnings('ignore')
+    for nome in ('numpy', 'pandas', 'openpyxl'):
+        api.importar_modulo(nome)
+    rss_inicial, _ = api.ler_memoria_processo()
+
+    etapas = executar_etapas(caminhos)
+
+    tracemalloc.start()
+    try:
+        etapas_alocacao = executar_etapas(caminhos)
+    finally:
+        tracemalloc.stop()
+
+    for nome, medida in etapas.items():
+        medida['tracemalloc_pico_mb'] = etapas_alocacao.get(nome, {}).get('tracemalloc_pico_mb', 0.0)
+        etapas[nome] = {chave: round(valor, 1) for chave, valor in medida.items()}
+    return {'rss_inicial_mb': round(rss_inicial / MB, 1), 'etapas': etapas}
+
+
+def verificar_orcamentos(operacoes: int, etapas: Dict[str, Dict[str, float]],
+                         orcamentos: Dict[str, Any]) -> List[str]:
+    """Lista as etapas acima do orçamento (vazia se tudo dentro)"""
+    violacoes = []
+    limite_rss = orcamentos.get('rss_pico_mb')
+    for nome, medida in etapas.items():
+        if limite_rss and medida['rss_pico_mb'] > limite_rss:
+            violacoes.append(f"{operacoes} operações, {nome}: RSS {medida['rss_pico_mb']:.1f} MB "
+                             f"> {limite_rss} MB")
+    for nome, orcamento in orcamentos.get('etapas', {}).items():
+        if nome not in etapas:
+            continue
+        limite = orcamento.get('base_mb', 0) + orcamento.get('mb_por_100k', 0) * operacoes / 100_000
+        alocado = etapas[nome]['tracemalloc_pico_mb']
+        if alocado > limite:
+            violacoes.append(f"{operacoes} operações, {nome}: alocado {alocado:.1f} MB > {limite:.1f} MB")
+    return violacoes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de memória por etapa do pipeline")
+    parser.add_argument('--operacoes', type=int, nargs='+', default=[10_000, 25_000],
+                        help="Volumes (número de operações) a medir, em ordem crescente")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--zip-partes', type=int, default=0)
+    parser.add_argument('--dados', default=os.path.join(DIR_BENCH, 'dados'))
+    parser.add_argument('--orcamentos', default=os.path.join(DIR_BENCH, 'orcamentos_memoria.json'))
+    parser.add_argument('--saida', default=os.path.join(DIR_BENCH, 'resultados', 'memoria.json'))
+    args = parser.parse_args(argv)
+
+    with open(args.orcamentos, encoding='utf-8') as f:
+        orcamentos = json.load(f)
+
+    resultado = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'ambiente': ambiente(),
+        'orcamentos': orcamentos,
+        'volumes': [],
+        'violacoes': [],
+    }
+    contexto = multiprocessing.get_context('spawn')
+    for operacoes in sorted(args.operacoes):
+        manifesto = preparar_dados(operacoes, args.seed, args.zip_partes, args.dados)
+        with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as executor:
+            medicao = executor.submit(medir_volume_no_processo, manifesto['caminhos']).result()
+
+        violacoes = verificar_orcamentos(operacoes, medicao['etapas'], orcamentos)
+        resultado['volumes'].append({'operacoes': operacoes, 'linhas_entrada': manifesto['linhas'],
+                                     'bytes_entrada': manifesto['bytes'], **medicao})
+        resultado['violacoes'].extend(violacoes)
+
+        print(f"{operacoes:>9} operações (RSS inicial {medicao['rss_inicial_mb']:.0f} MB):")
+        for nome, medida in medicao['etapas'].items():
+            print(f"    {nome:<28} RSS pico {medida['rss_pico_mb']:>7.1f} MB  "
+                  f"(+{medida['rss_delta_mb']:.1f})  alocado {medida['tracemalloc_pico_mb']:>7.1f} MB")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"Resultados em {args.saida}")
+
+    if resultado['violacoes']:
+        print("ORÇAMENTO DE MEMÓRIA EXCEDIDO:")
+        for violacao in resultado['violacoes']:
+            print(f"  - {violacao}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())